@@ -0,0 +1,9 @@
+"""Benchmarks for the wikivision data pipeline.
+
+Run all of the benchmarks on synthetic revision histories with::
+
+    $ python -m benchmarks --sizes 100 1000 10000 --output results.jsonl
+
+Each line of the output is a JSON record of a single timed run of a
+pipeline stage, so results from different commits can be compared.
+"""
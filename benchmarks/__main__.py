@@ -0,0 +1,53 @@
+import argparse
+import sys
+
+from benchmarks.pipeline import BENCHMARKS
+from benchmarks.runner import run_benchmarks, write_results
+from benchmarks.synthetic import make_history
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description="Benchmark the wikivision data pipeline.",
+    )
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10**2, 10**3, 10**4],
+                        help="Numbers of revisions in each synthetic history.")
+    parser.add_argument('--text-size', type=int, default=1000,
+                        help="Length of the wikitext of the first revision.")
+    parser.add_argument('--reversion-rate', type=float, default=0.1)
+    parser.add_argument('--repeat-rate', type=float, default=0.05)
+    parser.add_argument('--branchiness', type=float, default=0.05)
+    parser.add_argument('--benchmarks', nargs='+', choices=sorted(BENCHMARKS),
+                        default=sorted(BENCHMARKS),
+                        help="Names of the benchmarks to run.")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Number of timed runs of each benchmark.")
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help="Don't profile peak memory.")
+    parser.add_argument('--output', type=argparse.FileType('w'),
+                        default=sys.stdout,
+                        help="File to write JSON lines of results to.")
+    return parser
+
+
+def make_histories(args):
+    for n_revisions in args.sizes:
+        params = dict(
+            n_revisions=n_revisions,
+            text_size=args.text_size,
+            reversion_rate=args.reversion_rate,
+            repeat_rate=args.repeat_rate,
+            branchiness=args.branchiness,
+        )
+        yield params, make_history(**params)
+
+
+if __name__ == '__main__':
+    parser = get_parser()
+    args = parser.parse_args()
+    benchmarks = {name: BENCHMARKS[name] for name in args.benchmarks}
+    results = run_benchmarks(benchmarks, make_histories(args),
+                             repeat=args.repeat, memory=args.memory)
+    write_results(results, args.output)
@@ -0,0 +1,419 @@
+"""Benchmarks of each stage of the data pipeline.
+
+Each benchmark is a context manager that takes a synthetic revision
+history, as returned by `benchmarks.synthetic.make_history`, prepares
+the input to a stage of the pipeline, and yields a function that runs
+the stage. Anything created during setup is cleaned up on exit.
+"""
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+import graphviz
+import pandas as pd
+
+import wikivision
+
+
+@contextmanager
+def to_table(history):
+    slug = history.article_slug.iloc[0]
+    json_revisions = history.drop('article_slug', axis=1).rename(columns={
+        'rev_id': 'revid', 'parent_id': 'parentid', 'wikitext': '*',
+    }).to_dict('records')
+    yield lambda: wikivision.format_revisions(json_revisions, slug)
+
+
+@contextmanager
+def label_version(history):
+    revisions = wikivision.convert_timestamp_to_datetime(history)
+    yield lambda: wikivision.label_version(revisions)
+
+
+@contextmanager
+def drop_repeats(history):
+    revisions = wikivision.convert_timestamp_to_datetime(history)
+    revisions = wikivision.label_version(revisions)
+    yield lambda: wikivision.drop_repeats(revisions)
+
+
+@contextmanager
+def label_revision_type(history):
+    revisions = wikivision.convert_timestamp_to_datetime(history)
+    revisions = wikivision.label_version(revisions)
+    revisions = wikivision.drop_repeats(revisions)
+    yield lambda: wikivision.label_revision_type(revisions)
+
+
+@contextmanager
+def tidy_article_revisions(history):
+    yield lambda: wikivision.tidy_article_revisions(history)
+
+
+@contextmanager
+def label_reversions(history):
+    revisions = wikivision.tidy_article_revisions(history)
+    yield lambda: wikivision.label_reversions(revisions)
+
+
+@contextmanager
+def tidy_many_article_revisions(history):
+    corpus = _split_into_articles(history)
+    yield lambda: wikivision.tidy_many_article_revisions(corpus)
+
+
+@contextmanager
+def tidy_article_revisions_by_article(history):
+    """Tidy a corpus by looping over articles, as a baseline."""
+    corpus = _split_into_articles(history)
+
+    def tidy():
+        return [wikivision.tidy_article_revisions(revisions)
+                for _, revisions in corpus.groupby('article_slug', sort=False)]
+
+    yield tidy
+
+
+def _split_into_articles(history, size=100):
+    """Split a history into many articles of a few revisions each.
+
+    The first revision of each article is made its root.
+    """
+    corpus = history.copy()
+    article_number = corpus.index.values // size
+    corpus['article_slug'] = ['article_{}'.format(n) for n in article_number]
+    is_first = corpus.index.values % size == 0
+    corpus.loc[is_first, 'parent_id'] = 0
+    return corpus
+
+
+@contextmanager
+def label_edits(history):
+    revisions = wikivision.tidy_article_revisions(history)
+    yield lambda: wikivision.label_edits(revisions)
+
+
+# Seconds the fake API takes to respond to each request.
+API_LATENCY = 0.02
+
+
+@contextmanager
+def get_many_article_revisions(history, workers=8):
+    """Fetch a corpus from a fake API that's slow to respond.
+
+    Each request waits on the network, so throughput should scale with
+    the number of workers until the database becomes the bottleneck.
+    """
+    corpus = _split_into_articles(history)
+    with _serve_corpus(corpus) as api_endpoint:
+        def fetch():
+            db_dir = tempfile.mkdtemp()
+            try:
+                wikivision.get_many_article_revisions(
+                    corpus.article_slug.unique(), workers=workers,
+                    db_name=os.path.join(db_dir, 'benchmark'),
+                    api_endpoint=api_endpoint,
+                )
+            finally:
+                shutil.rmtree(db_dir, ignore_errors=True)
+
+        yield fetch
+
+
+@contextmanager
+def get_many_article_revisions_serially(history):
+    """A baseline for `get_many_article_revisions` with a single worker."""
+    with get_many_article_revisions(history, workers=1) as fetch:
+        yield fetch
+
+
+@contextmanager
+def _serve_corpus(corpus, page_size=50):
+    """Serve a corpus like the MediaWiki API, a page at a time."""
+    pages = {}
+    for article_slug, revisions in corpus.groupby('article_slug'):
+        pages[article_slug] = [
+            {'revid': int(rev_id), 'parentid': int(parent_id),
+             'timestamp': timestamp,
+             '*': wikitext}
+            for rev_id, parent_id, timestamp, wikitext in zip(
+                revisions.rev_id, revisions.parent_id, revisions.timestamp,
+                revisions.wikitext,
+            )
+        ]
+
+    class FakeAPI(BaseHTTPRequestHandler):
+        def do_GET(self):
+            params = {k: v[0] for k, v
+                      in parse_qs(urlparse(self.path).query).items()}
+            time.sleep(API_LATENCY)
+            revisions = pages.get(params['titles'], [])
+            start = int(params.get('rvcontinue', 0))
+            end = start + page_size
+            response = {'query': {'pages': {'1': {
+                'revisions': revisions[start:end]
+            }}}}
+            if end < len(revisions):
+                response['continue'] = {'rvcontinue': str(end)}
+            body = json.dumps(response).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeAPI)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield 'http://127.0.0.1:{}/w/api.php'.format(server.server_port)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@contextmanager
+def compact_revisions(history):
+    revisions = wikivision.tidy_article_revisions(history)
+    yield lambda: wikivision.compact_revisions(revisions)
+
+
+@contextmanager
+def append_revisions(history):
+    revisions = wikivision.tidy_article_revisions(history)
+
+    def append():
+        with temporary_db() as db_con:
+            wikivision.append_revisions(revisions, db_con)
+
+    yield append
+
+
+@contextmanager
+def append_revisions_as_deltas(history):
+    revisions = wikivision.tidy_article_revisions(history)
+
+    def append():
+        with temporary_db() as db_con:
+            wikivision.append_revisions(revisions[['article_slug', 'rev_id']],
+                                        db_con)
+            with db_con:
+                wikivision.insert_wikitexts(revisions, db_con, deltas=True)
+
+    yield append
+
+
+@contextmanager
+def select_revisions_by_article(history):
+    with _stored(history) as (slug, db_con):
+        def select():
+            wikivision.data._wikitext_cache.clear()
+            return wikivision.select_revisions_by_article(slug, db_con)
+
+        yield select
+
+
+@contextmanager
+def select_revisions_by_article_as_deltas(history):
+    with _stored(history, deltas=True) as (slug, db_con):
+        def select():
+            wikivision.data._wikitext_cache.clear()
+            return wikivision.select_revisions_by_article(slug, db_con)
+
+        yield select
+
+
+@contextmanager
+def select_metadata_by_article(history):
+    with _stored(history) as (slug, db_con):
+        yield lambda: wikivision.select_revisions_by_article(
+            slug, db_con, columns=wikivision.METADATA_COLUMNS
+        )
+
+
+@contextmanager
+def read_revisions(history):
+    """Count the revisions of each type in a corpus exported to parquet."""
+    with _stored_corpus(history) as (article_slugs, db_con):
+        export_dir = tempfile.mkdtemp()
+        try:
+            wikivision.export_revisions(export_dir, db_con, wikitexts=False)
+
+            def count():
+                revisions = wikivision.read_revisions(
+                    export_dir, columns=['article_slug', 'rev_type']
+                )
+                return revisions.groupby(['article_slug', 'rev_type']).size()
+
+            yield count
+        finally:
+            shutil.rmtree(export_dir, ignore_errors=True)
+
+
+@contextmanager
+def select_corpus_by_article(history):
+    """Count the revisions of each type in a corpus in the database.
+
+    A baseline for `read_revisions`.
+    """
+    with _stored_corpus(history) as (article_slugs, db_con):
+        def count():
+            revisions = pd.concat([
+                wikivision.select_revisions_by_article(
+                    slug, db_con, columns=['rev_type']
+                ).assign(article_slug=slug)
+                for slug in article_slugs
+            ])
+            return revisions.groupby(['article_slug', 'rev_type']).size()
+
+        yield count
+
+
+@contextmanager
+def version_graph_lineage(history):
+    """Trace the lineage of the head of every article in a saved graph."""
+    corpus = wikivision.tidy_many_article_revisions(
+        _split_into_articles(history)
+    )
+    graph_dir = tempfile.mkdtemp()
+    try:
+        wikivision.save_version_graph(graph_dir, corpus)
+
+        def trace():
+            graph = wikivision.VersionGraph(graph_dir)
+            return [graph.lineage(slug) for slug in graph.article_slugs]
+
+        yield trace
+    finally:
+        shutil.rmtree(graph_dir, ignore_errors=True)
+
+
+@contextmanager
+def lineage_by_article(history):
+    """Trace the lineage of the head of every article from a table.
+
+    A baseline for `version_graph_lineage`.
+    """
+    corpus = wikivision.tidy_many_article_revisions(
+        _split_into_articles(history)
+    )
+
+    def trace():
+        lineages = []
+        for _, revisions in corpus.groupby('article_slug'):
+            parent_index = wikivision.build_parent_index(
+                revisions.rev_version.values, revisions.parent_version.values
+            )
+            lineages.append(wikivision.trace_lineage(
+                parent_index, revisions.rev_version.iloc[-1]
+            ))
+        return lineages
+
+    yield trace
+
+
+@contextmanager
+def graph(history):
+    with _graphable(history) as (edges, nodes):
+        def graph():
+            return wikivision.graph(edges, nodes, remove_labels=True).source
+
+        yield graph
+
+
+@contextmanager
+def graph_node_by_node(history):
+    """Graph by adding nodes and edges to a Digraph one at a time.
+
+    This is how `wikivision.graph` used to work, kept as a baseline.
+    """
+    with _graphable(history) as (edges, nodes):
+        def graph():
+            g = graphviz.Digraph(graph_attr={'rankdir': 'LR'})
+            for _, attrs in nodes.to_dict('index').items():
+                attrs['label'] = ''
+                g.node(**attrs)
+            g.edges([(from_node, to_node)
+                     for _, (from_node, to_node) in edges.iterrows()])
+            return g.source
+
+        yield graph
+
+
+@contextmanager
+def _graphable(history):
+    revisions = wikivision.tidy_article_revisions(history)
+    nodes = wikivision.format_nodes(revisions, highlight=True)
+    edges = wikivision.format_edges(revisions.iloc[1:])
+    yield edges, nodes
+
+
+@contextmanager
+def _stored(history, deltas=False):
+    revisions = wikivision.tidy_article_revisions(history)
+    with temporary_db() as db_con:
+        wikivision.append_revisions(
+            revisions.drop('wikitext', axis=1), db_con
+        )
+        with db_con:
+            wikivision.insert_wikitexts(revisions, db_con, deltas=deltas)
+        yield revisions.article_slug.iloc[0], db_con
+
+
+@contextmanager
+def _stored_corpus(history):
+    corpus = wikivision.tidy_many_article_revisions(
+        _split_into_articles(history)
+    )
+    with temporary_db() as db_con:
+        wikivision.append_revisions(corpus, db_con)
+        yield corpus.article_slug.unique().tolist(), db_con
+
+
+@contextmanager
+def temporary_db():
+    """Connect to a new database that is deleted on exit."""
+    db_dir = tempfile.mkdtemp()
+    db_con = wikivision.connect_db(os.path.join(db_dir, 'benchmark'))
+    try:
+        yield db_con
+    finally:
+        db_con.close()
+        shutil.rmtree(db_dir, ignore_errors=True)
+
+
+BENCHMARKS = {
+    'to_table': to_table,
+    'label_version': label_version,
+    'drop_repeats': drop_repeats,
+    'label_revision_type': label_revision_type,
+    'tidy_article_revisions': tidy_article_revisions,
+    'tidy_many_article_revisions': tidy_many_article_revisions,
+    'tidy_article_revisions_by_article': tidy_article_revisions_by_article,
+    'label_reversions': label_reversions,
+    'label_edits': label_edits,
+    'get_many_article_revisions': get_many_article_revisions,
+    'get_many_article_revisions_serially':
+        get_many_article_revisions_serially,
+    'compact_revisions': compact_revisions,
+    'append_revisions': append_revisions,
+    'append_revisions_as_deltas': append_revisions_as_deltas,
+    'select_revisions_by_article': select_revisions_by_article,
+    'select_revisions_by_article_as_deltas':
+        select_revisions_by_article_as_deltas,
+    'select_metadata_by_article': select_metadata_by_article,
+    'read_revisions': read_revisions,
+    'select_corpus_by_article': select_corpus_by_article,
+    'version_graph_lineage': version_graph_lineage,
+    'lineage_by_article': lineage_by_article,
+    'graph': graph,
+    'graph_node_by_node': graph_node_by_node,
+}
@@ -0,0 +1,99 @@
+"""Time and profile the memory of benchmarks."""
+import gc
+import json
+import platform
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+
+def measure(func, repeat=3, memory=True):
+    """Measure the run time and peak memory of a function.
+
+    Memory is profiled in a separate run from the timed runs because
+    tracing allocations slows down execution.
+
+    Args:
+        func: A function taking no arguments.
+        repeat: The number of times to time the function. The fastest
+            time is reported.
+        memory: Should peak memory be profiled?
+
+    Returns:
+        A dict with the fastest time in seconds and the peak memory in
+        bytes allocated while the function was running, or None if
+        memory wasn't profiled.
+    """
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    peak_memory = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            func()
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return {'seconds': min(times), 'peak_memory_bytes': peak_memory}
+
+
+def run_benchmarks(benchmarks, histories, repeat=3, memory=True):
+    """Run benchmarks on histories of different sizes.
+
+    Args:
+        benchmarks: A dict mapping benchmark names to context managers.
+            Each takes a revision history and yields a function taking
+            no arguments to be measured.
+        histories: An iterable of pairs of the parameters used to make a
+            history, as a dict, and the history.
+        repeat: Passed on to `measure`.
+        memory: Passed on to `measure`.
+
+    Yields:
+        A dict of results for each benchmark run on each history. Peak
+        memory is also reported relative to the size of the history, as
+        the ratio of the total memory in use at the peak to the memory
+        used by the history alone. Errors are recorded rather than
+        raised, so one failing stage doesn't prevent the others from
+        being measured.
+    """
+    for params, history in histories:
+        input_bytes = int(history.memory_usage(deep=True).sum())
+        for name, setup in benchmarks.items():
+            result = dict(params, benchmark=name, input_bytes=input_bytes,
+                          **environment())
+            try:
+                with setup(history) as func:
+                    result.update(measure(func, repeat=repeat, memory=memory))
+            except Exception as e:
+                result['error'] = '{}: {}'.format(type(e).__name__, e)
+            if result.get('peak_memory_bytes') is not None:
+                result['peak_memory_ratio'] = (
+                    (input_bytes + result['peak_memory_bytes']) / input_bytes
+                )
+            yield result
+
+
+def environment():
+    """Describe the environment the benchmarks are run in."""
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+    }
+
+
+def write_results(results, output):
+    """Write results as JSON lines, flushing after each result."""
+    for result in results:
+        output.write(json.dumps(result) + '\n')
+        output.flush()
@@ -0,0 +1,95 @@
+"""Generate synthetic revision histories for benchmarking."""
+import datetime
+
+import numpy as np
+import pandas as pd
+
+
+def make_history(n_revisions, text_size=1000, edit_size=20,
+                 reversion_rate=0.1, repeat_rate=0.05, branchiness=0.05,
+                 article_slug='synthetic_article', seed=0):
+    """Create a synthetic revision history of an article.
+
+    Each revision is either an edit of the current version of the
+    article, an edit of an older version (which creates a branch), a
+    reversion to an older version, or a repeat of the current version.
+
+    Args:
+        n_revisions: The number of revisions in the history.
+        text_size: The length of the wikitext of the first revision.
+        edit_size: The number of characters changed by each edit.
+        reversion_rate: The proportion of revisions that revert the
+            article to an older version.
+        repeat_rate: The proportion of revisions that repeat the current
+            version.
+        branchiness: The proportion of revisions that edit an older
+            version instead of the current one.
+        article_slug: The name of the synthetic article.
+        seed: Seed for the random number generator.
+
+    Returns:
+        A pandas.DataFrame of revisions with the same columns as tables
+        made from Wikipedia API responses by `wikivision.format_revisions`.
+    """
+    rng = np.random.RandomState(seed)
+    alphabet = np.array(list('abcdefghijklmnopqrstuvwxyz \n'))
+
+    def random_text(size):
+        return ''.join(rng.choice(alphabet, size=size))
+
+    def edit(wikitext):
+        start = rng.randint(0, max(len(wikitext) - edit_size, 0) + 1)
+        return (wikitext[:start] + random_text(edit_size) +
+                wikitext[start + edit_size:])
+
+    versions = [random_text(text_size)]
+    wikitexts = [versions[0]]
+    current = 0
+    kinds = rng.choice(
+        ['edit', 'branch', 'reversion', 'repeat'],
+        size=n_revisions,
+        p=[1 - branchiness - reversion_rate - repeat_rate,
+           branchiness, reversion_rate, repeat_rate],
+    )
+    for kind in kinds[1:]:
+        if kind == 'repeat':
+            pass
+        elif kind == 'reversion' and current > 0:
+            current = rng.randint(0, current)
+        else:
+            base = current
+            if kind == 'branch' and current > 0:
+                base = rng.randint(0, current)
+            versions.append(edit(versions[base]))
+            current = len(versions) - 1
+        wikitexts.append(versions[current])
+
+    rev_ids = np.arange(1, n_revisions + 1)
+    start = datetime.datetime(2001, 1, 15)
+    timestamps = [(start + datetime.timedelta(minutes=int(i)))
+                  .strftime('%Y-%m-%dT%H:%M:%SZ') for i in rev_ids]
+    return pd.DataFrame({
+        'article_slug': article_slug,
+        'rev_id': rev_ids,
+        'parent_id': rev_ids - 1,
+        'timestamp': timestamps,
+        'wikitext': wikitexts,
+    })[['article_slug', 'rev_id', 'parent_id', 'timestamp', 'wikitext']]
+
+
+def make_json_revisions(n_revisions, **kwargs):
+    """Create a synthetic revision history as Wikipedia API records.
+
+    Args:
+        n_revisions: The number of revisions in the history.
+        **kwargs: Passed on to `make_history`.
+
+    Returns:
+        A list of revisions as dicts like those returned by
+        `wikivision.request`.
+    """
+    history = make_history(n_revisions, **kwargs)
+    history = history.rename(columns={'rev_id': 'revid',
+                                      'parent_id': 'parentid',
+                                      'wikitext': '*'})
+    return history.drop('article_slug', axis=1).to_dict('records')
@@ -1,13 +1,136 @@
+import gzip
+import json
+
 import pytest
+from numpy import nan
+import pandas as pd
 
+import wikivision.app
 from wikivision.app import app
 
 
 @pytest.fixture
-def test_app():
+def test_app(tmpdir, monkeypatch):
+    monkeypatch.setitem(app.config, 'DB_NAME', str(tmpdir.join('histories')))
     return app.test_client()
 
 
 def test_home_page(test_app):
     response = test_app.get('/')
     assert response._status_code == 200
+
+
+@pytest.fixture
+def revisions(monkeypatch):
+    # versions 0 -> 1 -> 2, 0 -> 3 -> 4, with a reversion back to 1
+    revisions = pd.DataFrame({
+        'rev_id': [1, 2, 3, 4, 5, 6],
+        'timestamp': pd.to_datetime(['2000-01-0{}'.format(i)
+                                     for i in range(1, 7)]),
+        'rev_sha1': ['a', 'b', 'c', 'd', 'e', 'b'],
+        'rev_version': [0, 1, 2, 3, 4, 1],
+        'parent_version': [nan, 0, 1, 0, 3, 4],
+        'rev_type': ['root', 'branch', 'reversion', 'reversion',
+                     'branch', 'head'],
+    })
+    monkeypatch.setattr(wikivision.app, 'select_revisions_by_article',
+                        lambda article_slug, db_con, columns: revisions[columns])
+    monkeypatch.setattr(wikivision.app, 'select_article_status',
+                        lambda article_slug, db_con: 'complete')
+    return revisions
+
+
+def test_tree_api_returns_nested_metadata(test_app, revisions):
+    response = test_app.get('/api/tree/test_slug')
+    data = json.loads(response.get_data())
+    tree = data['tree']
+    assert data['num_versions'] == 5
+    assert tree['rev_sha1'] == 'a'
+    assert [child['rev_version'] for child in tree['children']] == [1, 3]
+    assert tree['children'][1]['children'][0]['rev_sha1'] == 'e'
+    assert 'wikitext' not in tree
+
+
+def test_tree_api_paginates_subtrees(test_app, revisions):
+    response = test_app.get('/api/tree/test_slug?depth=1&limit=1')
+    tree = json.loads(response.get_data())['tree']
+    assert tree['num_children'] == 2
+    assert len(tree['children']) == 1
+    assert 'children' not in tree['children'][0]
+
+    response = test_app.get('/api/tree/test_slug?root=0&offset=1&depth=1')
+    tree = json.loads(response.get_data())['tree']
+    assert [child['rev_version'] for child in tree['children']] == [3]
+
+
+def test_tree_api_unknown_root(test_app, revisions):
+    response = test_app.get('/api/tree/test_slug?root=10')
+    assert response.status_code == 404
+
+
+def test_tree_api_is_gzipped(test_app, revisions, monkeypatch):
+    monkeypatch.setattr(wikivision.app, 'GZIP_MIN_BYTES', 0)
+    response = test_app.get('/api/tree/test_slug',
+                            headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    data = json.loads(gzip.decompress(response.get_data()))
+    assert data['tree']['rev_sha1'] == 'a'
+
+
+class FakeExecutor(object):
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, func, *args, **kwargs):
+        self.submitted.append(args)
+        self.kwargs = kwargs
+
+
+def test_tree_api_starts_fetch_job_for_uncached_article(test_app, monkeypatch):
+    executor = FakeExecutor()
+    monkeypatch.setattr(wikivision.data, '_get_job_executor', lambda: executor)
+
+    response = test_app.get('/api/tree/test_slug')
+    assert response.status_code == 202
+    job = json.loads(response.get_data())['job']
+    assert job['status'] == 'pending'
+
+    response = test_app.get('/api/tree/test_slug')
+    assert json.loads(response.get_data())['job']['job_id'] == job['job_id']
+    assert len(executor.submitted) == 1
+
+    response = test_app.get(job['status_url'])
+    assert json.loads(response.get_data())['job']['article_slug'] == 'test_slug'
+
+
+def test_tree_api_resumes_partly_fetched_article(test_app, monkeypatch):
+    executor = FakeExecutor()
+    monkeypatch.setattr(wikivision.data, '_get_job_executor', lambda: executor)
+    db_con = wikivision.get_db(app.config['DB_NAME'])
+    # revisions without types are left by a fetch that didn't finish
+    wikivision.append_revisions(pd.DataFrame({
+        'article_slug': 'test_slug', 'rev_id': [1, 2],
+    }), db_con)
+
+    response = test_app.get('/api/tree/test_slug')
+    assert response.status_code == 202
+    assert executor.kwargs['refresh']
+
+
+def test_tree_api_does_not_refetch_unknown_article(test_app, monkeypatch):
+    executor = FakeExecutor()
+    monkeypatch.setattr(wikivision.data, '_get_job_executor', lambda: executor)
+    db_con = wikivision.get_db(app.config['DB_NAME'])
+
+    response = test_app.get('/api/tree/test_slug')
+    job_id = json.loads(response.get_data())['job']['job_id']
+    # the fetch found no revisions
+    wikivision.data._update_job(job_id, db_con, status='failed',
+                                error=wikivision.JOB_NOT_FOUND_ERROR)
+
+    assert test_app.get('/api/tree/test_slug').status_code == 404
+    assert len(executor.submitted) == 1
+
+
+def test_unknown_job(test_app):
+    assert test_app.get('/api/jobs/10').status_code == 404
@@ -0,0 +1,48 @@
+import io
+import json
+
+from benchmarks.pipeline import BENCHMARKS
+from benchmarks.runner import measure, run_benchmarks, write_results
+from benchmarks.synthetic import make_history, make_json_revisions
+
+import wikivision
+
+
+def test_make_history_has_requested_number_of_revisions():
+    history = make_history(50, text_size=100)
+    assert len(history) == 50
+    assert history.wikitext.str.len().iloc[0] == 100
+
+
+def test_make_history_includes_reversions():
+    history = make_history(200, text_size=50, reversion_rate=0.3)
+    labeled = wikivision.label_version(history)
+    assert (labeled.rev_version < labeled.parent_version).any()
+
+
+def test_make_json_revisions_can_be_formatted():
+    json_revisions = make_json_revisions(10, text_size=10)
+    revisions = wikivision.format_revisions(json_revisions, 'synthetic')
+    assert len(revisions) == 10
+
+
+def test_measure_records_time_and_memory():
+    result = measure(lambda: [0] * 10000, repeat=2)
+    assert result['seconds'] > 0
+    assert result['peak_memory_bytes'] > 0
+
+
+def test_write_results_as_json_lines():
+    output = io.StringIO()
+    write_results([{'benchmark': 'a'}, {'benchmark': 'b'}], output)
+    lines = output.getvalue().splitlines()
+    assert [json.loads(line)['benchmark'] for line in lines] == ['a', 'b']
+
+
+def test_tidy_article_revisions_peak_memory():
+    """Tidying uses less than 1.5 times the memory of the raw revisions."""
+    history = make_history(2000, text_size=2000)
+    benchmarks = {'tidy_article_revisions': BENCHMARKS['tidy_article_revisions']}
+    params = {'n_revisions': 2000}
+    result, = run_benchmarks(benchmarks, [(params, history)], repeat=1)
+    assert result['peak_memory_ratio'] <= 1.5
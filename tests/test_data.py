@@ -1,6 +1,15 @@
+import bz2
+import gzip
+import io
+import json
 import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
 
 import pytest
+import numpy as np
 import pandas as pd
 from numpy import nan
 
@@ -18,6 +27,104 @@ def db_con(request):
     request.addfinalizer(delete_db)
     return db_con
 
+# fake Wikipedia API
+# ------------------
+
+def _make_json_revisions(wikitexts):
+    """Create revisions as they would be returned by the Wikipedia API."""
+    return [
+        {'revid': rev_id, 'parentid': rev_id - 1, '*': wikitext,
+         'timestamp': '2000-01-{:02d}T00:00:00Z'.format(rev_id)}
+        for rev_id, wikitext in enumerate(wikitexts, start=1)
+    ]
+
+
+class FakeAPI(BaseHTTPRequestHandler):
+    """Serve revisions a page at a time like the MediaWiki API.
+
+    Every article has the same revisions, but rev ids are unique across
+    articles like they are on Wikipedia.
+    """
+    json_revisions = []
+    page_size = 2
+    requests = []
+    failures = 0
+    titles = []
+    delay = 0
+    in_flight = 0
+    max_in_flight = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        self.requests.append(params)
+
+        with FakeAPI.lock:
+            FakeAPI.in_flight += 1
+            FakeAPI.max_in_flight = max(FakeAPI.max_in_flight,
+                                        FakeAPI.in_flight)
+        try:
+            time.sleep(self.delay)
+            self.respond(params)
+        finally:
+            with FakeAPI.lock:
+                FakeAPI.in_flight -= 1
+
+    def respond(self, params):
+        if FakeAPI.failures > 0:
+            FakeAPI.failures -= 1
+            self.send_error(503)
+            return
+
+        if params['titles'] not in self.titles:
+            self.titles.append(params['titles'])
+        offset = 1000 * self.titles.index(params['titles'])
+        revisions = [dict(r, revid=r['revid'] + offset,
+                          parentid=r['parentid'] and r['parentid'] + offset)
+                     for r in self.json_revisions]
+
+        revisions = sorted(revisions, key=lambda r: r['revid'],
+                           reverse=params.get('rvdir') != 'newer')
+        if 'rvstartid' in params:
+            start_id = int(params['rvstartid'])
+            revisions = [r for r in revisions
+                         if (r['revid'] >= start_id if params.get('rvdir') == 'newer'
+                             else r['revid'] <= start_id)]
+
+        start = int(params.get('rvcontinue', 0))
+        end = start + self.page_size
+        response = {'query': {'pages': {'1': {'revisions': revisions[start:end]}}}}
+        if end < len(revisions):
+            response['continue'] = {'rvcontinue': str(end)}
+
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fake_api(request):
+    """Run a fake Wikipedia API on a local port and return its url."""
+    FakeAPI.json_revisions = _make_json_revisions('abcbdd')
+    FakeAPI.requests = []
+    FakeAPI.failures = 0
+    FakeAPI.titles = []
+    FakeAPI.delay = 0
+    FakeAPI.max_in_flight = 0
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeAPI)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    def stop_server():
+        server.shutdown()
+        server.server_close()
+    request.addfinalizer(stop_server)
+    return 'http://127.0.0.1:{}/w/api.php'.format(server.server_port)
+
 # to_table
 # --------
 
@@ -58,6 +165,418 @@ def test_renaming_table_columns(json_revisions):
     want = set(renamer.values())
     assert got == want, "columns weren't renamed properly"
 
+# request_pages
+# -------------
+
+def test_request_pages_yields_each_continuation_page(fake_api):
+    pages = wikivision.request_pages('test_slug', api_endpoint=fake_api)
+    assert [len(page) for page in pages] == [2, 2, 2]
+    assert len(FakeAPI.requests) == 3
+
+
+def test_request_pages_is_lazy(fake_api):
+    pages = wikivision.request_pages('test_slug', api_endpoint=fake_api)
+    next(pages)
+    assert len(FakeAPI.requests) == 1
+
+
+def test_request_combines_pages(fake_api):
+    revisions = wikivision.request('test_slug', api_endpoint=fake_api)
+    assert len(revisions) == 6
+
+# fetch_article_revisions
+# -----------------------
+
+def test_tidy_revision_pages_matches_tidy_article_revisions():
+    json_revisions = _make_json_revisions('abcbdd')
+    revisions = wikivision.format_revisions(json_revisions, 'test_slug')
+    expected = wikivision.tidy_article_revisions(revisions)
+
+    pages = [wikivision.format_revisions(json_revisions[i:i+2], 'test_slug')
+             for i in range(0, len(json_revisions), 2)]
+    streamed = pd.concat(wikivision.tidy_revision_pages(pages))
+
+    columns = ['rev_id', 'rev_sha1', 'parent_sha1', 'rev_version']
+    assert (streamed[columns].fillna('').values.tolist() ==
+            expected[columns].fillna('').values.tolist())
+    assert (streamed.parent_version.tolist()[1:] ==
+            expected.parent_version.tolist()[1:])
+
+
+def test_tidy_revision_pages_requires_complete_history():
+    json_revisions = _make_json_revisions('abcd')
+    json_revisions[2]['parentid'] = 100
+    pages = [wikivision.format_revisions(json_revisions, 'test_slug')]
+    with pytest.raises(wikivision.IncompleteRevisionHistoryError):
+        list(wikivision.tidy_revision_pages(pages))
+
+
+def test_fetch_article_revisions(fake_api, db_con):
+    num_revisions = wikivision.fetch_article_revisions(
+        'test_slug', db_con, api_endpoint=fake_api
+    )
+    assert num_revisions == 5
+    assert all(params['rvdir'] == 'newer' for params in FakeAPI.requests)
+
+    revisions = wikivision.select_revisions_by_article('test_slug', db_con)
+    assert revisions.wikitext.tolist() == list('abcbd')
+    assert revisions.rev_type.tolist() == [
+        'root', 'branch', 'reversion', 'branch', 'head'
+    ]
+
+def test_fetch_article_revisions_reports_progress(fake_api, db_con):
+    progress = []
+    wikivision.fetch_article_revisions(
+        'test_slug', db_con, api_endpoint=fake_api,
+        progress=lambda pages, revisions: progress.append((pages, revisions))
+    )
+    assert progress == [(1, 2), (2, 4), (3, 5)]
+
+
+# background jobs
+# ---------------
+
+class QueuedExecutor(object):
+    """Hold on to submitted jobs until they are run explicitly."""
+    def __init__(self):
+        self.queue = []
+
+    def submit(self, func, *args, **kwargs):
+        self.queue.append((func, args, kwargs))
+
+    def run(self):
+        while self.queue:
+            func, args, kwargs = self.queue.pop(0)
+            func(*args, **kwargs)
+
+
+def test_fetch_jobs_for_the_same_article_are_coalesced(fake_api, db_con):
+    executor = QueuedExecutor()
+    job_id = wikivision.start_fetch_job('test_slug', db_name='histories-test',
+                                        executor=executor,
+                                        api_endpoint=fake_api)
+    assert wikivision.select_job(job_id, db_con)['status'] == 'pending'
+
+    same_job_id = wikivision.start_fetch_job('test_slug',
+                                             db_name='histories-test',
+                                             executor=executor)
+    assert same_job_id == job_id
+    assert len(executor.queue) == 1
+
+    executor.run()
+    job = wikivision.select_job(job_id, db_con)
+    assert job['status'] == 'done'
+    assert (job['pages'], job['revisions']) == (3, 5)
+    assert wikivision.count_revisions('test_slug', db_con) == 5
+
+    new_job_id = wikivision.start_fetch_job('test_slug',
+                                            db_name='histories-test',
+                                            executor=executor)
+    assert new_job_id != job_id
+
+
+def test_failed_fetch_job(fake_api, db_con):
+    FakeAPI.failures = 10
+    executor = QueuedExecutor()
+    job_id = wikivision.start_fetch_job('test_slug', db_name='histories-test',
+                                        executor=executor,
+                                        api_endpoint=fake_api)
+    executor.run()
+    job = wikivision.select_job(job_id, db_con)
+    assert job['status'] == 'failed'
+    assert job['error']
+
+
+def test_stalled_fetch_jobs_expire(db_con, monkeypatch):
+    executor = QueuedExecutor()
+    job_id = wikivision.start_fetch_job('test_slug', db_name='histories-test',
+                                        executor=executor)
+    monkeypatch.setattr(wikivision.data, 'JOB_TIMEOUT', -1)
+    assert wikivision.select_job(job_id, db_con)['status'] == 'failed'
+    assert wikivision.select_active_job('test_slug', db_con) is None
+
+
+def test_fetch_job_without_revisions_fails(fake_api, db_con):
+    FakeAPI.json_revisions = []
+    executor = QueuedExecutor()
+    job_id = wikivision.start_fetch_job('missing', db_name='histories-test',
+                                        executor=executor,
+                                        api_endpoint=fake_api)
+    executor.run()
+    job = wikivision.select_job(job_id, db_con)
+    assert job['status'] == 'failed'
+    assert job['error'] == wikivision.JOB_NOT_FOUND_ERROR
+    assert wikivision.select_last_job('missing', db_con)['job_id'] == job_id
+
+
+# load_dump
+# ---------
+
+def _make_dump(articles):
+    """Create a MediaWiki pages-meta-history XML dump of articles."""
+    pages = []
+    rev_id = 0
+    for page_id, (title, ns, wikitexts) in enumerate(articles, start=1):
+        revisions = []
+        for day, wikitext in enumerate(wikitexts, start=1):
+            rev_id += 1
+            parent = '' if day == 1 else \
+                '<parentid>{}</parentid>'.format(rev_id - 1)
+            text = '<text xml:space="preserve">{}</text>'.format(wikitext) \
+                if wikitext else '<text deleted="deleted" />'
+            revisions.append(
+                '<revision><id>{}</id>{}'
+                '<timestamp>2000-01-{:02d}T00:00:00Z</timestamp>'
+                '<contributor><username>Editor</username><id>99</id>'
+                '</contributor><sha1>unused</sha1>{}</revision>'.format(
+                    rev_id, parent, day, text
+                )
+            )
+        pages.append('<page><title>{}</title><ns>{}</ns><id>{}</id>{}</page>'
+                     .format(title, ns, page_id, ''.join(revisions)))
+    return (
+        '<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/" '
+        'version="0.10"><siteinfo><sitename>Wikipedia</sitename></siteinfo>'
+        '{}</mediawiki>'.format(''.join(pages))
+    ).encode('utf-8')
+
+
+@pytest.fixture
+def dump_articles():
+    return [('First article', 0, 'abcbd'),
+            ('Talk:First article', 1, 'ab'),
+            # the text of the third revision was deleted
+            ('Second article', 0, ['a', 'a', '', 'b'])]
+
+
+@pytest.mark.parametrize('extension, open_file', [
+    ('.xml', open), ('.xml.gz', gzip.open), ('.xml.bz2', bz2.open),
+])
+def test_load_dump(db_con, tmpdir, dump_articles, extension, open_file):
+    path = str(tmpdir.join('pages-meta-history' + extension))
+    with open_file(path, 'wb') as f:
+        f.write(_make_dump(dump_articles))
+
+    num_revisions = wikivision.load_dump(path, db_con)
+    assert num_revisions == {'First_article': 5, 'Second_article': 3}
+
+    revisions = wikivision.select_revisions_by_article('First_article',
+                                                       db_con)
+    assert revisions.wikitext.tolist() == list('abcbd')
+    assert revisions.rev_type.tolist() == [
+        'root', 'branch', 'reversion', 'branch', 'head'
+    ]
+
+
+def test_dump_revisions_match_api_revisions(dump_articles):
+    dump = io.BytesIO(_make_dump(dump_articles))
+    revisions = [revision for article_slug, revision
+                 in wikivision.iter_dump_revisions(dump)
+                 if article_slug == 'First_article']
+    assert revisions == _make_json_revisions('abcbd')
+
+
+def test_load_dump_in_pages(db_con, monkeypatch):
+    monkeypatch.setattr(wikivision.data, 'DUMP_PAGE_SIZE', 2)
+    dump = io.BytesIO(_make_dump([('Article', 0, 'abcbdda')]))
+    wikivision.load_dump(dump, db_con)
+    expected = wikivision.tidy_article_revisions(wikivision.format_revisions(
+        _make_json_revisions('abcbdda'), 'Article'
+    ))
+    revisions = wikivision.select_revisions_by_article('Article', db_con)
+    assert revisions.rev_type.tolist() == expected.rev_type.tolist()
+    assert revisions.rev_version.tolist() == expected.rev_version.tolist()
+
+
+def test_load_selected_articles_from_dump(db_con, dump_articles):
+    dump = io.BytesIO(_make_dump(dump_articles))
+    num_revisions = wikivision.load_dump(dump, db_con,
+                                         article_slugs=['Second_article'])
+    assert list(num_revisions) == ['Second_article']
+
+
+def test_load_dump_skips_articles_that_fail(db_con, monkeypatch):
+    monkeypatch.setattr(wikivision.data, 'DUMP_PAGE_SIZE', 2)
+    dump = _make_dump([('Broken article', 0, 'abcd'),
+                       ('Second article', 0, 'ab')])
+    # the parent of the fourth revision isn't in the dump
+    dump = dump.replace(b'<parentid>3</parentid>', b'<parentid>99</parentid>')
+    num_revisions = wikivision.load_dump(io.BytesIO(dump), db_con)
+    assert num_revisions == {'Broken_article': None, 'Second_article': 2}
+    # the revisions stored before the failure are deleted
+    assert wikivision.count_revisions('Broken_article', db_con) == 0
+
+
+def test_load_dump_replaces_articles(db_con):
+    wikivision.load_dump(io.BytesIO(_make_dump([('Article', 0, 'abcd')])),
+                         db_con)
+    # rev ids in the second dump don't overlap with the first
+    wikivision.load_dump(io.BytesIO(_make_dump([('Other', 0, 'abcd'),
+                                                ('Article', 0, 'ab')])),
+                         db_con)
+    revisions = wikivision.select_revisions_by_article('Article', db_con)
+    assert revisions.wikitext.tolist() == ['a', 'b']
+    assert revisions.rev_type.tolist() == ['root', 'head']
+
+
+def test_load_dump_keeps_lead_sections(db_con):
+    wikitexts = ['Lead', 'Lead\n\n== History ==\nMore',
+                 'New lead\n=== Early ===\nMore']
+    wikivision.load_dump(io.BytesIO(_make_dump([('Article', 0, wikitexts)])),
+                         db_con)
+    revisions = wikivision.select_revisions_by_article('Article', db_con)
+    # the second revision only changed the rest of the article
+    assert revisions.wikitext.tolist() == ['Lead', 'New lead']
+
+
+def test_lead_section():
+    assert wikivision.lead_section('Lead') == 'Lead'
+    assert wikivision.lead_section('Lead\n==History==\n') == 'Lead'
+    assert wikivision.lead_section('== History ==\nMore') == ''
+    assert wikivision.lead_section('a == b ==\nc') == 'a == b ==\nc'
+
+
+# update_article_revisions
+# ------------------------
+
+def test_update_article_revisions_only_requests_new_revisions(fake_api, db_con):
+    FakeAPI.json_revisions = _make_json_revisions('abcb')
+    wikivision.fetch_article_revisions('test_slug', db_con, api_endpoint=fake_api)
+
+    FakeAPI.json_revisions = _make_json_revisions('abcbbae')
+    FakeAPI.requests = []
+    num_revisions = wikivision.update_article_revisions(
+        'test_slug', db_con, api_endpoint=fake_api
+    )
+    assert num_revisions == 2
+    assert len(FakeAPI.requests) == 2
+    assert FakeAPI.requests[0]['rvstartid'] == '4'
+
+    revisions = wikivision.select_revisions_by_article('test_slug', db_con)
+    assert revisions.wikitext.tolist() == list('abcbae')
+    assert revisions.rev_version.tolist() == [0, 1, 2, 1, 0, 3]
+    assert revisions.rev_type.tolist() == [
+        'root', 'reversion', 'reversion', 'reversion', 'reversion', 'head'
+    ]
+
+
+def test_update_article_revisions_matches_full_fetch(fake_api, db_con):
+    FakeAPI.json_revisions = _make_json_revisions('abcbd')
+    wikivision.fetch_article_revisions('updated', db_con, api_endpoint=fake_api)
+    FakeAPI.json_revisions = _make_json_revisions('abcbddefcg')
+    wikivision.update_article_revisions('updated', db_con, api_endpoint=fake_api)
+    wikivision.fetch_article_revisions('fetched', db_con, api_endpoint=fake_api)
+
+    updated = wikivision.select_revisions_by_article('updated', db_con)
+    fetched = wikivision.select_revisions_by_article('fetched', db_con)
+    assert (updated.rev_id + 1000).tolist() == fetched.rev_id.tolist()
+    columns = ['rev_sha1', 'rev_version', 'parent_version', 'rev_type']
+    assert updated[columns].equals(fetched[columns])
+
+
+def test_update_article_revisions_after_a_repeat(fake_api, db_con):
+    FakeAPI.json_revisions = _make_json_revisions('aab')
+    wikivision.fetch_article_revisions('test_slug', db_con, api_endpoint=fake_api)
+
+    # the parent of the newest cached revision was dropped as a repeat
+    FakeAPI.json_revisions = _make_json_revisions('aabc')
+    num_revisions = wikivision.update_article_revisions(
+        'test_slug', db_con, api_endpoint=fake_api
+    )
+    assert num_revisions == 1
+    revisions = wikivision.select_revisions_by_article('test_slug', db_con)
+    assert revisions.wikitext.tolist() == list('abc')
+    assert revisions.parent_version.tolist()[1:] == [0, 1]
+    assert revisions.rev_type.tolist() == ['root', 'branch', 'head']
+
+
+def test_update_article_revisions_reuses_hashes(fake_api, db_con,
+                                                monkeypatch):
+    FakeAPI.json_revisions = _make_json_revisions('aabb')
+    wikivision.fetch_article_revisions('test_slug', db_con, api_endpoint=fake_api)
+    # repeats are cached along with the revisions that were appended
+    assert db_con.execute('SELECT COUNT(*) FROM rev_hashes').fetchone() == (4, )
+
+    hashed = []
+    hash_wikitexts = wikivision.data.hash_wikitexts
+
+    def count_hashes(wikitexts, *args, **kwargs):
+        hashed.extend(wikitexts)
+        return hash_wikitexts(wikitexts, *args, **kwargs)
+
+    monkeypatch.setattr(wikivision.data, 'hash_wikitexts', count_hashes)
+    FakeAPI.json_revisions = _make_json_revisions('aabbc')
+    wikivision.update_article_revisions('test_slug', db_con,
+                                        api_endpoint=fake_api)
+    assert hashed == ['c']
+
+
+def test_update_article_revisions_without_new_revisions(fake_api, db_con):
+    wikivision.fetch_article_revisions('test_slug', db_con, api_endpoint=fake_api)
+    num_revisions = wikivision.update_article_revisions(
+        'test_slug', db_con, api_endpoint=fake_api
+    )
+    assert num_revisions == 0
+    assert wikivision.count_revisions('test_slug', db_con) == 5
+
+# get_many_article_revisions
+# --------------------------
+
+def test_get_many_article_revisions(fake_api, db_con):
+    slugs = ['slug1', 'slug2', 'slug3']
+    num_revisions = wikivision.get_many_article_revisions(
+        slugs, workers=3, db_name='histories-test', api_endpoint=fake_api
+    )
+    assert num_revisions == {slug: 5 for slug in slugs}
+    assert all(wikivision.count_revisions(slug, db_con) == 5 for slug in slugs)
+
+
+def test_get_many_article_revisions_fetches_concurrently(fake_api, db_con):
+    FakeAPI.delay = 0.05
+    wikivision.get_many_article_revisions(
+        ['slug1', 'slug2', 'slug3', 'slug4'], workers=4,
+        db_name='histories-test', api_endpoint=fake_api,
+    )
+    assert FakeAPI.max_in_flight > 1
+
+
+def test_get_many_article_revisions_skips_cached_articles(fake_api, db_con):
+    wikivision.fetch_article_revisions('slug1', db_con, api_endpoint=fake_api)
+    FakeAPI.requests = []
+    num_revisions = wikivision.get_many_article_revisions(
+        ['slug1'], db_name='histories-test', api_endpoint=fake_api
+    )
+    assert num_revisions == {'slug1': 0}
+    assert len(FakeAPI.requests) == 0
+
+
+def test_session_retries_transient_errors(fake_api):
+    FakeAPI.failures = 2
+    session = wikivision.make_session(backoff_factor=0)
+    revisions = wikivision.request('test_slug', api_endpoint=fake_api,
+                                   session=session)
+    assert len(revisions) == 6
+    assert len(FakeAPI.requests) == 5
+
+
+def test_session_limits_rate_of_retries(fake_api):
+    FakeAPI.failures = 3
+    session = wikivision.make_session(backoff_factor=0, requests_per_second=20)
+    start = time.monotonic()
+    wikivision.request('test_slug', api_endpoint=fake_api, session=session)
+    # 3 failures then 3 pages, the first of which doesn't wait
+    assert len(FakeAPI.requests) == 6
+    assert time.monotonic() - start >= 5 * (1.0 / 20)
+
+
+def test_session_limits_request_rate():
+    session = wikivision.RateLimitedSession(requests_per_second=20)
+    start = time.monotonic()
+    for _ in range(5):
+        session.wait()
+    # the first request doesn't wait
+    assert time.monotonic() - start >= 4 * (1.0 / 20)
+
 # select_revisions_by_article
 # ---------------------------
 
@@ -81,6 +600,266 @@ def test_select_single_article(db_con):
     revisions = wikivision.select_revisions_by_article(slug1, db_con)
     assert len(revisions) == 1
 
+def test_select_metadata_columns_without_wikitexts(db_con):
+    revisions = pd.DataFrame({
+        'article_slug': 'test_slug',
+        'rev_id': [1, 2, 3],
+        'wikitext': list('aba'),
+    })
+    wikivision.append_revisions(revisions, db_con)
+
+    statements = []
+    db_con.set_trace_callback(statements.append)
+    selected = wikivision.select_revisions_by_article(
+        'test_slug', db_con, columns=['rev_id', 'rev_sha1']
+    )
+    db_con.set_trace_callback(None)
+
+    assert selected.columns.tolist() == ['rev_id', 'rev_sha1']
+    assert not any('wikitexts' in statement for statement in statements)
+
+    wikitexts = wikivision.select_wikitexts(selected.rev_sha1, db_con)
+    assert wikitexts.tolist() == list('aba')
+
+def test_select_unknown_columns(db_con):
+    with pytest.raises(ValueError):
+        wikivision.select_revisions_by_article('test_slug', db_con,
+                                               columns=['rev_id; DROP'])
+
+def test_appending_revisions_replaces_existing_revisions(db_con):
+    revisions = pd.DataFrame({
+        'article_slug': 'test_slug',
+        'rev_id': [1, 2],
+        'timestamp': pd.to_datetime(['2000-01-01', '2000-01-02'], utc=True),
+    })
+    wikivision.append_revisions(revisions, db_con)
+    wikivision.append_revisions(revisions, db_con)
+    selected = wikivision.select_revisions_by_article('test_slug', db_con)
+    assert selected.rev_id.tolist() == [1, 2]
+    assert selected.timestamp.tolist() == revisions.timestamp.tolist()
+
+
+def test_appending_revisions_only_updates_given_columns(db_con):
+    revisions = pd.DataFrame({
+        'article_slug': 'test_slug',
+        'rev_id': [1, 2],
+        'rev_type': ['root', 'head'],
+    })
+    wikivision.append_revisions(revisions, db_con)
+    wikivision.append_revisions(revisions[['article_slug', 'rev_id']], db_con)
+    selected = wikivision.select_revisions_by_article('test_slug', db_con)
+    assert selected.rev_type.tolist() == ['root', 'head']
+
+
+def test_wikitexts_are_stored_once(db_con):
+    revisions = pd.DataFrame({
+        'article_slug': 'test_slug',
+        'rev_id': [1, 2, 3, 4],
+        'wikitext': list('abab'),
+    })
+    wikivision.append_revisions(revisions, db_con)
+    num_wikitexts = db_con.execute('SELECT COUNT(*) FROM wikitexts').fetchone()[0]
+    assert num_wikitexts == 2
+    selected = wikivision.select_revisions_by_article('test_slug', db_con)
+    assert selected.wikitext.tolist() == list('abab')
+
+
+def test_delta_round_trip():
+    base = "== Taxonomy ==\nA fairywren.\n\n== Description ==\nBlue.\n"
+    wikitext = "== Taxonomy ==\nA fairywren.\nA passerine.\n\n== Description ==\n"
+    delta = wikivision.encode_delta(base, wikitext)
+    assert wikivision.apply_delta(base, delta) == wikitext
+    assert 'Taxonomy' not in delta
+
+@pytest.fixture
+def long_wikitexts():
+    lines = ['Line {} of the splendid fairywren.\n'.format(i)
+             for i in range(100)]
+    wikitexts = []
+    for i in range(10):
+        lines[i] = 'Edit {}.\n'.format(i)
+        wikitexts.append(''.join(lines))
+    return wikitexts
+
+def test_wikitexts_are_stored_as_deltas(db_con, long_wikitexts, monkeypatch):
+    monkeypatch.setattr(wikivision.data, 'WIKITEXT_DELTAS', True)
+    monkeypatch.setattr(wikivision.data, 'WIKITEXT_SNAPSHOT_INTERVAL', 3)
+    revisions = wikivision.tidy_article_revisions(wikivision.format_revisions(
+        _make_json_revisions(long_wikitexts), 'test_slug'
+    ))
+    # the second page is based on wikitexts stored with the first page
+    wikivision.append_revisions(revisions.iloc[:3], db_con)
+    wikivision.append_revisions(revisions.iloc[3:], db_con)
+
+    depths = db_con.execute('SELECT depth FROM wikitexts w '
+                            'JOIN revisions r ON w.sha1 = r.rev_sha1 '
+                            'ORDER BY r.timestamp').fetchall()
+    assert [depth for depth, in depths] == [0, 1, 2, 3, 0, 1, 2, 3, 0, 1]
+
+    wikivision.data._wikitext_cache.clear()
+    selected = wikivision.select_revisions_by_article('test_slug', db_con)
+    assert selected.wikitext.tolist() == long_wikitexts
+
+    wikivision.data._wikitext_cache.clear()
+    head = wikivision.select_wikitexts(revisions.rev_sha1.iloc[-1:], db_con)
+    assert head.tolist() == long_wikitexts[-1:]
+
+def test_cached_wikitexts_are_kept_per_database(db_con, tmpdir):
+    revisions = wikivision.tidy_article_revisions(wikivision.format_revisions(
+        _make_json_revisions('ab'), 'test_slug'
+    ))
+    wikivision.append_revisions(revisions, db_con)
+    assert wikivision.select_wikitexts(revisions.rev_sha1, db_con).tolist() \
+        == ['a', 'b']
+
+    other_con = wikivision.connect_db(str(tmpdir.join('other')))
+    try:
+        other = wikivision.select_wikitexts(revisions.rev_sha1, other_con)
+    finally:
+        other_con.close()
+    assert other.isnull().all()
+
+def test_rewritten_wikitexts_are_stored_in_full(db_con):
+    revisions = wikivision.tidy_article_revisions(wikivision.format_revisions(
+        _make_json_revisions(['a\nb\nc\n', 'x\ny\nz\n']), 'test_slug'
+    ))
+    with db_con:
+        wikivision.insert_wikitexts(revisions, db_con, deltas=True)
+    base_sha1s = db_con.execute('SELECT base_sha1 FROM wikitexts').fetchall()
+    assert base_sha1s == [(None, ), (None, )]
+
+def test_lru_cache():
+    cache = wikivision.LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+
+
+def test_wikitexts_can_be_stored_uncompressed(db_con):
+    revisions = pd.DataFrame({
+        'article_slug': 'test_slug',
+        'rev_id': [1],
+        'wikitext': ['a'],
+    })
+    wikivision.append_revisions(revisions, db_con, compression=None)
+    stored = db_con.execute('SELECT compression, content FROM wikitexts')
+    assert stored.fetchall() == [(None, b'a')]
+
+
+@pytest.mark.parametrize('compression', [None, 'zlib'])
+def test_compress_wikitext(compression):
+    wikitext = "The '''splendid fairywren''' is a passerine bird. " * 10
+    compressed = wikivision.compress_wikitext(wikitext, compression)
+    assert wikivision.decompress_wikitext(compressed, compression) == wikitext
+
+
+def test_db_uses_write_ahead_logging(db_con):
+    journal_mode, = db_con.execute('PRAGMA journal_mode').fetchone()
+    assert journal_mode == 'wal'
+
+
+def test_get_db_reuses_connections_within_a_thread(db_con):
+    db_con = wikivision.get_db('histories-test')
+    assert wikivision.get_db('histories-test') is db_con
+
+    other_thread = []
+    thread = threading.Thread(
+        target=lambda: other_thread.append(wikivision.get_db('histories-test'))
+    )
+    thread.start()
+    thread.join()
+    assert other_thread[0] is not db_con
+
+    wikivision.close_db('histories-test')
+    assert wikivision.get_db('histories-test') is not db_con
+    wikivision.close_db('histories-test')
+
+
+def test_revisions_are_indexed_by_article(db_con):
+    plan = db_con.execute(
+        'EXPLAIN QUERY PLAN SELECT * FROM revisions WHERE article_slug=? '
+        'ORDER BY timestamp', ('test_slug', )
+    ).fetchall()
+    assert 'revisions_article_slug_timestamp' in str(plan)
+
+
+def test_migrate_legacy_revisions_table(db_con):
+    db_con.execute('DROP TABLE revisions')
+    db_con.execute('DROP TABLE wikitexts')
+    db_con.execute('DROP TABLE rev_hashes')
+    db_con.execute('DROP TABLE jobs')
+    db_con.execute('DROP TABLE edits')
+    db_con.execute('PRAGMA user_version = 0')
+    legacy = pd.DataFrame({
+        'article_slug': ['test_slug'] * 2,
+        'rev_id': [1, 2],
+        'timestamp': ['2000-01-01 00:00:00', '2000-01-02 00:00:00'],
+        'wikitext': list('ab'),
+    })
+    legacy.to_sql('revisions', db_con, index=False)
+
+    wikivision.migrate_db(db_con)
+    revisions = wikivision.select_revisions_by_article('test_slug', db_con)
+    assert revisions.wikitext.tolist() == list('ab')
+    assert revisions.timestamp.tolist() == \
+        pd.to_datetime(legacy.timestamp, utc=True).tolist()
+
+
+# export_revisions
+# ----------------
+
+@pytest.fixture
+def exported(db_con, tmpdir):
+    pytest.importorskip('pyarrow')
+    corpus = wikivision.tidy_many_article_revisions(_make_corpus([
+        ('AC/DC', 'abcb'),
+        ('Splendid_fairywren', 'abac'),
+    ]))
+    wikivision.append_revisions(corpus, db_con)
+    directory = str(tmpdir.join('export'))
+    wikivision.export_revisions(directory, db_con)
+    return directory
+
+def test_export_revisions_round_trip(exported, db_con):
+    revisions = wikivision.read_revisions(
+        exported, columns=wikivision.ALL_COLUMNS, article_slugs=['AC/DC']
+    )
+    selected = wikivision.select_revisions_by_article('AC/DC', db_con)
+    pd.testing.assert_frame_equal(revisions, selected)
+
+def test_export_revisions_partitions_by_article(exported):
+    for dataset in ['revisions', 'wikitexts']:
+        assert sorted(os.listdir(os.path.join(exported, dataset))) == [
+            'article_slug=AC%2FDC', 'article_slug=Splendid_fairywren',
+        ]
+
+def test_read_revisions_projects_columns(exported, monkeypatch):
+    # reading metadata never touches the wikitexts
+    monkeypatch.setattr(wikivision.data, '_wikitexts_schema', None)
+    revisions = wikivision.read_revisions(exported, columns=['rev_type'])
+    assert revisions.columns.tolist() == ['rev_type']
+    assert len(revisions) == 8
+
+def test_read_revisions_filters(exported):
+    heads = wikivision.read_revisions(
+        exported, columns=['article_slug', 'wikitext'],
+        filters=[('rev_type', '=', 'head')],
+    )
+    assert heads.values.tolist() == [['AC/DC', 'b'],
+                                     ['Splendid_fairywren', 'c']]
+
+def test_reexporting_replaces_articles(exported, db_con):
+    db_con.execute("DELETE FROM revisions WHERE article_slug = 'AC/DC' "
+                   "AND rev_type = 'head'")
+    wikivision.export_revisions(exported, db_con, article_slugs=['AC/DC'])
+    revisions = wikivision.read_revisions(exported)
+    assert revisions.article_slug.value_counts().to_dict() == {
+        'AC/DC': 3, 'Splendid_fairywren': 4,
+    }
+
 @pytest.fixture
 def revision_wikitext():
     revisions = pd.DataFrame({'wikitext': list('abcbd')})
@@ -157,6 +936,47 @@ def test_label_rev_version(revision_wikitext):
     assert labeled.rev_version.tolist() == expected
 
 
+@pytest.mark.parametrize('use_processes', [False, True])
+def test_hashing_with_workers_matches_serial_hashing(use_processes):
+    wikitexts = pd.Series([str(i % 7) * 5000 for i in range(50)] + [nan])
+    serial = wikivision.hash_wikitexts(wikitexts, workers=1)
+    parallel = wikivision.hash_wikitexts(wikitexts, workers=3,
+                                         use_processes=use_processes)
+    assert parallel[:-1].tolist() == serial[:-1].tolist()
+    assert parallel.isnull().tolist() == serial.isnull().tolist()
+
+
+def test_label_version_with_hash_workers(revision_wikitext):
+    serial = wikivision.label_version(revision_wikitext)
+    parallel = wikivision.label_version(revision_wikitext, hash_workers=2)
+    assert parallel.equals(serial)
+
+
+def test_label_version_only_hashes_missing_sha1s(revision_wikitext):
+    revision_wikitext['rev_sha1'] = ['cached', nan, nan, nan, nan]
+    labeled = wikivision.label_version(revision_wikitext)
+    expected = revision_wikitext.wikitext.apply(wikivision.data._hash)
+    assert labeled.rev_sha1.tolist() == ['cached'] + expected.tolist()[1:]
+
+
+def test_tidying_reuses_hashes_from_db(db_con, monkeypatch):
+    json_revisions = _make_json_revisions('abcbdd')
+    revisions = wikivision.format_revisions(json_revisions, 'test_slug')
+    tidied = wikivision.tidy_article_revisions(revisions, db_con=db_con)
+
+    hashed = []
+    def _hash(wikitext):
+        hashed.append(wikitext)
+        return wikivision.data.hashlib.sha1(wikitext.encode('utf-8')).hexdigest()
+    monkeypatch.setattr(wikivision.data, '_hash', _hash)
+
+    json_revisions = _make_json_revisions('abcbdde')
+    revisions = wikivision.format_revisions(json_revisions, 'test_slug')
+    retidied = wikivision.tidy_article_revisions(revisions, db_con=db_con)
+    assert hashed == ['e']
+    assert retidied.rev_sha1.tolist()[:-1] == tidied.rev_sha1.tolist()
+
+
 def test_label_parent_version(revision_wikitext):
     labeled = wikivision.label_version(revision_wikitext)
     expected = [nan, 0, 1, 2, 1]
@@ -180,6 +1000,106 @@ def test_require_complete_revision_history():
         wikivision.label_version(incomplete_revisions)
 
 
+# tidy_article_revisions
+# ----------------------
+
+def test_tidy_article_revisions_matches_each_step():
+    json_revisions = _make_json_revisions('abbcbddaeb')
+    json_revisions[3], json_revisions[6] = json_revisions[6], json_revisions[3]
+    revisions = wikivision.format_revisions(json_revisions, 'test_slug')
+
+    expected = wikivision.convert_timestamp_to_datetime(revisions)
+    expected = wikivision.label_version(expected)
+    expected = wikivision.drop_repeats(expected)
+    expected = wikivision.label_revision_type(expected)
+
+    tidied = wikivision.tidy_article_revisions(revisions)
+    assert tidied.columns.tolist() == expected.columns.tolist()
+    assert tidied.fillna('').equals(expected.fillna(''))
+
+
+def test_tidy_article_revisions_leaves_revisions_unchanged():
+    revisions = wikivision.format_revisions(_make_json_revisions('aab'),
+                                            'test_slug')
+    original = revisions.copy()
+    wikivision.tidy_article_revisions(revisions)
+    assert revisions.equals(original)
+
+
+# tidy_many_article_revisions
+# ---------------------------
+
+def _make_corpus(articles):
+    """Concatenate the revisions of articles with unique rev ids."""
+    corpus = []
+    for n, (article_slug, wikitexts) in enumerate(articles):
+        revisions = wikivision.format_revisions(
+            _make_json_revisions(wikitexts), article_slug
+        )
+        revisions['rev_id'] += 1000 * n
+        revisions['parent_id'] += 1000 * n
+        corpus.append(revisions)
+    return pd.concat(corpus, ignore_index=True)
+
+
+def test_tidy_many_article_revisions_matches_each_article():
+    articles = [('first', 'abbcbddaeb'), ('second', 'a'), ('third', 'aab'),
+                ('fourth', 'abcdbe')]
+    corpus = _make_corpus(articles)
+    # shuffle the revisions of different articles together
+    corpus = corpus.iloc[np.random.RandomState(0).permutation(len(corpus))]
+
+    tidied = wikivision.tidy_many_article_revisions(corpus)
+    assert set(tidied.article_slug) == {slug for slug, _ in articles}
+
+    for article_slug, _ in articles:
+        expected = wikivision.tidy_article_revisions(
+            corpus.loc[corpus.article_slug == article_slug]
+        )
+        result = tidied.loc[tidied.article_slug == article_slug]
+        result = result.reset_index(drop=True)
+        assert result.fillna('').equals(expected.fillna(''))
+
+
+def test_tidy_many_article_revisions_requires_complete_histories():
+    corpus = _make_corpus([('first', 'abc'), ('second', 'abc')])
+    # the second article is missing its second revision
+    corpus = corpus.drop(4)
+    with pytest.raises(wikivision.IncompleteRevisionHistoryError):
+        wikivision.tidy_many_article_revisions(corpus)
+
+
+# compact_revisions
+# -----------------
+
+@pytest.fixture
+def tidied_revisions():
+    revisions = wikivision.format_revisions(
+        _make_json_revisions('abbcbddaeb'), 'test_slug'
+    )
+    return wikivision.tidy_article_revisions(revisions)
+
+
+@pytest.mark.parametrize('hashes', ['categorical', 'binary'])
+def test_compact_revisions_round_trip(tidied_revisions, hashes):
+    compact = wikivision.compact_revisions(tidied_revisions, hashes=hashes)
+    expanded = wikivision.expand_revisions(compact)
+    assert expanded.fillna('').equals(tidied_revisions.fillna(''))
+
+
+def test_compact_hash_codes_are_rev_versions(tidied_revisions):
+    compact = wikivision.compact_revisions(tidied_revisions)
+    codes = compact.rev_sha1.cat.codes
+    assert (codes.values == tidied_revisions.rev_version.values).all()
+    assert compact.parent_sha1.cat.codes[0] == -1
+    assert compact.rev_type.cat.categories.tolist() == wikivision.REV_TYPES
+
+
+def test_binary_hashes_are_digests(tidied_revisions):
+    compact = wikivision.compact_revisions(tidied_revisions, hashes='binary')
+    assert all(len(sha1) == 20 for sha1 in compact.rev_sha1)
+
+
 # drop_repeats
 # ------------
 
@@ -207,11 +1127,165 @@ def test_detect_repeats_when_revisions_are_out_of_order(timestamped_revisions):
 # drop_reversions
 # ---------------
 
-def test_drop_reversions(labeled_revisions):
-    forward = wikivision.drop_reversions(labeled_revisions)
-    assert len(forward) == 4
+@pytest.fixture
+def reverted_revisions():
+    return pd.DataFrame({
+        'wikitext': list('abcbdeab'),
+        'rev_version': [0, 1, 2, 1, 3, 4, 0, 1],
+    })
+
+
+def test_label_reversions(reverted_revisions):
+    labeled = wikivision.label_reversions(reverted_revisions)
+    assert labeled.is_reversion.tolist() == [False] * 3 + [True] + \
+        [False] * 2 + [True] * 2
+    assert labeled.reverted_to_version.fillna(-1).tolist() == [
+        -1, -1, -1, 1, -1, -1, 0, 1
+    ]
+    assert labeled.edits_undone.tolist() == [0, 0, 0, 1, 0, 0, 5, 3]
+
+
+def test_label_reversions_of_many_articles(reverted_revisions):
+    corpus = pd.concat([reverted_revisions.assign(article_slug='first'),
+                        reverted_revisions.assign(article_slug='second')],
+                       ignore_index=True)
+    labeled = wikivision.label_reversions(corpus)
+    assert not labeled.is_reversion[8]
+    assert labeled.edits_undone.tolist()[8:] == [0, 0, 0, 1, 0, 0, 5, 3]
+
+
+@pytest.fixture
+def interleaved_revisions():
+    # first: a b a (one edit undone), second: x y z, edited in between
+    return pd.DataFrame({
+        'article_slug': ['first', 'second', 'first', 'second', 'second',
+                         'first'],
+        'wikitext': list('axbyza'),
+        'rev_version': [0, 0, 1, 1, 2, 0],
+    })
+
+
+def test_label_reversions_of_interleaved_articles(interleaved_revisions):
+    labeled = wikivision.label_reversions(interleaved_revisions)
+    assert labeled.is_reversion.tolist() == [False] * 5 + [True]
+    assert labeled.edits_undone.tolist() == [0] * 5 + [1]
+
+
+def test_drop_reversions_of_interleaved_articles(interleaved_revisions):
+    forward = wikivision.drop_reversions(interleaved_revisions, undone=True)
+    assert forward.wikitext.tolist() == list('axyz')
+
+
+def test_drop_reversions(reverted_revisions):
+    forward = wikivision.drop_reversions(reverted_revisions)
+    assert forward.wikitext.tolist() == list('abcde')
+    assert forward.columns.tolist() == reverted_revisions.columns.tolist()
+
+
+def test_drop_reversions_and_undone_revisions(reverted_revisions):
+    forward = wikivision.drop_reversions(reverted_revisions, undone=True)
+    assert forward.wikitext.tolist() == list('a')
+
+
+def test_drop_reversions_of_tidied_revisions():
+    revisions = wikivision.format_revisions(_make_json_revisions('abcbd'),
+                                            'test_slug')
+    tidied = wikivision.tidy_article_revisions(revisions)
+    forward = wikivision.drop_reversions(tidied)
     assert forward.wikitext.tolist() == list('abcd')
 
+# label_edits
+# -----------
+
+def test_measure_edit():
+    size_change, distance, similarity = wikivision.measure_edit(
+        'A fairywren.\nBlue.\n', 'A fairywren.\nBlack.\nSmall.\n'
+    )
+    assert size_change == 8
+    # delete 'u' and 'e', insert 'ack', then insert a line
+    assert distance == 2 + 3 + len('Small.\n')
+    assert similarity == 1 - distance / 46
+
+def test_measure_edit_of_huge_wikitexts():
+    size_change, distance, similarity = wikivision.measure_edit(
+        'a' * 10, 'b' * 20, max_chars=20
+    )
+    assert size_change == 10
+    assert np.isnan(distance) and np.isnan(similarity)
+
+@pytest.fixture
+def edited_revisions():
+    return wikivision.tidy_article_revisions(wikivision.format_revisions(
+        _make_json_revisions(list('abcbdeab')), 'test_slug'
+    ))
+
+def test_label_edits(edited_revisions):
+    labeled = wikivision.label_edits(edited_revisions, workers=1)
+    assert labeled.index.tolist() == edited_revisions.index.tolist()
+    assert np.isnan(labeled.edit_distance.iloc[0])
+    # each version differs from its parent by a single character
+    assert labeled.edit_distance.tolist()[1:] == [2] * 7
+    assert labeled.size_change.tolist()[1:] == [0] * 7
+
+def test_label_edits_with_processes(edited_revisions):
+    labeled = wikivision.label_edits(edited_revisions, workers=2)
+    expected = wikivision.label_edits(edited_revisions, workers=1)
+    pd.testing.assert_frame_equal(labeled, expected)
+    # the pool is reused by later calls
+    pool = wikivision.data._get_edit_pool(2)
+    wikivision.label_edits(edited_revisions, workers=2)
+    assert wikivision.data._get_edit_pool(2) is pool
+
+def test_label_edits_without_processes_by_default(edited_revisions,
+                                                  monkeypatch):
+    def get_edit_pool(workers):
+        raise AssertionError('edits should be measured serially')
+
+    monkeypatch.setattr(wikivision.data, '_get_edit_pool', get_edit_pool)
+    labeled = wikivision.label_edits(edited_revisions)
+    assert labeled.edit_distance.tolist()[1:] == [2] * 7
+
+def test_label_edits_are_cached(db_con, edited_revisions, monkeypatch):
+    wikivision.append_revisions(edited_revisions, db_con)
+    metadata = wikivision.select_revisions_by_article(
+        'test_slug', db_con, columns=['rev_sha1', 'parent_sha1'],
+    )
+    labeled = wikivision.label_edits(metadata, db_con=db_con, workers=1)
+    assert labeled.edit_distance.tolist()[1:] == [2] * 7
+
+    def measure(*args):
+        raise AssertionError('edits should be cached')
+
+    monkeypatch.setattr(wikivision.data, '_measure_batch', measure)
+    cached = wikivision.label_edits(metadata, db_con=db_con, workers=1)
+    pd.testing.assert_frame_equal(cached, labeled)
+
+def test_label_edits_of_unchanged_versions(monkeypatch):
+    monkeypatch.setattr(wikivision.data, '_measure_batch',
+                        lambda texts, max_chars: [])
+    unchanged = pd.DataFrame({'parent_sha1': ['a'], 'rev_sha1': ['a']})
+    labeled = wikivision.label_edits(unchanged, workers=1)
+    assert labeled[['size_change', 'edit_distance', 'similarity']] \
+        .values.tolist() == [[0, 0, 1]]
+
+def test_label_edits_leaves_missing_wikitexts_unmeasured(db_con,
+                                                         edited_revisions):
+    revisions = edited_revisions.copy()
+    # the parent's wikitext is neither in the frame nor in the database
+    revisions.loc[revisions.index[1], 'parent_sha1'] = 'missing'
+    labeled = wikivision.label_edits(revisions, db_con=db_con, workers=1)
+    assert np.isnan(labeled.edit_distance.iloc[1])
+    assert labeled.edit_distance.tolist()[2:] == [2] * 6
+    assert db_con.execute("SELECT COUNT(*) FROM edits "
+                          "WHERE parent_sha1='missing'").fetchone() == (0, )
+
+def test_label_edits_requires_wikitexts():
+    revisions = pd.DataFrame({'parent_sha1': [nan, 'a'],
+                              'rev_sha1': ['a', 'b']})
+    with pytest.raises(wikivision.MissingRequiredColumnError):
+        wikivision.label_edits(revisions, workers=1)
+
+
 # tree_format
 # -----------
 
@@ -240,3 +1314,85 @@ def test_label_deadend_revisions(revision_versions):
 def test_label_reversion_revisions(revision_versions):
     revision_types = wikivision.label_revision_type(revision_versions)
     assert revision_types.ix[2, 'rev_type'] == 'reversion'
+
+
+def test_label_revision_type_of_deep_history():
+    """Long lines of descent are labeled without recursing."""
+    n_versions = 20000
+    revisions = pd.DataFrame({'rev_version': range(n_versions)})
+    revisions['parent_version'] = revisions.rev_version - 1
+    revision_types = wikivision.label_revision_type(revisions)
+    rev_types = revision_types.rev_type.tolist()
+    assert rev_types[0] == 'root'
+    assert rev_types[-1] == 'head'
+    assert set(rev_types[1:-1]) == {'branch'}
+
+
+def test_trace_lineage_from_parent_index(revision_versions):
+    parent_index = wikivision.build_parent_index(
+        revision_versions.rev_version, revision_versions.parent_version
+    )
+    assert parent_index.tolist() == [-1, 0, 0, 2]
+    assert wikivision.trace_lineage(parent_index, 3) == [3, 2, 0]
+    assert wikivision.trace_lineage(parent_index, 3, stop=0) == [3, 2]
+
+
+# save_version_graph
+# ------------------
+
+@pytest.fixture
+def version_graph(tmpdir):
+    corpus = wikivision.tidy_many_article_revisions(_make_corpus([
+        ('second', 'abcbdeab'), ('first', 'abac'),
+    ]))
+    directory = str(tmpdir.join('graph'))
+    wikivision.save_version_graph(directory, corpus)
+    return corpus, wikivision.VersionGraph(directory)
+
+def test_version_graph_matches_revisions(version_graph):
+    corpus, graph = version_graph
+    assert graph.article_slugs == ['first', 'second']
+    for article_slug, revisions in corpus.groupby('article_slug'):
+        assert graph.rev_versions(article_slug).tolist() == \
+            revisions.rev_version.tolist()
+        assert graph.rev_types(article_slug).tolist() == \
+            revisions.rev_type.tolist()
+        assert graph.timestamps(article_slug).astype('int64').tolist() == \
+            wikivision.to_epoch_seconds(revisions.timestamp).tolist()
+        assert graph.parents(article_slug).tolist() == \
+            wikivision.build_parent_index(revisions.rev_version,
+                                          revisions.parent_version).tolist()
+
+def test_version_graph_sorts_revisions(version_graph, tmpdir):
+    corpus, graph = version_graph
+    directory = str(tmpdir.join('shuffled'))
+    wikivision.save_version_graph(directory,
+                                  corpus.sample(frac=1, random_state=0))
+    shuffled = wikivision.VersionGraph(directory)
+    for article_slug in graph.article_slugs:
+        assert shuffled.rev_versions(article_slug).tolist() == \
+            graph.rev_versions(article_slug).tolist()
+        assert shuffled.parents(article_slug).tolist() == \
+            graph.parents(article_slug).tolist()
+        assert shuffled.head(article_slug) == graph.head(article_slug)
+
+def test_version_graph_is_memory_mapped(version_graph):
+    _, graph = version_graph
+    assert isinstance(graph.parents('first'), np.memmap)
+
+def test_version_graph_queries(version_graph):
+    _, graph = version_graph
+    # second: versions 0-1-2, 1-3-4, and the head is back at 1
+    assert graph.head('second') == 1
+    assert graph.lineage('second') == [1, 0]
+    assert graph.lineage('second', 4) == [4, 3, 1, 0]
+    assert graph.depths('second').tolist() == [0, 1, 2, 2, 3]
+    assert graph.num_children('second').tolist() == [1, 2, 0, 1, 0]
+    assert graph.children('second', 1).tolist() == [2, 3]
+    assert graph.children('first', 0).tolist() == [1, 2]
+
+def test_version_graph_unknown_article(version_graph):
+    _, graph = version_graph
+    assert 'third' not in graph
+    with pytest.raises(LookupError):
+        graph.lineage('third')
@@ -0,0 +1,111 @@
+import bz2
+import os
+
+import pytest
+
+import wikivision
+from wikivision.__main__ import main
+
+from test_data import FakeAPI, fake_api, _make_dump
+
+
+@pytest.fixture
+def db_name(tmpdir):
+    return str(tmpdir.join('histories'))
+
+
+def test_fetch_articles_from_command_line_and_file(fake_api, db_name, tmpdir,
+                                                   capsys):
+    slugs_file = tmpdir.join('slugs.txt')
+    slugs_file.write('# featured articles\nsecond_slug\n\nfirst_slug\n')
+
+    exit_code = main(['--db', db_name, 'fetch', 'first_slug',
+                      '--file', str(slugs_file), '--api-endpoint', fake_api])
+    assert exit_code == 0
+    assert sorted(FakeAPI.titles) == ['first_slug', 'second_slug']
+    assert '10 revisions' in capsys.readouterr().err
+
+    db_con = wikivision.connect_db(db_name)
+    stats = wikivision.select_article_stats(db_con)
+    db_con.close()
+    assert stats.article_slug.tolist() == ['first_slug', 'second_slug']
+    assert stats.complete.all()
+
+
+def test_fetch_skips_complete_articles(fake_api, db_name):
+    main(['--db', db_name, 'fetch', 'test_slug', '--api-endpoint', fake_api])
+    FakeAPI.requests = []
+    main(['--db', db_name, 'fetch', 'test_slug', '--api-endpoint', fake_api])
+    assert FakeAPI.requests == []
+
+
+def test_fetch_resumes_partly_fetched_articles(fake_api, db_name):
+    db_con = wikivision.connect_db(db_name)
+    # interrupt fetching after the first page
+    pages = wikivision.request_pages('test_slug', api_endpoint=fake_api,
+                                     rvdir='newer')
+    first_page = wikivision.format_revisions(next(pages), 'test_slug')
+    for revisions in wikivision.tidy_revision_pages([first_page]):
+        wikivision.append_revisions(revisions, db_con)
+    assert wikivision.select_article_status('test_slug', db_con) == 'partial'
+
+    FakeAPI.requests = []
+    main(['--db', db_name, 'fetch', 'test_slug', '--api-endpoint', fake_api])
+    assert FakeAPI.requests[0]['rvstartid'] == '2'
+    assert wikivision.select_article_status('test_slug', db_con) == 'complete'
+
+    revisions = wikivision.select_revisions_by_article('test_slug', db_con)
+    db_con.close()
+    assert revisions.wikitext.tolist() == list('abcbd')
+
+
+def test_stats(fake_api, db_name, capsys):
+    main(['--db', db_name, 'fetch', 'test_slug', '--api-endpoint', fake_api])
+    capsys.readouterr()
+    assert main(['--db', db_name, 'stats']) == 0
+    out = capsys.readouterr().out
+    assert 'test_slug' in out
+    assert '1 articles (1 complete), 5 revisions' in out
+
+
+def test_render_all_articles(fake_api, db_name, tmpdir, capsys):
+    main(['--db', db_name, 'fetch', 'test_slug', '--api-endpoint', fake_api])
+    cache_dir = str(tmpdir.join('renders'))
+    exit_code = main(['--db', db_name, 'render', '--all', '--format', 'gv',
+                      '--cache-dir', cache_dir])
+    assert exit_code == 0
+    assert len(os.listdir(cache_dir)) == 1
+
+
+def test_load_dump(db_name, tmpdir, capsys):
+    path = str(tmpdir.join('dump.xml.bz2'))
+    with bz2.open(path, 'wb') as f:
+        f.write(_make_dump([('First article', 0, 'abc'),
+                            ('Second article', 0, 'ab')]))
+
+    assert main(['--db', db_name, 'load', path, 'Second_article']) == 0
+    assert '[1/1] loaded Second_article: 2 revisions' in capsys.readouterr().err
+
+
+def test_load_dump_fails_if_any_article_fails(db_name, tmpdir, capsys):
+    path = str(tmpdir.join('dump.xml'))
+    dump = _make_dump([('First article', 0, 'abc')])
+    with open(path, 'wb') as f:
+        f.write(dump.replace(b'<parentid>2</parentid>',
+                             b'<parentid>99</parentid>'))
+
+    assert main(['--db', db_name, 'load', path]) == 1
+    assert '[1/?] loaded First_article: failed' in capsys.readouterr().err
+
+
+def test_export(db_name, tmpdir, capsys):
+    pytest.importorskip('pyarrow')
+    path = str(tmpdir.join('dump.xml'))
+    with open(path, 'wb') as f:
+        f.write(_make_dump([('First article', 0, 'abc')]))
+    main(['--db', db_name, 'load', path])
+
+    directory = str(tmpdir.join('export'))
+    assert main(['--db', db_name, 'export', directory, '--no-wikitexts']) == 0
+    assert '[1/1] exported First_article: 3 revisions' in capsys.readouterr().err
+    assert os.listdir(directory) == ['revisions']
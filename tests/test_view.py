@@ -1,3 +1,5 @@
+import os
+
 import pytest
 import graphviz
 from numpy import nan
@@ -46,3 +48,220 @@ def test_graph_body_correct_length(simple_edges):
     expected_body_len = num_nodes + num_edges
 
     assert len(simple_graph.body), expected_body_len
+
+
+@pytest.mark.parametrize('hashes', ['categorical', 'binary'])
+def test_graph_compact_revisions(hashes):
+    revisions = pd.DataFrame({
+        'parent_sha1': [nan, 'aa', 'bb', 'aa'],
+        'rev_sha1': ['aa', 'bb', 'aa', 'cc'],
+        'rev_type': ['root', 'reversion', 'branch', 'head'],
+    })
+    compact = wikivision.compact_revisions(revisions, hashes=hashes)
+
+    nodes = wikivision.format_nodes(compact, highlight=True)
+    expected = wikivision.format_nodes(revisions, highlight=True)
+    assert nodes.label.tolist() == expected.label.tolist()
+    assert nodes.color.tolist() == expected.color.tolist()
+
+    edges = wikivision.format_edges(compact.iloc[1:])
+    g = wikivision.graph(edges, nodes)
+    assert len(g.body) == len(nodes) + len(edges)
+
+
+def _graph_node_by_node(edges, nodes, remove_labels=False):
+    g = graphviz.Digraph(graph_attr={'rankdir': 'LR'})
+    for _, attrs in nodes.to_dict('index').items():
+        if remove_labels:
+            attrs['label'] = ''
+        g.node(**attrs)
+    g.edges([(from_node, to_node) for _, (from_node, to_node) in edges.iterrows()])
+    return g
+
+
+@pytest.mark.parametrize('remove_labels', [False, True])
+def test_graph_matches_graphing_node_by_node(remove_labels):
+    revisions = pd.DataFrame({
+        'parent_sha1': [nan, 'a1', 'b 2', 'a1'],
+        'rev_sha1': ['a1', 'b 2', 'a1', 'c"3'],
+        'rev_type': ['root', 'reversion', 'branch', 'head'],
+    })
+    nodes = wikivision.format_nodes(revisions, highlight=True)
+    edges = revisions[['parent_sha1', 'rev_sha1']].iloc[1:]
+
+    g = wikivision.graph(edges, nodes, remove_labels=remove_labels)
+    expected = _graph_node_by_node(edges, nodes, remove_labels=remove_labels)
+    assert g.source == expected.source
+
+
+def test_graph_edges_weighted_by_edits():
+    revisions = pd.DataFrame({
+        'parent_sha1': [nan, 'a', 'b'],
+        'rev_sha1': ['a', 'b', 'c'],
+        'rev_type': ['root', 'branch', 'head'],
+        'edit_distance': [nan, 9, nan],
+    })
+    edges = wikivision.format_edges(revisions.iloc[1:], edits=True)
+    assert edges.penwidth.tolist() == ['2.0', '1.0']
+
+    g = wikivision.graph(edges)
+    expected = graphviz.Digraph(graph_attr={'rankdir': 'LR'})
+    for name in 'abc':
+        expected.node(name, label=name)
+    expected.edge('a', 'b', penwidth='2.0')
+    expected.edge('b', 'c', penwidth='1.0')
+    assert g.source == expected.source
+
+
+def test_graph_infers_nodes_from_edges(simple_edges):
+    g = wikivision.graph(simple_edges)
+    assert g.body[:3] == ['\ta [label=a]\n', '\tb [label=b]\n', '\tc [label=c]\n']
+
+
+# render_article_revisions
+# ------------------------
+
+def _append_wikitexts(wikitexts, db_con):
+    json_revisions = [
+        {'revid': rev_id, 'parentid': rev_id - 1, '*': wikitext,
+         'timestamp': '2000-01-{:02d}T00:00:00Z'.format(rev_id)}
+        for rev_id, wikitext in enumerate(wikitexts, start=1)
+    ]
+    revisions = wikivision.format_revisions(json_revisions, 'test_slug')
+    wikivision.append_revisions(wikivision.tidy_article_revisions(revisions),
+                                db_con)
+
+
+@pytest.fixture
+def render_db(tmpdir, monkeypatch):
+    db_con = wikivision.connect_db(str(tmpdir.join('histories')))
+    _append_wikitexts('abac', db_con)
+
+    graphed = []
+    graph_article_revisions = wikivision.view.graph_article_revisions
+
+    def count_graphs(*args, **kwargs):
+        graphed.append(args)
+        return graph_article_revisions(*args, **kwargs)
+
+    monkeypatch.setattr(wikivision.view, 'graph_article_revisions',
+                        count_graphs)
+    yield db_con, graphed
+    db_con.close()
+
+
+def test_rendered_graphs_are_cached(render_db, tmpdir):
+    db_con, graphed = render_db
+    cache = wikivision.RenderCache(str(tmpdir.join('renders')))
+
+    path = wikivision.render_article_revisions('test_slug', format='gv',
+                                               db_con=db_con, cache=cache)
+    cached = wikivision.render_article_revisions('test_slug', format='gv',
+                                                 db_con=db_con, cache=cache)
+    assert cached == path
+    assert len(graphed) == 1
+    assert open(path).read().startswith('digraph')
+
+    wikivision.render_article_revisions('test_slug', format='gv', labels=True,
+                                        db_con=db_con, cache=cache)
+    assert len(graphed) == 2
+
+
+def test_new_head_revision_invalidates_rendered_graph(render_db, tmpdir):
+    db_con, graphed = render_db
+    cache = wikivision.RenderCache(str(tmpdir.join('renders')))
+    path = wikivision.render_article_revisions('test_slug', format='gv',
+                                               db_con=db_con, cache=cache)
+
+    _append_wikitexts('abacd', db_con)
+    new_path = wikivision.render_article_revisions('test_slug', format='gv',
+                                                   db_con=db_con, cache=cache)
+    assert new_path != path
+    assert len(graphed) == 2
+    assert os.listdir(cache.directory) == [os.path.basename(new_path)]
+
+
+def test_reverted_head_revision_invalidates_rendered_graph(render_db, tmpdir):
+    db_con, graphed = render_db
+    cache = wikivision.RenderCache(str(tmpdir.join('renders')))
+    path = wikivision.render_article_revisions('test_slug', format='gv',
+                                               db_con=db_con, cache=cache)
+
+    # the head is reverted to the same wikitext as before
+    _append_wikitexts('abacdc', db_con)
+    new_path = wikivision.render_article_revisions('test_slug', format='gv',
+                                                   db_con=db_con, cache=cache)
+    assert new_path != path
+    assert len(graphed) == 2
+
+
+def test_other_formats_are_rendered_from_cached_source(render_db, tmpdir,
+                                                       monkeypatch):
+    db_con, graphed = render_db
+    cache = wikivision.RenderCache(str(tmpdir.join('renders')))
+    piped = []
+
+    def pipe(self, format=None, **kwargs):
+        piped.append(format)
+        return self.source.encode('utf-8')
+
+    monkeypatch.setattr(graphviz.Digraph, 'pipe', pipe)
+    monkeypatch.setattr(graphviz.Source, 'pipe', pipe)
+
+    svg = wikivision.render_article_revisions('test_slug', format='svg',
+                                              db_con=db_con, cache=cache)
+    png = wikivision.render_article_revisions('test_slug', format='png',
+                                              db_con=db_con, cache=cache)
+    assert len(graphed) == 1
+    assert piped == ['svg', 'png']
+    assert open(png).read() == open(svg).read()
+    assert sorted(os.path.splitext(name)[1]
+                  for name in os.listdir(cache.directory)) == \
+        ['.gv', '.png', '.svg']
+
+
+def test_render_graph_weighted_by_edits(render_db, tmpdir):
+    db_con, _ = render_db
+    cache = wikivision.RenderCache(str(tmpdir.join('renders')))
+    path = wikivision.render_article_revisions('test_slug', format='gv',
+                                               db_con=db_con, cache=cache,
+                                               edits=True)
+    assert 'penwidth=' in open(path).read()
+    num_edits = db_con.execute('SELECT COUNT(*) FROM edits').fetchone()[0]
+    assert num_edits == 3
+
+
+def test_render_cache_evicts_least_recently_used(tmpdir):
+    cache = wikivision.RenderCache(str(tmpdir), max_bytes=100)
+    g = graphviz.Digraph(body=['\ta\n' * 10])
+    keys = [cache.key(slug, 'sha1') for slug in 'abc']
+
+    cache.put(keys[0], g, 'gv')
+    cache.put(keys[1], g, 'gv')
+    os.utime(cache.path(keys[0], 'gv'), (0, 0))
+    os.utime(cache.path(keys[1], 'gv'), (1, 1))
+    cache.get(keys[0], 'gv')
+    cache.put(keys[2], g, 'gv')
+
+    assert cache.get(keys[0], 'gv') is not None
+    assert cache.get(keys[1], 'gv') is None
+    assert cache.get(keys[2], 'gv') is not None
+
+
+# nest_versions
+# -------------
+
+def test_nest_versions_of_deep_history():
+    num_versions = 5000
+    revisions = pd.DataFrame({
+        'rev_version': range(num_versions),
+        'parent_version': [nan] + list(range(num_versions - 1)),
+    })
+    tree = wikivision.nest_versions(revisions, depth=num_versions)
+
+    depth = 0
+    while 'children' in tree:
+        tree, = tree['children']
+        depth += 1
+    assert depth == num_versions - 1
+    assert tree['num_children'] == 0
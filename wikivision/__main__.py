@@ -1,7 +1,13 @@
 #!/usr/bin/python
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import logging
+import sys
+import time
+from urllib.parse import quote
 
-from wikivision.app import app
+import wikivision
+from wikivision.app import app, serve
 
 
 def get_parser():
@@ -9,11 +15,326 @@ def get_parser():
         prog='python -m wikivision',
         description="Visualize Wikipedia article revision histories.",
     )
-    parser.add_argument('article_slug', nargs='?')
+    parser.add_argument('--db', default=app.config['DB_NAME'],
+                        help="Name of the database of revisions.")
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    subparsers.required = True
+
+    serve_parser = subparsers.add_parser('serve', help="Run the web app.")
+    serve_parser.add_argument(
+        'article_slug', nargs='?',
+        help="An article to visualize once the app is running.",
+    )
+    serve_parser.add_argument('--host', default='127.0.0.1',
+                              help="The address to listen on.")
+    serve_parser.add_argument('--port', type=int, default=5000,
+                              help="The port to listen on.")
+    serve_parser.add_argument('--workers', type=int, default=1,
+                              help="Number of worker processes. More than "
+                                   "one requires gunicorn.")
+    serve_parser.add_argument('--threads', type=int, default=8,
+                              help="Number of threads handling requests in "
+                                   "each worker process.")
+    serve_parser.add_argument('--debug', action='store_true',
+                              help="Run the development server in debug mode.")
+
+    fetch_parser = subparsers.add_parser(
+        'fetch', help="Fetch the revisions of articles not in the database.",
+        description="Fetch the revisions of articles. Articles already in "
+                    "the database are skipped, and articles that were only "
+                    "partly fetched are picked up where they left off, so "
+                    "an interrupted fetch can be resumed by running it again.",
+    )
+    add_article_arguments(fetch_parser)
+    add_fetch_arguments(fetch_parser)
+
+    refresh_parser = subparsers.add_parser(
+        'refresh', help="Fetch new revisions of articles in the database.",
+    )
+    add_article_arguments(refresh_parser, all_articles=True)
+    add_fetch_arguments(refresh_parser)
+
+    load_parser = subparsers.add_parser(
+        'load', help="Load articles from a MediaWiki XML dump.",
+        description="Load the revision histories of articles from a "
+                    "pages-meta-history XML dump, which may be compressed "
+                    "with bz2 or gzip. Only the lead section of each "
+                    "revision is kept, as when fetching from the API. "
+                    "Articles in the database are replaced.",
+    )
+    load_parser.add_argument('dump', help="Path to the dump.")
+    add_article_arguments(load_parser)
+    load_parser.add_argument('--namespaces', type=int, nargs='+', default=[0],
+                             help="Namespaces of the pages to load.")
+
+    export_parser = subparsers.add_parser(
+        'export', help="Export articles to parquet files for analysis.",
+        description="Export the revisions of articles in the database to "
+                    "parquet files partitioned by article, which can be read "
+                    "with wikivision.read_revisions. Requires pyarrow.",
+    )
+    export_parser.add_argument('directory',
+                               help="Where to write the parquet files.")
+    add_article_arguments(export_parser)
+    export_parser.add_argument('--no-wikitexts', dest='wikitexts',
+                               action='store_false',
+                               help="Only export the metadata of revisions.")
+
+    render_parser = subparsers.add_parser(
+        'render', help="Render graphs of the revision histories of articles.",
+    )
+    add_article_arguments(render_parser, all_articles=True)
+    render_parser.add_argument('--format', default='svg',
+                               help="Output format, e.g., svg, png, or gv "
+                                    "for DOT source.")
+    render_parser.add_argument('--highlight', action='store_true')
+    render_parser.add_argument('--labels', action='store_true')
+    render_parser.add_argument('--edits', action='store_true',
+                               help="Draw edges wider the bigger the edit.")
+    render_parser.add_argument('--cache-dir',
+                               default=wikivision.RENDER_CACHE_DIR,
+                               help="Where to store rendered graphs.")
+    render_parser.add_argument('--workers', type=int, default=4,
+                               help="Number of graphs to render at a time.")
+
+    stats_parser = subparsers.add_parser(
+        'stats', help="Summarize the articles in the database.",
+    )
+    add_article_arguments(stats_parser)
+
     return parser
 
 
-if __name__ == '__main__':
+def add_article_arguments(parser, all_articles=False):
+    parser.add_argument('article_slugs', nargs='*', metavar='article_slug')
+    parser.add_argument('-f', '--file', type=argparse.FileType('r'),
+                        help="File of article slugs, one per line. Use - "
+                             "for stdin.")
+    if all_articles:
+        parser.add_argument('--all', action='store_true',
+                            help="All articles in the database.")
+
+
+def add_fetch_arguments(parser):
+    parser.add_argument('--workers', type=int, default=4,
+                        help="Number of articles to fetch at a time.")
+    parser.add_argument('--requests-per-second', type=float,
+                        help="Limit on the rate of requests to the "
+                             "Wikipedia API.")
+    parser.add_argument('--api-endpoint', default=wikivision.API_ENDPOINT,
+                        help="URL of the MediaWiki API to fetch from.")
+
+
+def read_article_slugs(args):
+    """Collect article slugs from the command line and any file of slugs.
+
+    Blank lines and lines starting with # in files are ignored. Duplicate
+    slugs are dropped.
+    """
+    article_slugs = list(args.article_slugs)
+    if args.file is not None:
+        for line in args.file:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                article_slugs.append(line)
+    if getattr(args, 'all', False):
+        db_con = wikivision.connect_db(args.db)
+        try:
+            article_slugs.extend(wikivision.select_article_stats(db_con)
+                                 .article_slug.tolist())
+        finally:
+            db_con.close()
+    # drop duplicates, keeping the order
+    return list(dict.fromkeys(article_slugs))
+
+
+class ProgressReporter(object):
+    """Report the progress and throughput of a batch of articles."""
+
+    def __init__(self, total, verb, stream=None):
+        self.total = total
+        self.verb = verb
+        self.stream = stream or sys.stderr
+        self.done = 0
+        self.failed = 0
+        self.revisions = 0
+        self.start = time.time()
+
+    def __call__(self, article_slug, result, revisions=0):
+        self.done += 1
+        if result is None:
+            self.failed += 1
+            outcome = 'failed'
+        else:
+            self.revisions += revisions
+            outcome = result
+        elapsed = time.time() - self.start
+        self.stream.write('[{}/{}] {} {}: {} ({:.1f} articles/s)\n'.format(
+            self.done, self.total, self.verb, article_slug, outcome,
+            self.done / elapsed if elapsed else 0,
+        ))
+        self.stream.flush()
+
+    def summarize(self):
+        elapsed = time.time() - self.start
+        self.stream.write(
+            '{} {} articles ({} failed), {} revisions in {:.1f}s '
+            '({:.1f} revisions/s)\n'.format(
+                self.verb, self.done, self.failed, self.revisions, elapsed,
+                self.revisions / elapsed if elapsed else 0,
+            )
+        )
+
+
+def fetch(args, refresh=False):
+    article_slugs = read_article_slugs(args)
+    progress = ProgressReporter(len(article_slugs),
+                                'refreshed' if refresh else 'fetched')
+
+    def report(article_slug, num_revisions):
+        if num_revisions is None:
+            progress(article_slug, None)
+        else:
+            progress(article_slug, '{} revisions'.format(num_revisions),
+                     revisions=num_revisions)
+
+    results = wikivision.get_many_article_revisions(
+        article_slugs, workers=args.workers, db_name=args.db,
+        requests_per_second=args.requests_per_second, refresh=refresh,
+        callback=report, api_endpoint=args.api_endpoint,
+    )
+    progress.summarize()
+    return 1 if None in results.values() else 0
+
+
+def load(args):
+    article_slugs = read_article_slugs(args) or None
+    progress = ProgressReporter(len(article_slugs) if article_slugs else '?',
+                                'loaded')
+
+    def report(article_slug, num_revisions):
+        if num_revisions is None:
+            progress(article_slug, None)
+        else:
+            progress(article_slug, '{} revisions'.format(num_revisions),
+                     revisions=num_revisions)
+
+    db_con = wikivision.connect_db(args.db)
+    try:
+        results = wikivision.load_dump(args.dump, db_con,
+                                       article_slugs=article_slugs,
+                                       namespaces=args.namespaces,
+                                       callback=report)
+    finally:
+        db_con.close()
+    progress.summarize()
+    return 1 if None in results.values() else 0
+
+
+def export(args):
+    article_slugs = read_article_slugs(args) or None
+    db_con = wikivision.connect_db(args.db)
+    try:
+        if article_slugs is None:
+            article_slugs = (wikivision.select_article_stats(db_con)
+                             .article_slug.tolist())
+        progress = ProgressReporter(len(article_slugs), 'exported')
+
+        def report(article_slug, num_revisions):
+            progress(article_slug, '{} revisions'.format(num_revisions),
+                     revisions=num_revisions)
+
+        wikivision.export_revisions(args.directory, db_con,
+                                    article_slugs=article_slugs,
+                                    wikitexts=args.wikitexts, callback=report)
+    finally:
+        db_con.close()
+    progress.summarize()
+    return 0
+
+
+def render(args):
+    article_slugs = read_article_slugs(args)
+    progress = ProgressReporter(len(article_slugs), 'rendered')
+    cache = wikivision.RenderCache(args.cache_dir)
+
+    def render_article(article_slug):
+        return wikivision.render_article_revisions(
+            article_slug, format=args.format, highlight=args.highlight,
+            labels=args.labels, db_con=wikivision.get_db(args.db),
+            cache=cache, edits=args.edits,
+        )
+
+    failed = False
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(render_article, article_slug): article_slug
+                   for article_slug in article_slugs}
+        for future in as_completed(futures):
+            try:
+                path = future.result()
+            except Exception:
+                logging.exception('unable to render {}'.format(
+                                  futures[future]))
+                path = None
+                failed = True
+            progress(futures[future], path)
+    progress.summarize()
+    return 1 if failed else 0
+
+
+def stats(args):
+    article_slugs = read_article_slugs(args) or None
+    db_con = wikivision.connect_db(args.db)
+    try:
+        article_stats = wikivision.select_article_stats(
+            db_con, article_slugs=article_slugs
+        )
+    finally:
+        db_con.close()
+
+    if len(article_stats):
+        print(article_stats.to_string(index=False))
+    print('{} articles ({} complete), {} revisions'.format(
+        len(article_stats), article_stats.complete.sum(),
+        article_stats.revisions.sum(),
+    ))
+    return 0
+
+
+def run_server(args):
+    app.config['DB_NAME'] = args.db
+
+    url = 'http://{}:{}/'.format(args.host, args.port)
+    if args.article_slug:
+        url += '?article_slug={}'.format(quote(args.article_slug))
+    logging.info('serving wikivision at {}'.format(url))
+
+    if args.debug:
+        app.run(host=args.host, port=args.port, debug=True)
+    else:
+        serve(host=args.host, port=args.port, workers=args.workers,
+              threads=args.threads)
+    return 0
+
+
+COMMANDS = {
+    'serve': run_server,
+    'fetch': fetch,
+    'refresh': lambda args: fetch(args, refresh=True),
+    'load': load,
+    'export': export,
+    'render': render,
+    'stats': stats,
+}
+
+
+def main(argv=None):
     parser = get_parser()
-    args = parser.parse_args()
-    app.run(debug=True)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING if args.command != 'serve'
+                        else logging.INFO)
+    return COMMANDS[args.command](args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,16 +1,160 @@
-from flask import Flask, render_template, jsonify, request
+import gzip
+
+from flask import Flask, render_template, jsonify, request, abort, url_for
 app = Flask('wikivision')
+app.config['DB_NAME'] = 'histories'
+
+from wikivision.data import (get_db, select_revisions_by_article,
+                             select_active_job, select_article_status,
+                             select_job, select_last_job, start_fetch_job,
+                             JOB_NOT_FOUND_ERROR)
+from wikivision.view import nest_versions, TREE_DEPTH, TREE_MAX_DEPTH
 
-from wikivision.data import get_article_revisions
-from wikivision.view import tree_format
+# The metadata of each version in a tree, never the wikitexts.
+TREE_COLUMNS = ['rev_id', 'timestamp', 'rev_sha1', 'rev_version',
+                'parent_version', 'rev_type']
+
+# Responses smaller than this aren't worth compressing.
+GZIP_MIN_BYTES = 500
 
 
 @app.route('/')
 def index():
     article_slug = request.args.get('article_slug')
-    if article_slug:
-        revisions = get_article_revisions(article_slug)
-        tree_data = {'nodes': tree_format(revisions)}
-    else:
-        tree_data = None
-    return render_template('index.html', tree_data=tree_data)
+    return render_template('index.html', article_slug=article_slug)
+
+
+@app.route('/api/tree/<article_slug>')
+def tree(article_slug):
+    """Serve the tree of versions of an article as JSON, a subtree at a time.
+
+    If the article isn't completely in the database yet, e.g., because an
+    earlier fetch failed partway, a job is started to fetch the rest of it
+    in the background, and the job is returned with status 202 instead.
+    See `job`. Articles that a job found no revisions of are not found.
+
+    Query parameters:
+        root: The version at the root of the subtree. Defaults to the
+            first version.
+        depth: The number of levels to nest below the root.
+        offset: The number of children of the root to skip.
+        limit: The most children of each node to include.
+    """
+    root = request.args.get('root', type=int)
+    depth = min(request.args.get('depth', TREE_DEPTH, type=int),
+                TREE_MAX_DEPTH)
+    offset = request.args.get('offset', 0, type=int)
+    limit = request.args.get('limit', type=int)
+
+    db_con = get_db(app.config['DB_NAME'])
+    # revisions of an article being fetched, or whose fetch failed, are
+    # incomplete
+    status = select_article_status(article_slug, db_con)
+    active_job_id = select_active_job(article_slug, db_con)
+    if status == 'missing' and active_job_id is None:
+        last_job = select_last_job(article_slug, db_con)
+        if last_job is not None and last_job['error'] == JOB_NOT_FOUND_ERROR:
+            abort(404)
+    if status != 'complete' or active_job_id is not None:
+        job_id = start_fetch_job(article_slug, db_name=app.config['DB_NAME'],
+                                 refresh=status == 'partial')
+        return job_response(job_id, db_con), 202
+
+    revisions = select_revisions_by_article(article_slug, db_con,
+                                            columns=TREE_COLUMNS)
+
+    try:
+        tree = nest_versions(revisions, root=root, depth=depth,
+                             offset=offset, limit=limit)
+    except KeyError:
+        abort(404)
+
+    response = jsonify(article_slug=article_slug,
+                       num_versions=int(revisions.rev_version.max()) + 1,
+                       tree=tree)
+    return gzipped(response)
+
+
+@app.route('/api/jobs/<int:job_id>')
+def job(job_id):
+    """Serve the status and progress of a background job as JSON."""
+    try:
+        return job_response(job_id, get_db(app.config['DB_NAME']))
+    except LookupError:
+        abort(404)
+
+
+def job_response(job_id, db_con):
+    job = select_job(job_id, db_con)
+    job['status_url'] = url_for('job', job_id=job_id)
+    return jsonify(job=job)
+
+
+def gzipped(response):
+    """Compress a response if the client accepts gzip encoding."""
+    accept_encoding = request.headers.get('Accept-Encoding', '')
+    if 'gzip' not in accept_encoding.lower():
+        return response
+
+    data = response.get_data()
+    if len(data) < GZIP_MIN_BYTES:
+        return response
+
+    response.set_data(gzip.compress(data))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Content-Length'] = len(response.get_data())
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def serve(host='127.0.0.1', port=5000, workers=1, threads=8):
+    """Serve the app with a production WSGI server.
+
+    Multiple worker processes are run by gunicorn, which must be installed
+    separately. A single worker process is served by CherryPy's threaded
+    WSGI server instead, or by gunicorn if CherryPy isn't available.
+
+    Args:
+        host: The address to listen on.
+        port: The port to listen on.
+        workers: The number of worker processes.
+        threads: The number of threads handling requests in each worker.
+    """
+    if workers == 1:
+        server = _make_cherrypy_server(host, port, threads)
+        if server is not None:
+            try:
+                server.start()
+            except KeyboardInterrupt:
+                server.stop()
+            return
+
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        if workers == 1:
+            raise ImportError('serving requires CherryPy or gunicorn')
+        raise ImportError('serving more than one worker requires gunicorn')
+
+    class GunicornApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', '{}:{}'.format(host, port))
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+            self.cfg.set('worker_class', 'gthread')
+
+        def load(self):
+            return app
+
+    GunicornApplication().run()
+
+
+def _make_cherrypy_server(host, port, threads):
+    try:
+        from cheroot.wsgi import Server
+    except ImportError:
+        try:
+            from cherrypy.wsgiserver import CherryPyWSGIServer as Server
+        except ImportError:
+            return None
+    return Server((host, port), app, numthreads=threads)
@@ -1,15 +1,125 @@
+import bz2
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
+                                as_completed)
+import difflib
+from functools import partial
+import gzip
 import hashlib
+import itertools
+import json
 import logging
-
+import multiprocessing
+import os
+import re
+import threading
+import time
+from xml.etree import ElementTree
+import zlib
+
+import numpy as np
 import pandas as pd
 from numpy import nan
 import requests
+from requests.adapters import HTTPAdapter
 import sqlite3
+from urllib3.util.retry import Retry
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.dataset
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+API_ENDPOINT = 'https://en.wikipedia.org/w/api.php'
+USER_AGENT = 'wikivision (https://github.com/evoapps/wikivision)'
+
+
+# Revision metadata. Wikitexts are stored separately, keyed by rev_sha1.
+REVISIONS_COLUMNS = [
+    ('article_slug', 'TEXT NOT NULL'),
+    ('rev_id', 'INTEGER PRIMARY KEY'),
+    ('parent_id', 'INTEGER'),
+    ('timestamp', 'INTEGER'),  # seconds since the epoch
+    ('rev_sha1', 'TEXT'),
+    ('parent_sha1', 'TEXT'),
+    ('rev_version', 'INTEGER'),
+    ('parent_version', 'INTEGER'),
+    ('rev_type', 'TEXT'),
+]
+
+# All of the columns of a revision, in order.
+ALL_COLUMNS = ([name for name, _ in REVISIONS_COLUMNS[:4]] + ['wikitext'] +
+               [name for name, _ in REVISIONS_COLUMNS[4:]])
+
+# The columns needed to graph an article's revision history.
+METADATA_COLUMNS = ['rev_id', 'parent_id', 'timestamp', 'rev_sha1',
+                    'parent_sha1', 'rev_version', 'parent_version', 'rev_type']
+
+# Compression applied to new wikitexts stored in the database.
+# One of None, 'zlib' or 'zstd' (requires the zstandard package).
+WIKITEXT_COMPRESSION = 'zstd' if zstandard is not None else 'zlib'
+
+# Whether to store new wikitexts as deltas against their parent version,
+# and the most deltas in a row before a full wikitext is stored again.
+WIKITEXT_DELTAS = False
+WIKITEXT_SNAPSHOT_INTERVAL = 20
+
+# Number of reconstructed wikitexts kept in memory.
+WIKITEXT_CACHE_SIZE = 256
+
+# Number of workers used to hash wikitexts.
+HASH_WORKERS = 1
+
+# Number of processes used to measure edits between versions, and the
+# combined length of two wikitexts beyond which the edit distance between
+# them isn't measured.
+EDIT_WORKERS = 1
+EDIT_MAX_CHARS = 500000
+
+# Possible revision types, in the order of their categorical codes.
+REV_TYPES = ['root', 'branch', 'head', 'reversion', 'dead']
+
+# Number of background jobs fetching articles at the same time, and how
+# long a job can go without making progress before it's presumed dead.
+JOB_WORKERS = 2
+JOB_TIMEOUT = 10 * 60
+
+# The error of jobs that found no revisions, e.g., of nonexistent articles.
+JOB_NOT_FOUND_ERROR = 'article not found'
+
+# Number of revisions from an XML dump that are tidied and stored at a time.
+DUMP_PAGE_SIZE = 500
+
+# Matches the section headings of a wikitext, e.g., "== History ==".
+SECTION_HEADING = re.compile(r'^(={1,6})[^\n]+\1[ \t]*$', re.MULTILINE)
+
+# Marks arguments that default to a module setting, for arguments where
+# None has a meaning of its own.
+_DEFAULT = object()
+
+# Maximum number of parameters in a query for older versions of sqlite.
+SQLITE_MAX_VARIABLES = 999
+
+# Compression of the parquet files written by `export_revisions`.
+PARQUET_COMPRESSION = 'zstd'
 
 
 def connect_db(name='histories'):
     """Return a connection to the database.
 
+    The database schema is created, or migrated from an older version,
+    if necessary. The database is put in write-ahead logging mode, so
+    that readers don't wait on writers and writers don't wait on readers.
+
     Args:
         name (str): A name to be used as the filename for the sqlite
             database.
@@ -21,65 +131,772 @@ def connect_db(name='histories'):
             # ... interact with the database
             db_con.close()
     """
-    return sqlite3.connect('{}.sqlite'.format(name))
+    db_con = sqlite3.connect('{}.sqlite'.format(name))
+    db_con.execute('PRAGMA journal_mode=WAL')
+    db_con.execute('PRAGMA synchronous=NORMAL')
+    migrate_db(db_con)
+    return db_con
+
+
+def get_db(name='histories'):
+    """Return a connection to the database for the current thread.
+
+    Each thread reuses its own connection to each database rather than
+    connecting and migrating the database every time. Connections are
+    never shared between threads, or between processes, so forked worker
+    processes connect again. Don't close the connection when done with it.
+
+    Args:
+        name (str): The name of the database. See `connect_db`.
+    """
+    if getattr(_db_connections, 'pid', None) != os.getpid():
+        _db_connections.pid = os.getpid()
+        _db_connections.by_name = {}
+    if name not in _db_connections.by_name:
+        _db_connections.by_name[name] = connect_db(name)
+    return _db_connections.by_name[name]
+
+
+def close_db(name='histories'):
+    """Close the current thread's connection to the database, if open."""
+    by_name = getattr(_db_connections, 'by_name', {})
+    if getattr(_db_connections, 'pid', None) == os.getpid() and name in by_name:
+        by_name.pop(name).close()
+
+
+_db_connections = threading.local()
+
+
+def migrate_db(db_con):
+    """Bring the schema of the database up to date.
+
+    The version of the schema is stored in the database's `user_version`,
+    and each migration that hasn't been applied yet is applied in order.
+
+    Args:
+        db_con: An open connection to the database.
+    """
+    def get_schema_version():
+        return db_con.execute('PRAGMA user_version').fetchone()[0]
+
+    if get_schema_version() >= len(MIGRATIONS):
+        return
+
+    # Manage the transaction explicitly so that the write lock is held
+    # for the whole migration, even by other connections migrating the
+    # same database at the same time.
+    isolation_level = db_con.isolation_level
+    db_con.isolation_level = None
+    try:
+        db_con.execute('BEGIN IMMEDIATE')
+        try:
+            schema_version = get_schema_version()
+            for version, migration in enumerate(MIGRATIONS, start=1):
+                if version <= schema_version:
+                    continue
+                logging.info('migrating database to version {}'.format(version))
+                migration(db_con)
+                db_con.execute('PRAGMA user_version = {}'.format(version))
+        except Exception:
+            db_con.execute('ROLLBACK')
+            raise
+        else:
+            db_con.execute('COMMIT')
+    finally:
+        db_con.isolation_level = isolation_level
+
+
+def _create_revisions_table(db_con):
+    """Create an indexed revisions table.
+
+    Revisions are keyed by rev_id, and can be looked up by article in
+    chronological order. Revisions tables created by previous versions of
+    wikivision, which had no keys or indexes, are migrated to the new table.
+    """
+    legacy_columns = _get_column_names('revisions', db_con)
+    if legacy_columns:
+        db_con.execute('ALTER TABLE revisions RENAME TO legacy_revisions')
+
+    # the schema at this version, before wikitexts were stored separately
+    columns = [
+        ('article_slug', 'TEXT NOT NULL'),
+        ('rev_id', 'INTEGER PRIMARY KEY'),
+        ('parent_id', 'INTEGER'),
+        ('timestamp', 'INTEGER'),
+        ('wikitext', 'TEXT'),
+        ('rev_sha1', 'TEXT'),
+        ('parent_sha1', 'TEXT'),
+        ('rev_version', 'INTEGER'),
+        ('parent_version', 'INTEGER'),
+        ('rev_type', 'TEXT'),
+    ]
+    _create_table('revisions', columns, db_con)
+    db_con.execute('CREATE INDEX revisions_article_slug_timestamp '
+                   'ON revisions (article_slug, timestamp)')
+
+    if legacy_columns:
+        names = [name for name, _ in columns if name in legacy_columns]
+        values = [name if name != 'timestamp' else
+                  "CAST(strftime('%s', timestamp) AS INTEGER)"
+                  for name in names]
+        if 'article_slug' in names:
+            db_con.execute(
+                'INSERT OR REPLACE INTO revisions ({}) SELECT {} '
+                'FROM legacy_revisions WHERE article_slug IS NOT NULL'.format(
+                    ', '.join(names), ', '.join(values)
+                )
+            )
+        db_con.execute('DROP TABLE legacy_revisions')
+
+
+def _separate_wikitexts(db_con):
+    """Move wikitexts out of the revisions table into a wikitexts table.
+
+    Wikitexts are keyed by their sha1, so each unique wikitext is stored
+    once no matter how many revisions share it.
+    """
+    db_con.execute('CREATE TABLE wikitexts ('
+                   'sha1 TEXT PRIMARY KEY, compression TEXT, content BLOB)')
+
+    # revisions that were cached without being tidied may not have a sha1
+    hashed = []
+    cursor = db_con.execute('SELECT rev_id, rev_sha1, wikitext FROM revisions '
+                            'WHERE wikitext IS NOT NULL')
+    while True:
+        rows = cursor.fetchmany(1000)
+        if not rows:
+            break
+        texts = pd.DataFrame(rows, columns=['rev_id', 'rev_sha1', 'wikitext'])
+        unhashed = texts.rev_sha1.isnull()
+        texts.loc[unhashed, 'rev_sha1'] = hash_wikitexts(texts.wikitext[unhashed])
+        hashed.extend(zip(texts.rev_sha1[unhashed], texts.rev_id[unhashed]))
+        insert_wikitexts(texts, db_con, deltas=False)
+
+    db_con.execute('ALTER TABLE revisions RENAME TO revisions_with_wikitexts')
+    _create_table('revisions', REVISIONS_COLUMNS, db_con)
+    names = ', '.join(name for name, _ in REVISIONS_COLUMNS)
+    db_con.execute('INSERT INTO revisions ({0}) SELECT {0} '
+                   'FROM revisions_with_wikitexts'.format(names))
+    db_con.execute('DROP TABLE revisions_with_wikitexts')
+    db_con.execute('CREATE INDEX revisions_article_slug_timestamp '
+                   'ON revisions (article_slug, timestamp)')
+    db_con.executemany('UPDATE revisions SET rev_sha1=? WHERE rev_id=?',
+                       [(sha1, int(rev_id)) for sha1, rev_id in hashed])
+
+
+def _create_table(name, columns, db_con):
+    definitions = ',\n'.join('{} {}'.format(*column) for column in columns)
+    db_con.execute('CREATE TABLE {} ({})'.format(name, definitions))
+
+
+def _get_column_names(table, db_con):
+    return [row[1] for row in
+            db_con.execute('PRAGMA table_info({})'.format(table))]
+
+
+def _create_rev_hashes_table(db_con):
+    """Cache the sha1 of every revision that has been hashed.
+
+    Unlike the revisions table, repeated revisions are included, so that
+    no revision ever needs to be hashed twice.
+    """
+    db_con.execute('CREATE TABLE rev_hashes ('
+                   'rev_id INTEGER PRIMARY KEY, rev_sha1 TEXT NOT NULL)')
+    db_con.execute('INSERT INTO rev_hashes (rev_id, rev_sha1) '
+                   'SELECT rev_id, rev_sha1 FROM revisions '
+                   'WHERE rev_sha1 IS NOT NULL')
+
+
+def _create_jobs_table(db_con):
+    """Track background jobs that fetch articles.
+
+    At most one job per article can be pending or running at a time.
+    """
+    columns = [
+        ('job_id', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+        ('article_slug', 'TEXT NOT NULL'),
+        ('status', 'TEXT NOT NULL'),  # pending, running, done or failed
+        ('pages', 'INTEGER NOT NULL DEFAULT 0'),
+        ('revisions', 'INTEGER NOT NULL DEFAULT 0'),
+        ('error', 'TEXT'),
+        ('created', 'INTEGER NOT NULL'),  # seconds since the epoch
+        ('updated', 'INTEGER NOT NULL'),
+    ]
+    _create_table('jobs', columns, db_con)
+    db_con.execute("CREATE UNIQUE INDEX jobs_active_article_slug "
+                   "ON jobs (article_slug) "
+                   "WHERE status IN ('pending', 'running')")
+
+
+def _add_wikitext_deltas(db_con):
+    """Allow wikitexts to be stored as deltas against another wikitext.
+
+    A wikitext with a base_sha1 is stored as a delta against the wikitext
+    with that sha1, and its depth is the number of deltas that have to be
+    applied to the nearest full wikitext to reconstruct it.
+    """
+    db_con.execute('ALTER TABLE wikitexts ADD COLUMN base_sha1 TEXT')
+    db_con.execute('ALTER TABLE wikitexts '
+                   'ADD COLUMN depth INTEGER NOT NULL DEFAULT 0')
+
 
+def _create_edits_table(db_con):
+    """Cache measurements of the edits between versions, keyed by sha1s."""
+    db_con.execute('CREATE TABLE edits ('
+                   'parent_sha1 TEXT NOT NULL, rev_sha1 TEXT NOT NULL, '
+                   'size_change INTEGER, edit_distance INTEGER, '
+                   'similarity REAL, PRIMARY KEY (parent_sha1, rev_sha1))')
 
-def get_article_revisions(article_slug, db_con=None):
+
+MIGRATIONS = [
+    _create_revisions_table,
+    _separate_wikitexts,
+    _create_rev_hashes_table,
+    _create_jobs_table,
+    _add_wikitext_deltas,
+    _create_edits_table,
+]
+
+
+def get_article_revisions(article_slug, db_con=None, refresh=False,
+                          columns=None):
     """Retrieve all revisions made to a Wikipedia article.
 
     Args:
         article_slug: The name of the Wikipedia article to retrieve.
         db_con: An open connection to the database. If not specified,
-            a default db is created.
+            this thread's connection to the default db is used.
+        refresh: Should revisions made since the article was cached be
+            requested from the Wikipedia API? See
+            `update_article_revisions`.
+        columns: The columns to retrieve. Defaults to all columns. See
+            `select_revisions_by_article`.
 
     Returns:
         A pandas.DataFrame of revisions where each row is a version of
         the article.
     """
     if not db_con:
-        db_con = connect_db()
-        close_db = True
-    else:
-        # if it wasn't connected here, don't close it
-        close_db = False
+        db_con = get_db()
 
     try:
-        revisions = select_revisions_by_article(article_slug, db_con)
+        if refresh:
+            update_article_revisions(article_slug, db_con)
+        revisions = select_revisions_by_article(article_slug, db_con,
+                                                columns=columns)
     except LookupError:
         logging.info('revisions for {} not found'.format(article_slug))
-        revisions = make_revisions_table(article_slug)
-        append_revisions(revisions, db_con)
+        fetch_article_revisions(article_slug, db_con)
+        revisions = select_revisions_by_article(article_slug, db_con,
+                                                columns=columns)
     else:
         logging.info('returning revisions for {}'.format(article_slug))
-    finally:
-        if close_db:
-            db_con.close()
     return revisions
 
 
-def select_revisions_by_article(article_slug, db_con):
+def get_many_article_revisions(article_slugs, workers=4, db_name='histories',
+                               session=None, requests_per_second=None,
+                               refresh=False, callback=None, **kwargs):
+    """Retrieve the revisions of many Wikipedia articles concurrently.
+
+    Articles that are already in the database are skipped unless
+    `refresh` is requested. Articles that were only partly fetched, e.g.,
+    because fetching was interrupted, are picked up where they left off.
+    The rest are fetched by a pool of worker threads sharing a single
+    HTTP session, each streaming its article into the database with its
+    own connection.
+    The revisions themselves aren't returned, as they may not fit in
+    memory. Use `get_article_revisions` to retrieve them from the db.
+
+    Args:
+        article_slugs: The names of the Wikipedia articles to retrieve.
+        workers: The number of articles to fetch at the same time.
+        db_name: The name of the database to store the revisions in.
+        session: A `requests.Session` to share among the workers. If not
+            specified, one is created with `make_session`.
+        requests_per_second: An optional limit on the rate of requests
+            made by all workers combined. Only used when creating the
+            session.
+        refresh: Should articles already in the database be brought up to
+            date with `update_article_revisions`?
+        callback: An optional function called with each article slug and
+            its number of revisions fetched as soon as it's done.
+        **kwargs: Passed on to `fetch_article_revisions`.
+
+    Returns:
+        A dict mapping each article slug to the number of revisions
+        fetched for it, or None if the article couldn't be fetched.
+    """
+    article_slugs = list(article_slugs)
+    if session is None:
+        session = make_session(pool_size=workers,
+                               requests_per_second=requests_per_second)
+    db_lock = threading.Lock()
+
+    def fetch(article_slug):
+        db_con = connect_db(db_name)
+        try:
+            status = select_article_status(article_slug, db_con)
+            if status == 'complete' and not refresh:
+                logging.info('revisions for {} already in db'.format(
+                             article_slug))
+                return 0
+            if status == 'missing':
+                return fetch_article_revisions(article_slug, db_con,
+                                               db_lock=db_lock,
+                                               session=session, **kwargs)
+            return update_article_revisions(article_slug, db_con,
+                                            db_lock=db_lock,
+                                            session=session, **kwargs)
+        except Exception:
+            logging.exception('unable to fetch {}'.format(article_slug))
+            return None
+        finally:
+            db_con.close()
+
+    num_revisions = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fetch, article_slug): article_slug
+                   for article_slug in article_slugs}
+        for future in as_completed(futures):
+            article_slug = futures[future]
+            num_revisions[article_slug] = future.result()
+            if callback is not None:
+                callback(article_slug, num_revisions[article_slug])
+    return {article_slug: num_revisions[article_slug]
+            for article_slug in article_slugs}
+
+
+def select_article_status(article_slug, db_con):
+    """Determine how much of an article's history is in the database.
+
+    Revision types are labeled once all of an article's revisions have
+    been stored, so revisions without a type mean that fetching the
+    article didn't finish.
+
+    Args:
+        article_slug: The name of the Wikipedia article.
+        db_con: An open connection to the database.
+
+    Returns:
+        'missing' if none of the article's revisions are in the database,
+        'partial' if fetching the article didn't finish, or 'complete'.
+    """
+    query = ('SELECT COUNT(*), COUNT(rev_type) FROM revisions '
+             'WHERE article_slug=?')
+    num_revisions, num_labeled = db_con.execute(query,
+                                                (article_slug, )).fetchone()
+    if num_revisions == 0:
+        return 'missing'
+    if num_labeled < num_revisions:
+        return 'partial'
+    return 'complete'
+
+
+def select_article_stats(db_con, article_slugs=None):
+    """Summarize the articles in the database without loading them.
+
+    Args:
+        db_con: An open connection to the database.
+        article_slugs: The articles to summarize. Defaults to all articles.
+
+    Returns:
+        A pandas.DataFrame with a row for each article, with its number of
+        revisions and versions, the timestamps of its first and last
+        revisions, and whether its history is complete.
+    """
+    query = ('SELECT article_slug, COUNT(*) AS revisions, '
+             'COUNT(DISTINCT rev_sha1) AS versions, '
+             'MIN(timestamp) AS first, MAX(timestamp) AS last, '
+             'COUNT(*) = COUNT(rev_type) AS complete '
+             'FROM revisions {} GROUP BY article_slug ORDER BY article_slug')
+    if article_slugs is None:
+        stats = pd.read_sql_query(query.format(''), db_con)
+    else:
+        chunks = []
+        for chunk in _chunks(list(article_slugs), SQLITE_MAX_VARIABLES):
+            placeholders = ', '.join(['?'] * len(chunk))
+            where = 'WHERE article_slug IN ({})'.format(placeholders)
+            chunks.append(pd.read_sql_query(query.format(where), db_con,
+                                            params=chunk))
+        if not chunks:
+            chunks.append(pd.read_sql_query(query.format('WHERE 0'), db_con))
+        stats = pd.concat(chunks, ignore_index=True)
+    for col in ['first', 'last']:
+        stats[col] = pd.to_datetime(stats[col], unit='s')
+    stats['complete'] = stats.complete.astype(bool)
+    return stats
+
+
+def start_fetch_job(article_slug, db_name='histories', refresh=False,
+                    executor=None, **kwargs):
+    """Fetch the revisions of an article in the background.
+
+    Requests for an article that is already being fetched are coalesced,
+    so that each article is only fetched by one job at a time. Progress
+    is recorded in the jobs table of the database. See `select_job`.
+
+    Args:
+        article_slug: The name of the Wikipedia article to fetch.
+        db_name: The name of the database to store the revisions in.
+        refresh: Should an article that is already in the database be
+            brought up to date? See `update_article_revisions`.
+        executor: A concurrent.futures.Executor to run the job. Defaults
+            to a shared pool of `JOB_WORKERS` threads.
+        **kwargs: Passed on to `fetch_article_revisions`.
+
+    Returns:
+        The id of the job fetching the article.
+    """
+    db_con = connect_db(db_name)
+    try:
+        job_id, created = _insert_job(article_slug, db_con)
+    finally:
+        db_con.close()
+
+    if created:
+        executor = executor or _get_job_executor()
+        executor.submit(run_fetch_job, job_id, article_slug, db_name,
+                        refresh=refresh, **kwargs)
+    return job_id
+
+
+def run_fetch_job(job_id, article_slug, db_name='histories', refresh=False,
+                  **kwargs):
+    """Fetch the revisions of an article, recording progress as a job.
+
+    Jobs that leave the article without any revisions fail with
+    `JOB_NOT_FOUND_ERROR`.
+    """
+    db_con = connect_db(db_name)
+    try:
+        with db_con:
+            claimed = db_con.execute(
+                "UPDATE jobs SET status='running', updated=? "
+                "WHERE job_id=? AND status='pending'",
+                (int(time.time()), job_id)
+            ).rowcount
+        if not claimed:
+            logging.info('job {} expired before it was run'.format(job_id))
+            return
+
+        def progress(pages, revisions):
+            _update_job(job_id, db_con, pages=pages, revisions=revisions)
+
+        try:
+            if refresh:
+                update_article_revisions(article_slug, db_con,
+                                         progress=progress, **kwargs)
+            else:
+                fetch_article_revisions(article_slug, db_con,
+                                        progress=progress, **kwargs)
+        except Exception as e:
+            logging.exception('job {} failed'.format(job_id))
+            _update_job(job_id, db_con, status='failed', error=repr(e))
+        else:
+            if count_revisions(article_slug, db_con):
+                _update_job(job_id, db_con, status='done')
+            else:
+                logging.info('no revisions of {} found'.format(article_slug))
+                _update_job(job_id, db_con, status='failed',
+                            error=JOB_NOT_FOUND_ERROR)
+    finally:
+        db_con.close()
+
+
+def select_job(job_id, db_con):
+    """Look up the status and progress of a background job.
+
+    Jobs that stopped making progress are failed first, so polling a job
+    never waits on one whose process died.
+
+    Args:
+        job_id: The id of the job, as returned by `start_fetch_job`.
+        db_con: An open connection to the database.
+
+    Returns:
+        A dict with the job's article_slug, status (pending, running,
+        done or failed), the number of pages and revisions fetched so
+        far, any error, and when it was created and last updated.
+
+    Raises:
+        LookupError: If there is no such job.
+    """
+    _expire_jobs(db_con)
+    query = 'SELECT * FROM jobs WHERE job_id=?'
+    cursor = db_con.execute(query, (job_id, ))
+    row = cursor.fetchone()
+    if row is None:
+        raise LookupError('no job {}'.format(job_id))
+    return dict(zip([column[0] for column in cursor.description], row))
+
+
+def select_last_job(article_slug, db_con):
+    """Look up the most recent job fetching an article.
+
+    Args:
+        article_slug: The name of the Wikipedia article.
+        db_con: An open connection to the database.
+
+    Returns:
+        A dict like those returned by `select_job`, or None if the
+        article was never fetched by a job.
+    """
+    query = ('SELECT * FROM jobs WHERE article_slug=? '
+             'ORDER BY job_id DESC LIMIT 1')
+    cursor = db_con.execute(query, (article_slug, ))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return dict(zip([column[0] for column in cursor.description], row))
+
+
+def select_active_job(article_slug, db_con):
+    """Return the id of the job fetching an article, or None if there isn't one."""
+    query = ("SELECT job_id FROM jobs WHERE article_slug=? "
+             "AND status IN ('pending', 'running')")
+    row = db_con.execute(query, (article_slug, )).fetchone()
+    return row[0] if row else None
+
+
+def _insert_job(article_slug, db_con):
+    _expire_jobs(db_con)
+    now = int(time.time())
+    while True:
+        job_id = select_active_job(article_slug, db_con)
+        if job_id is not None:
+            return job_id, False
+        try:
+            with db_con:
+                cursor = db_con.execute(
+                    "INSERT INTO jobs (article_slug, status, created, updated) "
+                    "VALUES (?, 'pending', ?, ?)", (article_slug, now, now)
+                )
+        except sqlite3.IntegrityError:
+            # another job for the article was started in the meantime
+            continue
+        return cursor.lastrowid, True
+
+
+def _update_job(job_id, db_con, **values):
+    values['updated'] = int(time.time())
+    names = sorted(values)
+    query = 'UPDATE jobs SET {} WHERE job_id=?'.format(
+        ', '.join('{}=?'.format(name) for name in names)
+    )
+    with db_con:
+        db_con.execute(query, [values[name] for name in names] + [job_id])
+
+
+def _expire_jobs(db_con):
+    """Fail jobs that stopped making progress, e.g., if their process died."""
+    with db_con:
+        db_con.execute(
+            "UPDATE jobs SET status='failed', error='timed out' "
+            "WHERE status IN ('pending', 'running') AND updated < ?",
+            (int(time.time()) - JOB_TIMEOUT, )
+        )
+
+
+_job_executor = None
+_job_executor_lock = threading.Lock()
+
+
+def _get_job_executor():
+    global _job_executor
+    with _job_executor_lock:
+        if _job_executor is None:
+            _job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS)
+        return _job_executor
+
+
+def select_revisions_by_article(article_slug, db_con, columns=None):
     """Query the database for all revisions made to a particular article.
 
+    Wikitexts are only read from the database if the `wikitext` column
+    is requested. Loading only the metadata of an article's revisions
+    is much faster for long histories. Wikitexts can be loaded later,
+    if needed, with `select_wikitexts`.
+
     Args:
         article_slug: The name of the Wikipedia article to retrieve from
             the database.
         db_con: An open connection to the database.
+        columns: A list of columns to retrieve, in order. Defaults to
+            `REVISIONS_COLUMNS` plus the `wikitext` column.
 
     Returns:
         A pandas.DataFrame of revisions where each row is a version of
         the article.
     """
-    query = "SELECT * from revisions WHERE article_slug='{}'".format(
-        article_slug
-    )
+    if columns is None:
+        columns = ALL_COLUMNS
+
+    unknown = set(columns).difference(ALL_COLUMNS)
+    if unknown:
+        raise ValueError('unknown columns: {}'.format(', '.join(unknown)))
+
+    selected = [name for name in columns if name != 'wikitext']
+    if 'wikitext' in columns and 'rev_sha1' not in selected:
+        selected.append('rev_sha1')
+
+    query = ("SELECT {} FROM revisions WHERE article_slug=? "
+             "ORDER BY timestamp, rev_id").format(', '.join(selected))
     try:
-        revisions = pd.read_sql_query(query, db_con)
+        revisions = pd.read_sql_query(query, db_con, params=(article_slug, ))
     except pd.io.sql.DatabaseError as e:
         raise LookupError(e)
     else:
         if len(revisions) == 0:
             raise LookupError('no rows for article {}'.format(article_slug))
-        return revisions
+        if 'timestamp' in revisions:
+            revisions['timestamp'] = pd.to_datetime(revisions.timestamp,
+                                                    unit='s', utc=True)
+        if 'wikitext' in columns:
+            revisions['wikitext'] = select_wikitexts(revisions.rev_sha1, db_con)
+        return revisions[list(columns)]
+
+
+def select_wikitexts(sha1s, db_con):
+    """Look up wikitexts in the database by their sha1.
+
+    Each unique wikitext is only read and decompressed once. Wikitexts
+    stored as deltas are reconstructed from the wikitexts they're based
+    on, which are read a level at a time. Reconstructed wikitexts are kept
+    in an LRU cache per database file, so reading nearby versions again is
+    fast. Wikitexts of in-memory databases aren't cached.
+
+    Args:
+        sha1s: A pandas.Series of sha1 hashes.
+        db_con: An open connection to the database.
+
+    Returns:
+        A pandas.Series of wikitexts aligned with sha1s. Wikitexts that
+        aren't in the database are missing.
+    """
+    unique_sha1s = sha1s.dropna().unique().tolist()
+    db_file = _get_db_file(db_con)
+    wikitexts = {}
+    rows = {}
+    needed = unique_sha1s
+    while needed:
+        bases = []
+        for sha1 in needed:
+            wikitext = _wikitext_cache.get((db_file, sha1)) if db_file \
+                else None
+            if wikitext is not None:
+                wikitexts[sha1] = wikitext
+        needed = [sha1 for sha1 in needed if sha1 not in wikitexts]
+        for chunk in _chunks(needed, SQLITE_MAX_VARIABLES):
+            query = 'SELECT sha1, compression, content, base_sha1 ' \
+                    'FROM wikitexts WHERE sha1 IN ({})'.format(
+                        ', '.join(['?'] * len(chunk)))
+            for sha1, compression, content, base_sha1 in db_con.execute(
+                    query, chunk):
+                rows[sha1] = decompress_wikitext(content, compression), \
+                    base_sha1
+                if base_sha1 is not None and base_sha1 not in rows:
+                    bases.append(base_sha1)
+        needed = list(dict.fromkeys(bases))
+
+    for sha1 in unique_sha1s:
+        _reconstruct_wikitext(sha1, rows, wikitexts, db_file)
+    return sha1s.map(wikitexts)
+
+
+def _get_db_file(db_con):
+    """Get the path of a database file, or '' if it's in memory."""
+    for _, name, path in db_con.execute('PRAGMA database_list'):
+        if name == 'main':
+            return path or ''
+    return ''
+
+
+def _reconstruct_wikitext(sha1, rows, wikitexts, db_file):
+    """Apply the chain of deltas leading to a wikitext, nearest base first."""
+    chain = []
+    while sha1 not in wikitexts and sha1 in rows:
+        chain.append(sha1)
+        sha1 = rows[sha1][1]
+        if sha1 is None:
+            break
+    for sha1 in reversed(chain):
+        content, base_sha1 = rows[sha1]
+        if base_sha1 is None:
+            wikitext = content
+        elif base_sha1 in wikitexts:
+            wikitext = apply_delta(wikitexts[base_sha1], content)
+        else:
+            # the base is missing, so neither is this wikitext
+            continue
+        wikitexts[sha1] = wikitext
+        if db_file:
+            _wikitext_cache.put((db_file, sha1), wikitext)
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def count_revisions(article_slug, db_con):
+    """Count the revisions of an article in the database without loading them.
+
+    Args:
+        article_slug: The name of the Wikipedia article.
+        db_con: An open connection to the database.
+
+    Returns:
+        The number of revisions, which is 0 if there is no revisions table.
+    """
+    query = 'SELECT COUNT(*) FROM revisions WHERE article_slug=?'
+    try:
+        return db_con.execute(query, (article_slug, )).fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0
+
+
+def delete_article_revisions(article_slug, db_con):
+    """Delete the revisions of an article from the database.
+
+    The sha1s of the revisions are deleted along with them. Wikitexts
+    are kept, as they may be shared with other articles.
+
+    Args:
+        article_slug: The name of the Wikipedia article to delete.
+        db_con: An open connection to the database.
+    """
+    with db_con:
+        db_con.execute('DELETE FROM rev_hashes WHERE rev_id IN '
+                       '(SELECT rev_id FROM revisions WHERE article_slug=?)',
+                       (article_slug, ))
+        db_con.execute('DELETE FROM revisions WHERE article_slug=?',
+                       (article_slug, ))
+
+
+def select_head_rev_id(article_slug, db_con):
+    """Look up the rev_id of the latest revision of an article in the database.
+
+    Unlike the sha1 of the latest revision, which comes back when an article
+    is reverted to an earlier version, the rev_id changes with every new
+    revision.
+
+    Args:
+        article_slug: The name of the Wikipedia article.
+        db_con: An open connection to the database.
+
+    Returns:
+        The rev_id of the head revision.
+
+    Raises:
+        LookupError: If the article is not in the database.
+    """
+    query = ('SELECT rev_id FROM revisions WHERE article_slug=? '
+             'ORDER BY timestamp DESC, rev_id DESC LIMIT 1')
+    row = db_con.execute(query, (article_slug, )).fetchone()
+    if row is None:
+        raise LookupError('no rows for article {}'.format(article_slug))
+    return row[0]
 
 
 def make_revisions_table(article_slug):
@@ -94,40 +911,590 @@ def make_revisions_table(article_slug):
         the article.
     """
     json_revisions = request(article_slug)
-    revisions = to_table(
-        json_revisions,
-        id_vars={'article_slug': article_slug},
-        columns=['revid', 'parentid', 'timestamp', '*'],
-        renamer={'revid': 'rev_id', 'parentid': 'parent_id', '*': 'wikitext'},
-    )
+    revisions = format_revisions(json_revisions, article_slug)
     revisions = tidy_article_revisions(revisions)
     return revisions
 
 
-def request(article_slug):
+def fetch_article_revisions(article_slug, db_con, db_lock=None, history=None,
+                            progress=None, **kwargs):
+    """Stream an article's revision history from the API into the database.
+
+    Unlike `make_revisions_table`, the full history is never held in
+    memory. Each page of revisions is converted, hashed, labeled and
+    appended to the database as soon as it arrives, so peak memory is
+    bounded by the size of a single page. Revision types depend on the
+    head of the history, so they are labeled last from the metadata
+    stored in the database. Revisions that were hashed before, e.g., by
+    a fetch that was interrupted, aren't hashed again.
+
+    Args:
+        article_slug: The name of the Wikipedia article to request
+            from the Wikipedia API.
+        db_con: An open connection to the database.
+        db_lock: An optional lock to hold while writing to the database.
+            SQLite only allows a single writer, so threads fetching
+            articles at the same time should share a lock.
+        history: Metadata of previously cached revisions to continue
+            from. See `tidy_revision_pages`.
+        progress: An optional function called with the number of pages
+            received and the number of revisions appended so far, each
+            time revisions are appended.
+        **kwargs: Passed on to `request_pages`.
+
+    Returns:
+        The number of revisions appended to the database.
+    """
+    db_lock = db_lock or threading.Lock()
+
+    # pages need to arrive in chronological order to be labeled
+    kwargs.setdefault('rvdir', 'newer')
+    pages = request_pages(article_slug, **kwargs)
+    num_pages = [0]
+
+    def format_pages():
+        for page in pages:
+            num_pages[0] += 1
+            if page:
+                yield format_revisions(page, article_slug)
+
+    num_revisions = 0
+    for revisions in tidy_revision_pages(format_pages(), history=history,
+                                         db_con=db_con, db_lock=db_lock):
+        with db_lock:
+            append_revisions(revisions, db_con)
+        num_revisions += len(revisions)
+        if progress is not None:
+            progress(num_pages[0], num_revisions)
+
+    if num_revisions:
+        with db_lock:
+            relabel_revision_types(article_slug, db_con)
+    return num_revisions
+
+
+def update_article_revisions(article_slug, db_con, db_lock=None, **kwargs):
+    """Bring the cached revision history of an article up to date.
+
+    Only revisions made after the newest cached revision are requested
+    from the Wikipedia API. They are labeled as a continuation of the
+    cached history and appended to the database. Wikitexts of cached
+    revisions are never loaded. If the article isn't cached at all, its
+    complete history is fetched.
+
+    Args:
+        article_slug: The name of the Wikipedia article to update.
+        db_con: An open connection to the database.
+        db_lock: An optional lock to hold while writing to the database.
+        **kwargs: Passed on to `request_pages`.
+
+    Returns:
+        The number of new revisions appended to the database.
+    """
+    if not count_revisions(article_slug, db_con):
+        return fetch_article_revisions(article_slug, db_con, db_lock=db_lock,
+                                       **kwargs)
+
+    query = ("SELECT rev_id, rev_sha1, rev_version, parent_id, parent_sha1, "
+             "parent_version FROM revisions "
+             "WHERE article_slug=? ORDER BY timestamp, rev_id")
+    history = pd.read_sql_query(query, db_con, params=(article_slug, ))
+    newest_rev_id = int(history.rev_id.max())
+    logging.info('requesting revisions for {} since {}'.format(
+                 article_slug, newest_rev_id))
+
+    # Start at the newest cached revision so that it can be recognized
+    # and dropped as a repeat along with any repeats that followed it.
+    return fetch_article_revisions(article_slug, db_con, db_lock=db_lock,
+                                   history=history, rvstartid=newest_rev_id,
+                                   **kwargs)
+
+
+def load_dump(dump, db_con, article_slugs=None, namespaces=(0, ),
+              db_lock=None, callback=None):
+    """Load the revision histories of articles from a MediaWiki XML dump.
+
+    This is the offline counterpart of `fetch_article_revisions`, for
+    bulk loading many articles from a `pages-meta-history` dump in one
+    pass. The dump is parsed as a stream, and revisions are tidied and
+    appended to the database `DUMP_PAGE_SIZE` at a time, so memory is
+    bounded no matter how large the dump is. Articles that are already
+    in the database are deleted before they are loaded, so they're
+    replaced. Like the API requests, only the lead section of each
+    wikitext is stored, so loaded and fetched articles are comparable.
+
+    Articles that can't be loaded are logged and skipped, and any of
+    their revisions that were already stored are deleted.
+
+    Args:
+        dump: The path to the dump, which may be compressed with bz2 or
+            gzip, or an open binary file.
+        db_con: An open connection to the database.
+        article_slugs: The articles to load. Defaults to all articles in
+            the dump.
+        namespaces: The namespaces of the pages to load. Defaults to
+            articles only.
+        db_lock: An optional lock to hold while writing to the database.
+        callback: An optional function called with each article slug and
+            its number of revisions as soon as it's loaded.
+
+    Returns:
+        A dict mapping each article slug to the number of revisions
+        loaded for it, or None if the article couldn't be loaded.
+    """
+    db_lock = db_lock or threading.Lock()
+    revisions = iter_dump_revisions(dump, article_slugs=article_slugs,
+                                    namespaces=namespaces)
+
+    num_revisions = {}
+    for article_slug, article_revisions in itertools.groupby(
+            revisions, key=lambda revision: revision[0]):
+        pages = _chunks_of(
+            (json_revision for _, json_revision in article_revisions),
+            DUMP_PAGE_SIZE,
+        )
+        tables = (format_revisions(page, article_slug) for page in pages)
+
+        num_revisions[article_slug] = 0
+        try:
+            with db_lock:
+                delete_article_revisions(article_slug, db_con)
+            for tidied in tidy_revision_pages(tables, db_con=db_con,
+                                              db_lock=db_lock):
+                with db_lock:
+                    append_revisions(tidied, db_con)
+                num_revisions[article_slug] += len(tidied)
+
+            if num_revisions[article_slug]:
+                with db_lock:
+                    relabel_revision_types(article_slug, db_con)
+        except ElementTree.ParseError:
+            # the rest of the dump can't be read either
+            raise
+        except Exception:
+            logging.exception('unable to load {}'.format(article_slug))
+            with db_lock:
+                delete_article_revisions(article_slug, db_con)
+            num_revisions[article_slug] = None
+        else:
+            logging.info('loaded {} revisions of {}'.format(
+                         num_revisions[article_slug], article_slug))
+        if callback is not None:
+            callback(article_slug, num_revisions[article_slug])
+    return num_revisions
+
+
+def iter_dump_revisions(dump, article_slugs=None, namespaces=(0, ),
+                        full_text=False):
+    """Stream revisions out of a MediaWiki XML dump.
+
+    Revisions are formatted like the revisions returned by the Wikipedia
+    API, so they can be converted with `format_revisions`. Parsed elements
+    are discarded as soon as each revision is read.
+
+    Args:
+        dump: The path to the dump, which may be compressed with bz2 or
+            gzip, or an open binary file.
+        article_slugs: The articles to include. Defaults to all.
+        namespaces: The namespaces of the pages to include.
+        full_text: Should the full wikitext of each revision be included?
+            By default only the lead section is, like the API requests.
+
+    Yields:
+        Tuples of (article_slug, revision), in the order of the dump.
+    """
+    if article_slugs is not None:
+        article_slugs = set(article_slugs)
+
+    with open_dump(dump) as f:
+        events = ElementTree.iterparse(f, events=('start', 'end'))
+        _, root = next(events)
+
+        page = None
+        in_revision = in_contributor = False
+        for event, elem in events:
+            tag = elem.tag.rsplit('}', 1)[-1]
+            if event == 'start':
+                if tag == 'page':
+                    page, article_slug, include = elem, None, False
+                elif tag == 'revision':
+                    in_revision, revision = True, {'parentid': 0}
+                elif tag == 'contributor':
+                    in_contributor = True
+                continue
+
+            if tag == 'contributor':
+                in_contributor = False
+            elif not in_revision:
+                if tag == 'title':
+                    article_slug = elem.text.replace(' ', '_')
+                elif tag == 'ns':
+                    include = (int(elem.text) in namespaces and
+                               (article_slugs is None or
+                                article_slug in article_slugs))
+                elif tag == 'page':
+                    root.clear()
+            elif tag == 'id' and not in_contributor:
+                revision['revid'] = int(elem.text)
+            elif tag == 'parentid':
+                revision['parentid'] = int(elem.text)
+            elif tag == 'timestamp':
+                revision['timestamp'] = elem.text
+            elif tag == 'text':
+                wikitext = elem.text or ''
+                revision['*'] = wikitext if full_text else \
+                    lead_section(wikitext)
+            elif tag == 'revision':
+                in_revision = False
+                if include:
+                    yield article_slug, revision
+                # discard the revisions parsed so far
+                page.clear()
+
+
+def lead_section(wikitext):
+    """Cut a wikitext down to the text before its first section heading.
+
+    This is the text the Wikipedia API returns for section 0.
+    """
+    heading = SECTION_HEADING.search(wikitext)
+    if heading is None:
+        return wikitext
+    return wikitext[:heading.start()].rstrip()
+
+
+@contextmanager
+def open_dump(dump):
+    """Open a MediaWiki XML dump for reading, decompressing it if needed.
+
+    Args:
+        dump: The path to the dump, or an open binary file. Paths ending
+            in .bz2 or .gz are decompressed.
+    """
+    if not isinstance(dump, str):
+        yield dump
+        return
+
+    if dump.endswith('.bz2'):
+        f = bz2.open(dump, 'rb')
+    elif dump.endswith('.gz'):
+        f = gzip.open(dump, 'rb')
+    else:
+        f = open(dump, 'rb')
+    with f:
+        yield f
+
+
+def _chunks_of(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def export_revisions(directory, db_con, article_slugs=None, wikitexts=True,
+                     compression=_DEFAULT, callback=None):
+    """Export revisions from the database to parquet files for analysis.
+
+    Revisions are written to a `revisions` dataset and wikitexts to a
+    separate `wikitexts` dataset, both partitioned by article_slug, so
+    that scans of the metadata never read any wikitexts and scans of a
+    few articles only read their partitions. Each unique wikitext of an
+    article is exported once. Articles that were exported before are
+    replaced. Requires pyarrow.
+
+    Args:
+        directory: Where to write the datasets.
+        db_con: An open connection to the database.
+        article_slugs: The articles to export. Defaults to all articles.
+        wikitexts: Whether to export wikitexts too.
+        compression: The parquet compression codec, or None for no
+            compression. Defaults to `PARQUET_COMPRESSION`.
+        callback: An optional function called with each article slug and
+            its number of revisions as soon as it's exported.
+
+    Returns:
+        A dict mapping each article slug to the number of revisions
+        exported for it.
+    """
+    if pyarrow is None:
+        raise ImportError('exporting revisions requires pyarrow')
+    if compression is _DEFAULT:
+        compression = PARQUET_COMPRESSION
+    if article_slugs is None:
+        article_slugs = select_article_stats(db_con).article_slug
+
+    file_options = pyarrow.dataset.ParquetFileFormat().make_write_options(
+        compression=compression
+    )
+    num_revisions = {}
+    for article_slug in article_slugs:
+        columns = METADATA_COLUMNS + (['wikitext'] if wikitexts else [])
+        revisions = select_revisions_by_article(article_slug, db_con,
+                                                columns=columns)
+        revisions.insert(0, 'article_slug', article_slug)
+        _write_partition(
+            revisions[['article_slug'] + METADATA_COLUMNS],
+            os.path.join(directory, 'revisions'), _revisions_schema(),
+            file_options,
+        )
+        if wikitexts:
+            _write_partition(
+                revisions[['article_slug', 'rev_sha1', 'wikitext']]
+                .drop_duplicates('rev_sha1'),
+                os.path.join(directory, 'wikitexts'), _wikitexts_schema(),
+                file_options,
+            )
+        num_revisions[article_slug] = len(revisions)
+        if callback is not None:
+            callback(article_slug, len(revisions))
+    return num_revisions
+
+
+def read_revisions(directory, columns=None, article_slugs=None, filters=None):
+    """Read revisions exported with `export_revisions`.
+
+    Only the requested columns are read, and filters are pushed down to
+    the parquet files: partitions of other articles are skipped without
+    being opened, and row groups whose statistics rule out a filter on
+    any other column are skipped without being decoded. For example,
+    reversions can be counted across all articles without reading any
+    wikitexts with::
+
+        read_revisions(directory, columns=['article_slug'],
+                       filters=[('rev_type', '=', 'reversion')])
+
+    Wikitexts are only read if the `wikitext` column is requested.
+    Requires pyarrow.
+
+    Args:
+        directory: The directory the revisions were exported to.
+        columns: A list of columns to read, in order. Defaults to
+            `article_slug` plus `METADATA_COLUMNS`.
+        article_slugs: The articles to read. Defaults to all articles.
+        filters: A list of (column, op, value) tuples that each revision
+            must match, e.g., [('rev_type', '=', 'head')]. A list of lists
+            of tuples matches revisions that match any of the inner lists.
+
+    Returns:
+        A pandas.DataFrame of revisions, in order of article and timestamp.
+    """
+    if pyarrow is None:
+        raise ImportError('reading exported revisions requires pyarrow')
+    if columns is None:
+        columns = ['article_slug'] + METADATA_COLUMNS
+
+    known = ['article_slug'] + ALL_COLUMNS
+    unknown = set(columns).difference(known)
+    if unknown:
+        raise ValueError('unknown columns: {}'.format(', '.join(unknown)))
+
+    selected = [name for name in columns if name != 'wikitext']
+    if 'wikitext' in columns:
+        selected.extend(name for name in ['article_slug', 'rev_sha1']
+                        if name not in selected)
+
+    expression = None
+    if filters:
+        expression = pyarrow.parquet.filters_to_expression(filters)
+    if article_slugs is not None:
+        is_selected = pyarrow.dataset.field('article_slug').isin(
+            list(article_slugs)
+        )
+        expression = (is_selected if expression is None
+                      else expression & is_selected)
+
+    revisions = _read_dataset(os.path.join(directory, 'revisions'),
+                              _revisions_schema(), selected, expression)
+
+    if 'wikitext' in columns:
+        is_read = pyarrow.dataset.field('article_slug').isin(
+            revisions.article_slug.unique().tolist()
+        )
+        wikitexts = _read_dataset(os.path.join(directory, 'wikitexts'),
+                                  _wikitexts_schema(), None, is_read)
+        revisions = revisions.merge(wikitexts, how='left',
+                                    on=['article_slug', 'rev_sha1'])
+    return revisions[list(columns)]
+
+
+def _revisions_schema():
+    return pyarrow.schema([
+        ('article_slug', pyarrow.string()),
+        ('rev_id', pyarrow.int64()),
+        ('parent_id', pyarrow.int64()),
+        ('timestamp', pyarrow.timestamp('s', tz='UTC')),
+        ('rev_sha1', pyarrow.string()),
+        ('parent_sha1', pyarrow.string()),
+        ('rev_version', pyarrow.int64()),
+        ('parent_version', pyarrow.int64()),
+        ('rev_type', pyarrow.string()),
+    ])
+
+
+def _wikitexts_schema():
+    return pyarrow.schema([
+        ('article_slug', pyarrow.string()),
+        ('rev_sha1', pyarrow.string()),
+        ('wikitext', pyarrow.string()),
+    ])
+
+
+def _partitioning(schema):
+    return pyarrow.dataset.partitioning(
+        pyarrow.schema([schema.field('article_slug')]), flavor='hive'
+    )
+
+
+def _write_partition(table, directory, schema, file_options):
+    """Write the rows of a single article, replacing its partition."""
+    table = pyarrow.Table.from_pandas(table, schema=schema,
+                                      preserve_index=False)
+    pyarrow.dataset.write_dataset(
+        table, directory, format='parquet', partitioning=_partitioning(schema),
+        file_options=file_options, basename_template='part-{i}.parquet',
+        existing_data_behavior='delete_matching',
+    )
+
+
+def _read_dataset(directory, schema, columns, expression):
+    dataset = pyarrow.dataset.dataset(directory, schema=schema,
+                                      format='parquet',
+                                      partitioning=_partitioning(schema))
+    table = dataset.to_table(columns=columns, filter=expression)
+    return table.to_pandas()
+
+
+def request(article_slug, **kwargs):
     """Request complete revision histories from the Wikipedia API.
 
     Args:
         article_slug: The name of the Wikipedia article to request
             from the Wikipedia API.
+        **kwargs: Passed on to `request_pages`.
 
     Returns:
         A list of revisions as dicts.
     """
+    return [revision
+            for page in request_pages(article_slug, **kwargs)
+            for revision in page]
+
+
+def request_pages(article_slug, api_endpoint=API_ENDPOINT, session=None,
+                  **kwargs):
+    """Request revision histories from the Wikipedia API a page at a time.
+
+    Args:
+        article_slug: The name of the Wikipedia article to request
+            from the Wikipedia API.
+        api_endpoint: The url of the MediaWiki API.
+        session: An optional `requests.Session` to make the requests with.
+        **kwargs: Revision query options passed on to
+            `compile_revision_request_kwargs`.
+
+    Yields:
+        Lists of revisions as dicts, one list per continuation page.
+    """
     logging.info('requesting revisions for article {}'.format(article_slug))
-    api_endpoint = 'https://en.wikipedia.org/w/api.php'
-    api_kwargs = compile_revision_request_kwargs(titles=article_slug)
-    revisions = []
+    get = session.get if session else requests.get
+    api_kwargs = compile_revision_request_kwargs(titles=article_slug, **kwargs)
     while True:
-        response = requests.get(api_endpoint, api_kwargs).json()
-        revisions.extend(unearth_revisions(response))
+        response = get(api_endpoint, params=api_kwargs).json()
+        yield unearth_revisions(response)
         if 'continue' in response:
             logging.info('requesting more revisions {}'.format(
                          response['continue']['rvcontinue']))
             api_kwargs.update(response['continue'])
         else:
             break
-    return revisions
+
+
+def make_session(pool_size=10, max_retries=3, backoff_factor=0.5,
+                 requests_per_second=None):
+    """Create an HTTP session for making many requests to the Wikipedia API.
+
+    Connections are pooled and reused across requests. Requests that fail
+    due to connection errors or transient server errors are retried with
+    exponential backoff. Retries count toward the session's rate limit.
+
+    Args:
+        pool_size: The maximum number of connections to keep open. Should
+            be at least the number of threads sharing the session.
+        max_retries: The number of times to retry a failed request.
+        backoff_factor: Seconds to wait before the first retry, doubling
+            after each subsequent retry.
+        requests_per_second: An optional limit on the rate of requests
+            made with the session, shared by all threads using it.
+
+    Returns:
+        A `RateLimitedSession`.
+    """
+    session = RateLimitedSession(requests_per_second)
+    session.headers['User-Agent'] = USER_AGENT
+    retry = RateLimitedRetry(
+        total=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=[429, 500, 502, 503, 504],
+        limiter=session,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                          max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class RateLimitedSession(requests.Session):
+    """A `requests.Session` that limits the rate of requests.
+
+    Requests are spaced evenly so that no more than `requests_per_second`
+    are started in any second, across all threads using the session.
+    """
+    def __init__(self, requests_per_second=None):
+        super(RateLimitedSession, self).__init__()
+        self.requests_per_second = requests_per_second
+        self._rate_lock = threading.Lock()
+        self._next_request_time = time.monotonic()
+
+    def request(self, *args, **kwargs):
+        self.wait()
+        return super(RateLimitedSession, self).request(*args, **kwargs)
+
+    def wait(self):
+        """Block until another request can be made."""
+        if not self.requests_per_second:
+            return
+        interval = 1.0 / self.requests_per_second
+        with self._rate_lock:
+            now = time.monotonic()
+            delay = self._next_request_time - now
+            self._next_request_time = max(now, self._next_request_time) + interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class RateLimitedRetry(Retry):
+    """A `Retry` that waits for a `RateLimitedSession` before retrying.
+
+    Retries are made by urllib3 inside a single call to the session, so
+    without this they would bypass the session's rate limit.
+    """
+    def __init__(self, *args, limiter=None, **kwargs):
+        super(RateLimitedRetry, self).__init__(*args, **kwargs)
+        self.limiter = limiter
+
+    def new(self, **kwargs):
+        retry = super(RateLimitedRetry, self).new(**kwargs)
+        retry.limiter = self.limiter
+        return retry
+
+    def sleep(self, response=None):
+        super(RateLimitedRetry, self).sleep(response)
+        if self.limiter is not None:
+            self.limiter.wait()
 
 
 def compile_revision_request_kwargs(titles, **kwargs):
@@ -172,7 +1539,19 @@ def compile_revision_request_kwargs(titles, **kwargs):
 
 def unearth_revisions(response):
     """Burrow in to the json response and retrieve the list of revisions."""
-    return list(response['query']['pages'].values())[0]['revisions']
+    page = list(response['query']['pages'].values())[0]
+    # pages without any (new) revisions don't have a revisions key
+    return page.get('revisions', [])
+
+
+def format_revisions(json_revisions, article_slug):
+    """Convert revisions from the Wikipedia API to a table of revisions."""
+    return to_table(
+        json_revisions,
+        id_vars={'article_slug': article_slug},
+        columns=['article_slug', 'revid', 'parentid', 'timestamp', '*'],
+        renamer={'revid': 'rev_id', 'parentid': 'parent_id', '*': 'wikitext'},
+    )
 
 
 def to_table(json_revisions, id_vars=None, columns=None, renamer=None):
@@ -195,7 +1574,8 @@ def to_table(json_revisions, id_vars=None, columns=None, renamer=None):
     revisions = pd.DataFrame.from_records(json_revisions)
 
     if id_vars:
-        revisions = insert_id_vars(revisions, id_vars)
+        # the table was just created, so there's no need to copy it
+        revisions = insert_id_vars(revisions, id_vars, copy=False)
 
     if columns:
         revisions = revisions[columns]
@@ -206,21 +1586,300 @@ def to_table(json_revisions, id_vars=None, columns=None, renamer=None):
     return revisions
 
 
-def insert_id_vars(revisions, id_vars):
-    """Insert identifiers into the revisions."""
-    revisions = revisions.copy()
+def insert_id_vars(revisions, id_vars, copy=True):
+    """Insert identifiers into the revisions.
+
+    Unless `copy` is False, the identifiers are inserted into a copy of
+    the revisions.
+    """
+    if copy:
+        revisions = revisions.copy()
     for name, value in id_vars.items():
         revisions.insert(0, column=name, value=value)
     return revisions
 
 
-def append_revisions(revisions, db_con):
-    """Append revisions to the database."""
+def append_revisions(revisions, db_con, compression=_DEFAULT):
+    """Append revisions to the database.
+
+    Revisions that are already in the database are updated, but only in
+    the columns given. Wikitexts are stored separately from the revisions,
+    once per unique wikitext.
+
+    Args:
+        revisions: A pandas.DataFrame of revisions. Columns that aren't in
+            the revisions table are ignored.
+        db_con: An open connection to the database.
+        compression: How to compress new wikitexts, or None to store them
+            uncompressed. Defaults to `WIKITEXT_COMPRESSION`.
+    """
     logging.info('appending revisions to database')
-    revisions.to_sql('revisions', db_con, index=False, if_exists='append')
+    if 'wikitext' in revisions and 'rev_sha1' not in revisions:
+        revisions = revisions.assign(
+            rev_sha1=hash_wikitexts(clean_wikitexts(revisions.wikitext))
+        )
+
+    names = [name for name, _ in REVISIONS_COLUMNS if name in revisions]
+    rows = revisions[names]
+
+    if 'timestamp' in rows:
+        rows = rows.assign(timestamp=to_epoch_seconds(rows.timestamp))
+
+    # only update the columns that were given, leaving the rest as they are
+    updates = ', '.join('{0}=excluded.{0}'.format(name) for name in names
+                        if name != 'rev_id')
+    query = 'INSERT INTO revisions ({}) VALUES ({}) ON CONFLICT (rev_id) {}'.format(
+        ', '.join(names), ', '.join(['?'] * len(names)),
+        'DO UPDATE SET ' + updates if updates else 'DO NOTHING',
+    )
+    with db_con:
+        db_con.executemany(query, _to_records(rows))
+        if 'rev_sha1' in revisions:
+            insert_rev_hashes(revisions, db_con)
+        if 'wikitext' in revisions:
+            insert_wikitexts(revisions, db_con, compression=compression)
+
+
+def insert_rev_hashes(revisions, db_con):
+    """Cache the sha1 of each revision by rev_id.
+
+    Args:
+        revisions: A pandas.DataFrame with columns `rev_id` and `rev_sha1`.
+        db_con: An open connection to the database.
+    """
+    hashes = revisions[['rev_id', 'rev_sha1']].dropna()
+    db_con.executemany(
+        'INSERT OR REPLACE INTO rev_hashes (rev_id, rev_sha1) VALUES (?, ?)',
+        zip(hashes.rev_id.astype(int).tolist(), hashes.rev_sha1)
+    )
+
+
+def select_rev_hashes(rev_ids, db_con):
+    """Look up the cached sha1 of revisions by rev_id.
+
+    Args:
+        rev_ids: A pandas.Series of rev_ids.
+        db_con: An open connection to the database.
+
+    Returns:
+        A pandas.Series of sha1s aligned with rev_ids. Revisions that
+        haven't been hashed before are missing.
+    """
+    unique_ids = [int(rev_id) for rev_id in rev_ids.dropna().unique()]
+    hashes = {}
+    for chunk in _chunks(unique_ids, SQLITE_MAX_VARIABLES):
+        query = 'SELECT rev_id, rev_sha1 FROM rev_hashes ' \
+                'WHERE rev_id IN ({})'.format(', '.join(['?'] * len(chunk)))
+        hashes.update(db_con.execute(query, chunk))
+    return rev_ids.map(hashes)
+
+
+def insert_wikitexts(revisions, db_con, compression=_DEFAULT, deltas=None):
+    """Store the unique wikitexts of revisions that aren't stored already.
+
+    When storing deltas, each wikitext is stored as a delta against the
+    wikitext of its parent version, unless the delta isn't much smaller
+    than the wikitext itself, or the parent is already at the end of a
+    chain of `WIKITEXT_SNAPSHOT_INTERVAL` deltas. Those wikitexts, and
+    any whose parent isn't known, are stored in full.
+
+    Args:
+        revisions: A pandas.DataFrame with columns `rev_sha1` and `wikitext`.
+            A `parent_sha1` column is needed to store deltas.
+        db_con: An open connection to the database.
+        compression: How to compress the wikitexts, or None to store them
+            uncompressed. Defaults to `WIKITEXT_COMPRESSION`.
+        deltas: Whether to store deltas. Defaults to `WIKITEXT_DELTAS`.
+    """
+    if compression is _DEFAULT:
+        compression = WIKITEXT_COMPRESSION
+    if deltas is None:
+        deltas = WIKITEXT_DELTAS
+    deltas = deltas and 'parent_sha1' in revisions
+
+    columns = ['rev_sha1', 'wikitext'] + (['parent_sha1'] if deltas else [])
+    texts = revisions[columns].dropna(subset=['rev_sha1'])
+    texts = texts.drop_duplicates(subset='rev_sha1')
+
+    sha1s = texts.rev_sha1.tolist()
+    stored = set()
+    for chunk in _chunks(sha1s, SQLITE_MAX_VARIABLES):
+        query = 'SELECT sha1 FROM wikitexts WHERE sha1 IN ({})'.format(
+            ', '.join(['?'] * len(chunk))
+        )
+        stored.update(sha1 for sha1, in db_con.execute(query, chunk))
+
+    texts = texts.loc[~texts.rev_sha1.isin(stored)]
+    if not deltas:
+        db_con.executemany(
+            'INSERT OR IGNORE INTO wikitexts (sha1, compression, content) '
+            'VALUES (?, ?, ?)',
+            ((sha1, compression, compress_wikitext(wikitext, compression))
+             for sha1, wikitext in zip(texts.rev_sha1,
+                                       clean_wikitexts(texts.wikitext)))
+        )
+        return
+
+    wikitexts = dict(zip(texts.rev_sha1, clean_wikitexts(texts.wikitext)))
+    depths = {}
+    rows = []
+    stored_parents = texts.parent_sha1[
+        texts.parent_sha1.notnull() & ~texts.parent_sha1.isin(wikitexts)
+    ].unique().tolist()
+    if stored_parents:
+        wikitexts.update(zip(stored_parents,
+                             select_wikitexts(pd.Series(stored_parents),
+                                              db_con)))
+        for chunk in _chunks(stored_parents, SQLITE_MAX_VARIABLES):
+            query = 'SELECT sha1, depth FROM wikitexts ' \
+                    'WHERE sha1 IN ({})'.format(', '.join(['?'] * len(chunk)))
+            depths.update(db_con.execute(query, chunk))
+
+    for sha1, parent_sha1 in zip(texts.rev_sha1, texts.parent_sha1):
+        wikitext = wikitexts[sha1]
+        base = wikitexts.get(parent_sha1)
+        # only parents that were stored already can be bases
+        base_depth = depths.get(parent_sha1)
+        delta = None
+        if (isinstance(base, str) and base_depth is not None and
+                base_depth < WIKITEXT_SNAPSHOT_INTERVAL):
+            delta = encode_delta(base, wikitext)
+            if len(delta) > len(wikitext) // 2:
+                delta = None
+        if delta is None:
+            rows.append((sha1, compression,
+                         compress_wikitext(wikitext, compression), None, 0))
+            depths[sha1] = 0
+        else:
+            rows.append((sha1, compression,
+                         compress_wikitext(delta, compression),
+                         parent_sha1, base_depth + 1))
+            depths[sha1] = base_depth + 1
+
+    db_con.executemany(
+        'INSERT OR IGNORE INTO wikitexts '
+        '(sha1, compression, content, base_sha1, depth) '
+        'VALUES (?, ?, ?, ?, ?)', rows
+    )
+
+
+def encode_delta(base, wikitext):
+    """Encode a wikitext as the lines it changes in a base wikitext.
+
+    Runs of lines kept from the base are encoded as [start, stop] ranges
+    of base lines, and new lines as strings, in a JSON list.
+
+    Args:
+        base: The wikitext the delta is against.
+        wikitext: The wikitext to encode.
+
+    Returns:
+        The delta as a string. See `apply_delta` for the inverse.
+    """
+    base_lines = base.splitlines(True)
+    lines = wikitext.splitlines(True)
+    matcher = difflib.SequenceMatcher(None, base_lines, lines)
+    delta = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            delta.append([i1, i2])
+        elif j2 > j1:
+            delta.append(''.join(lines[j1:j2]))
+    return json.dumps(delta, separators=(',', ':'))
+
+
+def apply_delta(base, delta):
+    """Reconstruct a wikitext from its base and a delta from `encode_delta`."""
+    base_lines = base.splitlines(True)
+    return ''.join(''.join(base_lines[op[0]:op[1]]) if isinstance(op, list)
+                   else op for op in json.loads(delta))
+
+
+class LRUCache(object):
+    """A thread-safe mapping that holds only its most recently used items."""
+
+    def __init__(self, max_items):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._items.move_to_end(key)
+            except KeyError:
+                return default
+            return self._items[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+# Wikitexts are keyed by their database file and sha1, so cached wikitexts
+# never go stale and are only returned for databases that store them.
+_wikitext_cache = LRUCache(WIKITEXT_CACHE_SIZE)
+
+
+def compress_wikitext(wikitext, compression=None):
+    """Encode a wikitext as bytes, optionally compressing it.
+
+    Args:
+        wikitext: The wikitext to compress.
+        compression: One of None, 'zlib' or 'zstd'.
+
+    Returns:
+        The compressed wikitext as bytes.
+    """
+    data = wikitext.encode('utf-8')
+    if not compression:
+        return data
+    elif compression == 'zlib':
+        return zlib.compress(data)
+    elif compression == 'zstd':
+        if zstandard is None:
+            raise ImportError('zstd compression requires zstandard')
+        return zstandard.ZstdCompressor().compress(data)
+    else:
+        raise ValueError('unknown compression {}'.format(compression))
+
+
+def decompress_wikitext(data, compression=None):
+    """Decode a wikitext compressed with `compress_wikitext`."""
+    if not compression:
+        pass
+    elif compression == 'zlib':
+        data = zlib.decompress(data)
+    elif compression == 'zstd':
+        if zstandard is None:
+            raise ImportError('zstd compression requires zstandard')
+        data = zstandard.ZstdDecompressor().decompress(data)
+    else:
+        raise ValueError('unknown compression {}'.format(compression))
+    return bytes(data).decode('utf-8')
+
+
+def to_epoch_seconds(timestamps):
+    """Convert timestamps to integer seconds since the epoch."""
+    timestamps = pd.to_datetime(timestamps)
+    seconds = timestamps.values.astype('datetime64[s]').astype('int64')
+    return pd.Series(seconds, index=timestamps.index).where(timestamps.notnull())
+
+
+def _to_records(table):
+    """Convert a table to rows of python objects that sqlite can store."""
+    table = table.astype(object)
+    return table.where(table.notnull(), None).values.tolist()
 
 
-def tidy_article_revisions(revisions):
+def tidy_article_revisions(revisions, hash_workers=None, db_con=None):
     """Clean a table of revisions.
 
     This is the central method for processing an article's revision
@@ -229,8 +1888,21 @@ def tidy_article_revisions(revisions):
     versions. What is returned is the unique revision history of
     an article.
 
+    The result is the same as applying `convert_timestamp_to_datetime`,
+    `label_version`, `drop_repeats` and `label_revision_type` in turn,
+    but the revisions are sorted once, repeats are found before any
+    wikitexts are hashed, and the only copy made is of the rows that are
+    returned. The wikitexts themselves are never copied, so peak memory
+    stays well under 1.5 times the size of the revisions.
+
     Args:
         revisions: A pandas.DataFrame of revisions.
+        hash_workers: The number of threads to hash wikitexts with. See
+            `hash_wikitexts`.
+        db_con: An optional open connection to the database. If given,
+            the hashes of revisions that have been hashed before are
+            taken from the database instead of being recomputed, and the
+            hashes of the rest are saved for next time.
 
     Returns:
         A pandas.DataFrame with correct data types and additional
@@ -239,27 +1911,228 @@ def tidy_article_revisions(revisions):
     Raises:
         IncompleteRevisionHistoryError: There were revisions in the
             table that didn't have a parent.
+        MissingRequiredColumnError: If revisions do not have a timestamp
+            column.
     """
-    revisions = revisions.copy()
+    if 'timestamp' not in revisions:
+        raise MissingRequiredColumnError('timestamp required')
 
-    # convert objects
-    if 'timestamp' in revisions:
-        revisions = convert_timestamp_to_datetime(revisions)
+    # Check that the revision history is complete.
+    if (~revisions.parent_id.isin(revisions.rev_id.values)).sum() > 1:
+        raise IncompleteRevisionHistoryError()
 
-    revisions = label_version(revisions)
-    revisions = drop_repeats(revisions)
-    revisions = label_revision_type(revisions)
+    # sort once, keeping revisions with the same timestamp in order
+    timestamps = pd.to_datetime(revisions.timestamp)
+    order = np.argsort(timestamps.values, kind='mergesort')
+    articles = np.zeros(len(order), dtype=np.int64)
 
-    return revisions
+    tidied, _, _, _ = _tidy_sorted_revisions(revisions, timestamps, order,
+                                             articles, hash_workers, db_con)
+    return label_revision_type(tidied)
+
+
+def tidy_many_article_revisions(revisions, hash_workers=None, db_con=None):
+    """Clean a table of the revisions of many articles at once.
+
+    The result for each article is the same as `tidy_article_revisions`,
+    but every step is done for all articles together rather than looping
+    over them: revisions are sorted by article and timestamp in one pass,
+    all unhashed wikitexts are hashed in one batch, versions are numbered
+    within each article by factorizing (article, hash) pairs, and the
+    branches of every article are traced at the same time.
+
+    Args:
+        revisions: A pandas.DataFrame of revisions with an `article_slug`
+            column. Revision ids must be unique across articles, as they
+            are on Wikipedia.
+        hash_workers: The number of threads to hash wikitexts with. See
+            `hash_wikitexts`.
+        db_con: An optional open connection to the database used to cache
+            hashes. See `tidy_article_revisions`.
+
+    Returns:
+        A pandas.DataFrame of the tidied revisions of each article, in
+        order of the first appearance of each article, then by timestamp.
+
+    Raises:
+        IncompleteRevisionHistoryError: Any article had more than one
+            revision without a parent.
+        MissingRequiredColumnError: If revisions do not have a timestamp
+            or an article_slug column.
+    """
+    for col in ['timestamp', 'article_slug']:
+        if col not in revisions:
+            raise MissingRequiredColumnError('{} required'.format(col))
+
+    articles, article_slugs = pd.factorize(revisions.article_slug)
+
+    # Check that the revision history of each article is complete.
+    parent_articles = pd.Series(articles, index=revisions.rev_id.values) \
+        .reindex(revisions.parent_id.values).values
+    orphans = parent_articles != articles
+    num_orphans = np.bincount(articles[orphans], minlength=len(article_slugs))
+    if (num_orphans > 1).any():
+        raise IncompleteRevisionHistoryError(
+            ', '.join(article_slugs[num_orphans > 1])
+        )
+
+    # sort by article then timestamp, keeping ties in order
+    timestamps = pd.to_datetime(revisions.timestamp)
+    order = np.lexsort((timestamps.values, articles))
+
+    tidied, versions, parents, is_first = _tidy_sorted_revisions(
+        revisions, timestamps, order, articles[order], hash_workers, db_con
+    )
+    starts = np.flatnonzero(is_first)
+
+    # Trace the branches of all articles at once, from the parent of each
+    # head back to each root, in terms of versions across all articles.
+    first_rows = np.unique(versions, return_index=True)[1]
+    parent_index = np.full(len(first_rows), -1, dtype=np.int64)
+    parent_index[versions[first_rows]] = parents[first_rows]
+
+    heads = np.append(starts[1:], len(tidied)) - 1
+    frontier = parents[heads]
+    stops = versions[starts]
+    on_branch = np.zeros(len(parent_index), dtype=bool)
+    while len(frontier):
+        keep = frontier >= 0
+        keep[keep] = ~on_branch[frontier[keep]]
+        keep &= frontier != stops
+        frontier, stops = frontier[keep], stops[keep]
+        on_branch[frontier] = True
+        frontier = parent_index[frontier]
+
+    rev_types = np.full(len(tidied), 'reversion', dtype=object)
+    rev_types[on_branch[versions]] = 'branch'
+    rev_types[starts] = 'root'
+    rev_types[heads] = 'head'
+    tidied['rev_type'] = rev_types
+
+    return tidied
+
+
+def _tidy_sorted_revisions(revisions, timestamps, order, articles,
+                           hash_workers=None, db_con=None):
+    """Drop repeats, hash and label versions, in the order given.
+
+    These are the steps shared by `tidy_article_revisions` and
+    `tidy_many_article_revisions`. The revisions of each article must be
+    contiguous in the order, and in chronological order.
+
+    Args:
+        revisions: A pandas.DataFrame of revisions.
+        timestamps: The timestamps of the revisions, as datetimes.
+        order: The positions of the revisions in sorted order.
+        articles: The code of the article of each revision, in sorted
+            order.
+        hash_workers: The number of threads to hash wikitexts with.
+        db_con: An optional open connection to the database used to cache
+            hashes. See `tidy_article_revisions`.
+
+    Returns:
+        A tuple of the tidied revisions without their types, and for each
+        of them, its version numbered across all articles, the version of
+        its parent across all articles (-1 for roots), and whether it is
+        the first revision of its article.
+    """
+    rev_ids = revisions.rev_id.values[order]
+
+    # Find repeats by comparing subsequent wikitexts, or hashes if the
+    # wikitexts aren't available.
+    if 'wikitext' in revisions:
+        contents = clean_wikitexts(revisions.wikitext).values[order]
+    else:
+        contents = revisions.rev_sha1.values[order]
+    is_first = np.ones(len(order), dtype=bool)
+    is_first[1:] = articles[1:] != articles[:-1]
+    is_repeat = np.zeros(len(order), dtype=bool)
+    is_repeat[1:] = (contents[1:] == contents[:-1]) & ~is_first[1:]
+    logging.info('dropping {} repeat revisions'.format(is_repeat.sum()))
+
+    # the only copy of the table, and only of the rows being kept
+    tidied = revisions.take(order[~is_repeat])
+    tidied.reset_index(drop=True, inplace=True)
+    tidied['timestamp'] = timestamps.take(order[~is_repeat]).reset_index(
+        drop=True)
+    if 'wikitext' in tidied:
+        tidied['wikitext'] = contents[~is_repeat]
+    articles = articles[~is_repeat]
+    is_first = is_first[~is_repeat]
+
+    if db_con is not None:
+        cached = select_rev_hashes(tidied.rev_id, db_con)
+        if 'rev_sha1' in tidied:
+            cached = tidied.rev_sha1.combine_first(cached)
+        tidied['rev_sha1'] = cached
+
+    if 'rev_sha1' in tidied:
+        unhashed = tidied.rev_sha1.isnull()
+        if unhashed.any():
+            tidied.loc[unhashed, 'rev_sha1'] = hash_wikitexts(
+                tidied.wikitext[unhashed], workers=hash_workers
+            )
+    else:
+        tidied['rev_sha1'] = hash_wikitexts(tidied.wikitext,
+                                            workers=hash_workers)
+
+    # Number the versions of all articles together, in order of first
+    # appearance, then count from 0 within each article.
+    sha1s, _ = pd.factorize(tidied.rev_sha1)
+    num_sha1s = sha1s.max() + 1 if len(sha1s) else 1
+    versions, _ = pd.factorize(articles.astype(np.int64) * num_sha1s + sha1s)
+    starts = np.flatnonzero(is_first)
+    first_versions = versions[starts][np.cumsum(is_first) - 1]
+    tidied['rev_version'] = versions - first_versions
+
+    # Repeats share the labels of the revision before them. Map every
+    # rev_id, including those of repeats, to the row with its labels.
+    rows = pd.Series(np.cumsum(~is_repeat) - 1, index=rev_ids)
+
+    if db_con is not None:
+        with db_con:
+            insert_rev_hashes(pd.DataFrame({
+                'rev_id': rev_ids,
+                'rev_sha1': tidied.rev_sha1.values[rows.values],
+            }), db_con)
+
+    # parents must be revisions of the same article
+    parent_rows = rows.reindex(tidied.parent_id.values).values.astype(float)
+    has_parent = ~np.isnan(parent_rows)
+    has_parent[has_parent] = (
+        articles[parent_rows[has_parent].astype(np.int64)] ==
+        articles[has_parent]
+    )
+    parent_rows = parent_rows[has_parent].astype(np.int64)
+
+    parent_sha1s = np.full(len(tidied), nan, dtype=object)
+    parent_sha1s[has_parent] = tidied.rev_sha1.values[parent_rows]
+    tidied['parent_sha1'] = parent_sha1s
+
+    # as in label_revision_type, the root of each article has no parent
+    parents = np.full(len(tidied), -1, dtype=np.int64)
+    parents[has_parent] = versions[parent_rows]
+    parents[is_first] = -1
+
+    parent_versions = np.where(parents >= 0, parents - first_versions, nan)
+    tidied['parent_version'] = parent_versions
 
+    return tidied, versions, parents, is_first
 
-def label_version(revisions):
+
+def label_version(revisions, hash_workers=None):
     """Label the unique versions of an article.
 
     Revision histories must be complete in order to be labeled.
 
+    If revisions already have a `rev_sha1` column, e.g., from a previous
+    labeling, only the revisions missing a sha1 are hashed. Versions are
+    cheap to relabel from the hashes, so they are always recomputed.
+
     Args:
         revisions: A pandas.DataFrame of revisions to an article.
+        hash_workers: The number of threads to hash wikitexts with. See
+            `hash_wikitexts`.
 
     Returns:
         A copy of revisions with new columns that label the current version
@@ -275,42 +2148,224 @@ def label_version(revisions):
     if (~revisions.parent_id.isin(revisions.rev_id.values)).sum() > 1:
         raise IncompleteRevisionHistoryError()
 
-    # Efficiently create a mapping from id to wikitext to sha1.
-
     # ensure that revisions are in the correct order
     if 'timestamp' in revisions:
         revisions.sort_values(by='timestamp', ascending=True, inplace=True)
 
     # replace any missing wikitexts
-    revisions.wikitext.fillna('', inplace=True)
-    non_texts = revisions.wikitext.apply(lambda x: not isinstance(x, str))
-    revisions.loc[non_texts, 'wikitext'] = ''
-
-    # hashes are as unique as wikitexts, so only digest them once.
-    hashes = pd.DataFrame({'wikitext': revisions.wikitext.unique()})
-    hashes['sha1'] = hashes.wikitext.apply(_hash)
-    hashes['version'] = range(len(hashes))
+    revisions['wikitext'] = clean_wikitexts(revisions.wikitext)
+
+    if 'rev_sha1' in revisions:
+        unhashed = revisions.rev_sha1.isnull()
+        if unhashed.any():
+            revisions.loc[unhashed, 'rev_sha1'] = hash_wikitexts(
+                revisions.wikitext[unhashed], workers=hash_workers
+            )
+    else:
+        revisions['rev_sha1'] = hash_wikitexts(revisions.wikitext,
+                                               workers=hash_workers)
+    # versions are numbered in the order they first appear
+    revisions['rev_version'], _ = pd.factorize(revisions.rev_sha1)
+
     # use rev_ids because they are a superset of parent_ids
-    ids = revisions[['rev_id', 'wikitext']].rename(columns={'rev_id': 'id'})
-    # join sha1 column
-    versions = ids.merge(hashes).set_index('id')
+    versions = revisions.set_index('rev_id')[['rev_sha1', 'rev_version']]
+    parents = versions.reindex(revisions.parent_id.values)
+    revisions['parent_sha1'] = parents.rev_sha1.values
+    revisions['parent_version'] = parents.rev_version.values
+
+    return revisions
 
-    def get_revision_info(id_col, value_col):
-        return versions.reindex(revisions[id_col].values)[value_col].values
 
-    def get_shas(id_col):
-        return get_revision_info(id_col, value_col='sha1')
+def tidy_revision_pages(pages, history=None, db_con=None, db_lock=None):
+    """Tidy pages of revisions as they arrive from the Wikipedia API.
 
-    revisions['rev_sha1'] = get_shas('rev_id')
-    revisions['parent_sha1'] = get_shas('parent_id')
+    This is the streaming counterpart of `tidy_article_revisions`. Pages
+    must be given in chronological order (i.e., requested with
+    `rvdir='newer'`). Only the hashes and version labels of previous
+    revisions are carried from page to page, never their wikitexts.
 
-    def get_version_number(id_col):
-        return get_revision_info(id_col, value_col='version')
+    Revision types can't be determined until the head of the history is
+    known, so the `rev_type` column of each page is left empty. See
+    `relabel_revision_types`.
 
-    revisions['rev_version'] = get_version_number('rev_id')
-    revisions['parent_version'] = get_version_number('parent_id')
+    To continue a history that was tidied previously, provide the
+    metadata of the previous revisions as `history`. New revisions are
+    then labeled with the same versions as the revisions before them.
 
-    return revisions
+    Given a database, revisions that were hashed before, including
+    repeats, take their hashes from the rev_hashes table instead of being
+    hashed again. Repeats aren't yielded, so their hashes are saved here,
+    and the hashes of the other revisions are saved when they're appended.
+
+    Args:
+        pages: An iterable of pandas.DataFrames of revisions.
+        history: An optional pandas.DataFrame of previously tidied
+            revisions with columns `rev_id`, `rev_sha1` and `rev_version`,
+            in chronological order. If it also has columns `parent_id`,
+            `parent_sha1` and `parent_version`, new revisions can have
+            parents that were dropped from it as repeats.
+        db_con: An optional open connection to the database.
+        db_lock: An optional lock to hold while writing to the database.
+
+    Yields:
+        pandas.DataFrames of revisions with the same columns as returned
+        by `tidy_article_revisions`, with repeats removed.
+
+    Raises:
+        IncompleteRevisionHistoryError: There was more than one revision
+            without a parent.
+    """
+    db_lock = db_lock or threading.Lock()
+    versions = {}    # rev_sha1 -> rev_version
+    rev_labels = {}  # rev_id -> (rev_sha1, rev_version)
+    last_sha1 = None
+    num_orphans = 0
+
+    if history is not None and len(history) > 0:
+        for rev_sha1, rev_version in zip(history.rev_sha1, history.rev_version):
+            versions.setdefault(rev_sha1, int(rev_version))
+        if {'parent_id', 'parent_sha1', 'parent_version'}.issubset(history):
+            # Repeats aren't stored, but the labels of those that were
+            # parents are stored with their children.
+            parents = history.dropna(subset=['parent_id', 'parent_sha1'])
+            rev_labels.update(zip(parents.parent_id.astype(np.int64),
+                                  zip(parents.parent_sha1,
+                                      parents.parent_version)))
+        rev_labels.update(zip(history.rev_id,
+                              zip(history.rev_sha1, history.rev_version)))
+        last_sha1 = history.rev_sha1.iloc[-1]
+        # the root of the history has already been accounted for
+        num_orphans = 1
+
+    for revisions in pages:
+        if 'timestamp' in revisions:
+            revisions = convert_timestamp_to_datetime(revisions)
+
+        revisions['wikitext'] = clean_wikitexts(revisions.wikitext)
+        if db_con is not None:
+            rev_sha1s = select_rev_hashes(revisions.rev_id, db_con) \
+                .astype(object)
+            unhashed = rev_sha1s.isnull()
+            if unhashed.any():
+                rev_sha1s[unhashed] = hash_wikitexts(
+                    revisions.wikitext[unhashed])
+            revisions['rev_sha1'] = rev_sha1s
+        else:
+            revisions['rev_sha1'] = hash_wikitexts(revisions.wikitext)
+
+        for rev_sha1 in revisions.rev_sha1.unique():
+            if rev_sha1 not in versions:
+                versions[rev_sha1] = len(versions)
+        revisions['rev_version'] = revisions.rev_sha1.map(versions)
+
+        rev_labels.update(zip(revisions.rev_id,
+                              zip(revisions.rev_sha1, revisions.rev_version)))
+        parent_labels = [rev_labels.get(parent_id, (nan, nan))
+                         for parent_id in revisions.parent_id]
+        parent_sha1s, parent_versions = zip(*parent_labels)
+        revisions['parent_sha1'] = parent_sha1s
+        revisions['parent_version'] = parent_versions
+
+        num_orphans += revisions.parent_sha1.isnull().sum()
+        if num_orphans > 1:
+            raise IncompleteRevisionHistoryError()
+
+        previous_sha1s = revisions.rev_sha1.shift(1)
+        previous_sha1s.iloc[0] = last_sha1
+        is_repeat = revisions.rev_sha1 == previous_sha1s
+        last_sha1 = revisions.rev_sha1.iloc[-1]
+        if db_con is not None and is_repeat.any():
+            with db_lock, db_con:
+                insert_rev_hashes(revisions.loc[is_repeat], db_con)
+
+        logging.info('dropping {} repeat revisions'.format(is_repeat.sum()))
+        if not is_repeat.all():
+            yield revisions.loc[~is_repeat].assign(rev_type=None)
+
+
+def relabel_revision_types(article_slug, db_con):
+    """Label the types of an article's revisions stored in the database.
+
+    Only the metadata needed to trace the history is read, so the
+    wikitexts are never loaded, and only the revisions whose type has
+    changed are written back.
+
+    Args:
+        article_slug: The name of the Wikipedia article to relabel.
+        db_con: An open connection to the database.
+
+    Returns:
+        The number of revisions that were relabeled.
+    """
+    query = ("SELECT rev_id, rev_version, parent_version, "
+             "rev_type AS old_rev_type FROM revisions "
+             "WHERE article_slug=? ORDER BY timestamp, rev_id")
+    revisions = pd.read_sql_query(query, db_con, params=(article_slug, ))
+    revisions = label_revision_type(revisions)
+    relabeled = revisions.loc[revisions.rev_type != revisions.old_rev_type]
+
+    db_con.execute('CREATE TEMP TABLE IF NOT EXISTS rev_type_labels '
+                   '(rev_id INTEGER PRIMARY KEY, rev_type TEXT)')
+    db_con.execute('DELETE FROM rev_type_labels')
+    db_con.executemany(
+        'INSERT INTO rev_type_labels VALUES (?, ?)',
+        zip(relabeled.rev_id.astype(int).tolist(), relabeled.rev_type)
+    )
+    db_con.execute(
+        'UPDATE revisions SET rev_type = (SELECT rev_type FROM rev_type_labels '
+        'WHERE rev_type_labels.rev_id = revisions.rev_id) '
+        'WHERE rev_id IN (SELECT rev_id FROM rev_type_labels)'
+    )
+    db_con.commit()
+    return len(relabeled)
+
+
+def clean_wikitexts(wikitexts):
+    """Replace missing or non-string wikitexts with empty strings."""
+    return wikitexts.apply(lambda x: x if isinstance(x, str) else '')
+
+
+def hash_wikitexts(wikitexts, workers=None, use_processes=False):
+    """Compute the sha1 of each wikitext.
+
+    Wikitexts are often repeated in an article's history, so each unique
+    wikitext is only digested once. The unique wikitexts can be hashed
+    in batches by a pool of workers. hashlib releases the GIL while
+    digesting large buffers, so threads are usually enough; processes
+    avoid the GIL entirely at the cost of copying the wikitexts to them.
+
+    Args:
+        wikitexts: A pandas.Series of wikitexts.
+        workers: The number of workers to hash with. Defaults to
+            `HASH_WORKERS`. With a single worker, wikitexts are hashed
+            serially in the calling thread.
+        use_processes: Should the workers be processes instead of threads?
+
+    Returns:
+        A pandas.Series of hex digests aligned with wikitexts.
+    """
+    if workers is None:
+        workers = HASH_WORKERS
+
+    codes, uniques = pd.factorize(wikitexts)
+    uniques = list(uniques)
+
+    if workers > 1 and len(uniques) > 1:
+        batch_size = -(-len(uniques) // (workers * 4))
+        Executor = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        with Executor(max_workers=workers) as pool:
+            batches = pool.map(_hash_batch, _chunks(uniques, batch_size))
+            digests = [digest for batch in batches for digest in batch]
+    else:
+        digests = _hash_batch(uniques)
+
+    # missing wikitexts are coded as -1 and hash to a missing value
+    digests = np.array(digests + [nan], dtype=object)
+    return pd.Series(digests[codes], index=wikitexts.index)
+
+
+def _hash_batch(wikitexts):
+    return [_hash(wikitext) for wikitext in wikitexts]
 
 
 def _hash(wikitext):
@@ -322,6 +2377,222 @@ def _hash(wikitext):
     return hashlib.sha1(bytes(wikitext, 'utf-8')).hexdigest()
 
 
+def label_edits(revisions, db_con=None, workers=None, max_chars=None):
+    """Measure the edit made by each revision to its parent version.
+
+    Each edit is measured by the change in the size of the wikitext, the
+    number of characters inserted and deleted to make it (its edit
+    distance) and the similarity of the two wikitexts, from 0 to 1. Each
+    unique pair of versions is only measured once. Measurements are cached
+    in the database, so they're never repeated.
+
+    Edits are measured in the calling thread unless more workers are
+    asked for. Measuring is pure Python, so extra workers are processes,
+    sent batches through a pool that's started once and shared by all
+    calls. The pool spawns fresh interpreters rather than forking, so it's
+    safe to use from threaded servers.
+
+    Args:
+        revisions: A pandas.DataFrame of tidied revisions with columns
+            rev_sha1 and parent_sha1. Wikitexts are read from its wikitext
+            column if it has one, or else from the database.
+        db_con: An open connection to the database, to cache measurements
+            in. Required if revisions don't have wikitexts.
+        workers: The number of processes to measure with. Defaults to
+            `EDIT_WORKERS`. With a single worker, edits are measured
+            serially in the calling thread.
+        max_chars: The combined length of two wikitexts beyond which only
+            the size change between them is measured. Defaults to
+            `EDIT_MAX_CHARS`.
+
+    Returns:
+        A copy of revisions with columns size_change, edit_distance and
+        similarity, which are missing for roots and for revisions whose
+        wikitexts or their parent's couldn't be found.
+    """
+    if workers is None:
+        workers = EDIT_WORKERS
+    if max_chars is None:
+        max_chars = EDIT_MAX_CHARS
+
+    has_parent = revisions.parent_sha1.notnull() & revisions.rev_sha1.notnull()
+    pairs = revisions.loc[has_parent, ['parent_sha1', 'rev_sha1']] \
+        .drop_duplicates()
+
+    # versions that didn't change don't need to be measured
+    unchanged = pairs.parent_sha1 == pairs.rev_sha1
+    edits = [pairs.loc[unchanged].assign(size_change=0, edit_distance=0,
+                                         similarity=1.0)]
+    pairs = pairs.loc[~unchanged]
+
+    if db_con is not None and len(pairs):
+        edits.append(select_edits(pairs, db_con))
+        measured = pd.MultiIndex.from_frame(edits[-1][['parent_sha1',
+                                                       'rev_sha1']])
+        is_new = ~pd.MultiIndex.from_frame(pairs).isin(measured)
+        pairs = pairs.loc[is_new]
+
+    if len(pairs):
+        sha1s = pd.Series(pd.unique(pd.concat([pairs.parent_sha1,
+                                               pairs.rev_sha1])))
+        if 'wikitext' in revisions:
+            texts = revisions.drop_duplicates('rev_sha1') \
+                .set_index('rev_sha1').wikitext
+            wikitexts = sha1s.map(clean_wikitexts(texts))
+            if db_con is not None and wikitexts.isnull().any():
+                missing = wikitexts.isnull()
+                wikitexts[missing] = select_wikitexts(sha1s[missing], db_con)
+        elif db_con is not None:
+            wikitexts = select_wikitexts(sha1s, db_con)
+        else:
+            raise MissingRequiredColumnError('wikitext')
+
+        # edits to or from wikitexts that weren't found are left missing
+        # rather than measured against empty wikitexts and cached
+        found = set(sha1s[wikitexts.notnull()])
+        pairs = pairs.loc[pairs.parent_sha1.isin(found) &
+                          pairs.rev_sha1.isin(found)]
+        wikitexts = dict(zip(sha1s, wikitexts))
+
+    if len(pairs):
+        texts = [(wikitexts[parent_sha1], wikitexts[rev_sha1])
+                 for parent_sha1, rev_sha1 in zip(pairs.parent_sha1,
+                                                  pairs.rev_sha1)]
+        if workers > 1 and len(texts) > 1:
+            batch_size = -(-len(texts) // (workers * 4))
+            measure_batch = partial(_measure_batch, max_chars=max_chars)
+            batches = _get_edit_pool(workers).map(measure_batch,
+                                                  _chunks(texts, batch_size))
+            measurements = [edit for batch in batches for edit in batch]
+        else:
+            measurements = _measure_batch(texts, max_chars)
+
+        new_edits = pairs.reset_index(drop=True).join(pd.DataFrame(
+            measurements, columns=['size_change', 'edit_distance',
+                                   'similarity'],
+        ))
+        if db_con is not None:
+            with db_con:
+                insert_edits(new_edits, db_con)
+        edits.append(new_edits)
+
+    columns = ['parent_sha1', 'rev_sha1', 'size_change', 'edit_distance',
+               'similarity']
+    edits = pd.concat(edits, ignore_index=True)
+    edits = edits[columns].astype({col: float for col in columns[2:]})
+    labeled = revisions.drop([col for col in columns[2:] if col in revisions],
+                             axis=1)
+    labeled = labeled.merge(edits, how='left', on=['parent_sha1', 'rev_sha1'])
+    labeled.index = revisions.index
+    return labeled
+
+
+def measure_edit(parent, wikitext, max_chars=None):
+    """Measure the edit that turned one wikitext into another.
+
+    The wikitexts are compared a line at a time, and lines that were
+    replaced are compared a character at a time, so the edit distance
+    counts the characters inserted and deleted, as in an insertion and
+    deletion only Levenshtein distance.
+
+    Args:
+        parent: The wikitext before the edit.
+        wikitext: The wikitext after the edit.
+        max_chars: The combined length of the wikitexts beyond which the
+            edit distance isn't measured. Defaults to `EDIT_MAX_CHARS`.
+
+    Returns:
+        A tuple of the change in size, the edit distance, and the
+        similarity of the wikitexts, from 0 to 1. The edit distance and
+        similarity are nan if the wikitexts are too long.
+    """
+    if max_chars is None:
+        max_chars = EDIT_MAX_CHARS
+    size_change = len(wikitext) - len(parent)
+    total = len(parent) + len(wikitext)
+    if total > max_chars:
+        return size_change, nan, nan
+    if total == 0:
+        return size_change, 0, 1.0
+
+    parent_lines = parent.splitlines(True)
+    lines = wikitext.splitlines(True)
+    matcher = difflib.SequenceMatcher(None, parent_lines, lines)
+    distance = 0
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        deleted = ''.join(parent_lines[i1:i2])
+        inserted = ''.join(lines[j1:j2])
+        if tag == 'replace':
+            # count only the characters that changed within the lines
+            matched = sum(block.size for block in difflib.SequenceMatcher(
+                None, deleted, inserted, autojunk=False
+            ).get_matching_blocks())
+            distance += len(deleted) + len(inserted) - 2 * matched
+        else:
+            distance += len(deleted) + len(inserted)
+    return size_change, distance, 1 - distance / total
+
+
+_edit_pools = {}
+_edit_pools_lock = threading.Lock()
+
+
+def _get_edit_pool(workers):
+    with _edit_pools_lock:
+        if workers not in _edit_pools:
+            _edit_pools[workers] = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _edit_pools[workers]
+
+
+def _measure_batch(texts, max_chars):
+    return [measure_edit(parent, wikitext, max_chars)
+            for parent, wikitext in texts]
+
+
+def select_edits(pairs, db_con):
+    """Look up cached measurements of the edits between pairs of versions.
+
+    Args:
+        pairs: A pandas.DataFrame with columns parent_sha1 and rev_sha1.
+        db_con: An open connection to the database.
+
+    Returns:
+        A pandas.DataFrame of the measured edits, one per pair that's in
+        the cache. See `label_edits`.
+    """
+    rev_sha1s = pairs.rev_sha1.dropna().unique().tolist()
+    chunks = []
+    for chunk in _chunks(rev_sha1s, SQLITE_MAX_VARIABLES):
+        query = ('SELECT parent_sha1, rev_sha1, size_change, edit_distance, '
+                 'similarity FROM edits WHERE rev_sha1 IN ({})').format(
+                     ', '.join(['?'] * len(chunk)))
+        chunks.append(pd.read_sql_query(query, db_con, params=chunk))
+    if not chunks:
+        chunks.append(pd.read_sql_query(
+            'SELECT parent_sha1, rev_sha1, size_change, edit_distance, '
+            'similarity FROM edits WHERE 0', db_con,
+        ))
+    edits = pd.concat(chunks, ignore_index=True)
+    return edits.merge(pairs[['parent_sha1', 'rev_sha1']].drop_duplicates(),
+                       on=['parent_sha1', 'rev_sha1'])
+
+
+def insert_edits(edits, db_con):
+    """Cache measurements of edits made by `label_edits`."""
+    columns = ['parent_sha1', 'rev_sha1', 'size_change', 'edit_distance',
+               'similarity']
+    db_con.executemany(
+        'INSERT OR REPLACE INTO edits ({}) VALUES (?, ?, ?, ?, ?)'.format(
+            ', '.join(columns)
+        ), _to_records(edits[columns])
+    )
+
+
 def convert_timestamp_to_datetime(revisions):
     """Convert column of timestamps as strings to datetime objects.
 
@@ -353,35 +2624,101 @@ def drop_repeats(revisions):
     Raises:
         MissingRequiredColumnError: If revisions do not have a timestamp column.
     """
-    revisions = revisions.copy()
-
     if 'timestamp' not in revisions:
         raise MissingRequiredColumnError('timestamp required')
 
-    revisions.sort_values(by='timestamp', inplace=True)
+    revisions = revisions.sort_values(by='timestamp')
 
-    is_repeat = revisions.wikitext.iloc[1:] == revisions.wikitext.iloc[:-1]
-    revisions['is_repeat'] = is_repeat
-    revisions.fillna(False, inplace=True)
+    wikitexts = revisions.wikitext.values
+    is_repeat = np.zeros(len(revisions), dtype=bool)
+    is_repeat[1:] = wikitexts[1:] == wikitexts[:-1]
     logging.info('dropping {} repeat revisions'.format(is_repeat.sum()))
-    return revisions.ix[~revisions.is_repeat].drop('is_repeat', axis=1)
+    return revisions.loc[~is_repeat]
+
+
+def label_reversions(revisions):
+    """Label revisions that revert an article to an earlier version.
 
+    Versions are labeled in order, so a revision is a reversion if its
+    version appeared before. The edits undone by a reversion are the
+    revisions made since its version last appeared. Each revision is
+    compared with the previous appearance of its version in a single
+    grouped pass, so labeling is linear in the number of revisions.
 
-def drop_reversions(revisions):
+    Args:
+        revisions: A pandas.DataFrame of tidied revisions in chronological
+            order, with a `rev_version` column. Revisions of more than one
+            article are labeled separately by `article_slug`.
+
+    Returns:
+        A copy of revisions with the additional columns `is_reversion`,
+        `reverted_to_version`, the version restored by a reversion, and
+        `edits_undone`, the number of revisions a reversion undid.
+    """
+    keys = [revisions.rev_version.values]
+    positions = pd.Series(np.arange(len(revisions)))
+    if 'article_slug' in revisions:
+        keys.insert(0, revisions.article_slug.values)
+        # count positions within each article, which may be interleaved
+        positions = positions.groupby(revisions.article_slug.values) \
+            .cumcount()
+
+    previous = positions.groupby(keys).shift(1).values
+    is_reversion = ~np.isnan(previous)
+
+    edits_undone = np.zeros(len(revisions), dtype=np.int64)
+    edits_undone[is_reversion] = (positions.values[is_reversion] -
+                                  previous[is_reversion] - 1)
+
+    return revisions.assign(
+        is_reversion=is_reversion,
+        reverted_to_version=revisions.rev_version.where(is_reversion),
+        edits_undone=edits_undone,
+    )
+
+
+def drop_reversions(revisions, undone=False):
     """Drop revisions that revert the article to a previous state.
 
-    Reversions are repeats with intervening revisions.
+    Reversions are repeats with intervening revisions. See
+    `label_reversions`.
 
     Args:
-        revisions: A pandas.DataFrame of revisions to an article.
+        revisions: A pandas.DataFrame of tidied revisions in chronological
+            order. Reversions are labeled if they haven't been already.
+            Revisions of more than one article are handled separately by
+            `article_slug`.
+        undone: Should the revisions undone by each reversion be
+            dropped as well?
 
     Returns:
         A copy of revisions without reversions.
     """
-    is_reversion = (revisions.wikitext_version <
-                    revisions.wikitext_parent_version)
+    labeled = revisions
+    if 'is_reversion' not in labeled:
+        labeled = label_reversions(revisions)
+
+    is_reversion = labeled.is_reversion.values.astype(bool)
+    to_drop = is_reversion.copy()
+    if undone:
+        # make the revisions of each article contiguous, keeping their order
+        if 'article_slug' in labeled:
+            codes, _ = pd.factorize(labeled.article_slug)
+            order = np.argsort(codes, kind='mergesort')
+        else:
+            order = np.arange(len(labeled))
+        ordered = is_reversion[order]
+
+        # mark the span of revisions before each reversion that it undid
+        ends = np.flatnonzero(ordered)
+        starts = ends - labeled.edits_undone.values[order][ordered]
+        spans = np.zeros(len(labeled) + 1, dtype=np.int64)
+        np.add.at(spans, starts, 1)
+        np.add.at(spans, ends, -1)
+        to_drop[order] |= np.cumsum(spans)[:-1] > 0
+
     logging.info('dropping {} reversions'.format(is_reversion.sum()))
-    return revisions.ix[~is_reversion]
+    return revisions.loc[~to_drop]
 
 
 def label_revision_type(revisions):
@@ -392,12 +2729,18 @@ def label_revision_type(revisions):
     - root
     - branch
     - reversion
+    - head
+
+    Branches are the versions on the line of descent from the head back
+    to the root. The line of descent is traced iteratively through an
+    index of version parents, so the cost is linear in the number of
+    revisions regardless of how deep the history goes.
 
     Args:
         revisions (pandas.DataFrame): A table where each row is a revision.
 
     Returns:
-        A pandas.DataFrame with an additional column `revision_type`.
+        A pandas.DataFrame with an additional column `rev_type`.
     """
     # NB: Index needs to be fresh!
     revisions.reset_index(drop=True, inplace=True)
@@ -406,32 +2749,404 @@ def label_revision_type(revisions):
     revisions.loc[0, 'parent_version'] = nan
 
     # default rev type is reversion
-    rev_types = pd.Series('reversion', index=revisions.index)
+    rev_types = np.full(len(revisions), 'reversion', dtype=object)
 
-    # label the root and the head
-    root_ix = revisions.index[0]
-    head_ix = revisions.index[-1]
+    parent_index = build_parent_index(revisions.rev_version.values,
+                                      revisions.parent_version.values)
+    lineage = trace_lineage(parent_index,
+                            revisions.parent_version.iloc[-1],
+                            stop=revisions.rev_version.iloc[0])
+    rev_types[revisions.rev_version.isin(lineage).values] = 'branch'
 
-    rev_types[root_ix] = 'root'
-    rev_types[head_ix] = 'head'
+    # label the root and the head last so they can't be overwritten
+    rev_types[0] = 'root'
+    rev_types[-1] = 'head'
 
-    # recursively label branches starting at head
-    def label_parent_branch(rev_version):
-        parent_version = revisions.ix[revisions.rev_version == rev_version, 'parent_version']
-        parent_type = rev_types[parent_version.index].values
-        # If you haven't reached the root, change the rev type to branch
-        # and recurse on parent
-        if len(parent_type) > 0 and parent_type[0] != 'root':
-            rev_types[parent_version.index] = 'branch'
-            label_parent_branch(parent_version.values[0])
+    revisions['rev_type'] = rev_types
+    return revisions
 
-    label_parent_branch(revisions.loc[head_ix, 'parent_version'])
 
-    # relabel the head if needed
-    rev_types[head_ix] = 'head'
+def build_parent_index(rev_versions, parent_versions):
+    """Index the parent of each version of an article.
 
-    revisions['rev_type'] = rev_types
-    return revisions
+    A version can appear more than once in a revision history, e.g., when
+    an edit is reverted. The parent of a version is taken from its first
+    appearance.
+
+    Args:
+        rev_versions: An array of integer version labels, in order.
+        parent_versions: An array of the parent version of each revision.
+            Missing parents should be NaN.
+
+    Returns:
+        A numpy.ndarray where the value at position `v` is the parent
+        version of version `v`, or -1 if the version has no parent.
+    """
+    rev_versions = np.asarray(rev_versions, dtype=float)
+    parent_versions = np.asarray(parent_versions, dtype=float)
+
+    present = ~np.isnan(rev_versions)
+    if not present.any():
+        return np.empty(0, dtype=np.int64)
+
+    versions, first = np.unique(rev_versions[present], return_index=True)
+    parents = parent_versions[present][first]
+
+    parent_index = np.full(int(versions.max()) + 1, -1, dtype=np.int64)
+    parent_index[versions.astype(np.int64)] = np.where(
+        np.isnan(parents), -1, parents
+    ).astype(np.int64)
+    return parent_index
+
+
+def index_children(parent_index):
+    """Index the children of each version of an article.
+
+    Args:
+        parent_index: An array of the parent of each version, as made by
+            `build_parent_index`.
+
+    Returns:
+        A tuple of numpy.ndarrays (offsets, children). The children of
+        version `v` are `children[offsets[v]:offsets[v+1]]`, in order.
+    """
+    parent_index = np.asarray(parent_index, dtype=np.int64)
+    has_parent = np.flatnonzero(parent_index >= 0)
+    parents = parent_index[has_parent]
+    children = has_parent[np.argsort(parents, kind='mergesort')]
+    counts = np.bincount(parents, minlength=len(parent_index))
+    offsets = np.zeros(len(parent_index) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets, children
+
+
+def trace_lineage(parent_index, version, stop=None):
+    """Follow a version's line of descent back toward the root.
+
+    Args:
+        parent_index: An array of parent versions as returned by
+            `build_parent_index`.
+        version: The version to start tracing from. It is included in the
+            lineage.
+        stop: An optional version at which to stop. It is not included in
+            the lineage.
+
+    Returns:
+        A list of versions, from the starting version back to the root,
+        inclusive. If `stop` is given, the lineage ends just before it.
+    """
+    lineage = []
+    if pd.isnull(version):
+        return lineage
+
+    visited = np.zeros(len(parent_index), dtype=bool)
+    version = int(version)
+    stop = -1 if pd.isnull(stop) else int(stop)
+
+    while 0 <= version < len(parent_index) and version != stop:
+        # guard against cycles in malformed histories
+        if visited[version]:
+            break
+        visited[version] = True
+        lineage.append(version)
+        version = parent_index[version]
+
+    return lineage
+
+
+def save_version_graph(directory, revisions):
+    """Store the version graphs of many articles as flat arrays on disk.
+
+    The graph of every article is packed into a few arrays, each saved
+    as a .npy file, with the rows of each article contiguous and found
+    through offset arrays. Per revision, in order, the arrays hold the
+    version, parent version, revision type code (see `REV_TYPES`) and
+    timestamp. Per version, they hold its parent, its depth from the root,
+    and its children in CSR form (see `index_children`). Versions are
+    numbered within each article. Load the graph with `VersionGraph`.
+
+    Args:
+        directory: Where to save the graph. Any graph already saved there
+            is replaced.
+        revisions: A pandas.DataFrame of tidied revisions of one or more
+            articles, with columns article_slug, rev_version,
+            parent_version, rev_type and timestamp. Revisions are
+            sorted by article and timestamp. Revisions made at the same
+            time are kept in the order given.
+    """
+    article_codes, article_slugs = pd.factorize(revisions.article_slug,
+                                                sort=True)
+    timestamps = pd.to_datetime(revisions.timestamp.values) \
+        .values.astype('datetime64[s]')
+    # lexsort is stable, and sorts by the last key first
+    order = np.lexsort((timestamps, article_codes))
+    article_codes = article_codes[order]
+    rev_versions = revisions.rev_version.values[order].astype(np.int64)
+    parent_versions = revisions.parent_version.values[order].astype(float)
+
+    article_offsets = np.zeros(len(article_slugs) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(article_codes, minlength=len(article_slugs)),
+              out=article_offsets[1:])
+    num_versions = np.maximum.reduceat(rev_versions, article_offsets[:-1]) + 1
+    version_offsets = np.zeros(len(article_slugs) + 1, dtype=np.int64)
+    np.cumsum(num_versions, out=version_offsets[1:])
+
+    # parents are taken from the first appearance of each version, as in
+    # build_parent_index, but numbered across all articles
+    first_offsets = version_offsets[article_codes]
+    global_versions, first = np.unique(first_offsets + rev_versions,
+                                       return_index=True)
+    first_parents = parent_versions[first]
+    parents = np.full(version_offsets[-1], -1, dtype=np.int64)
+    parents[global_versions] = np.where(
+        np.isnan(first_parents), -1,
+        first_offsets[first] + np.nan_to_num(first_parents),
+    ).astype(np.int64)
+
+    child_offsets, children = index_children(parents)
+    depths = _measure_depths(parents, child_offsets, children)
+
+    # store versions relative to their article
+    version_articles = np.repeat(np.arange(len(article_slugs)), num_versions)
+    local_parents = np.where(parents >= 0,
+                             parents - version_offsets[version_articles], -1)
+    child_articles = version_articles[children]
+    local_children = children - version_offsets[child_articles]
+
+    rev_types = pd.Categorical(revisions.rev_type.values[order],
+                               categories=REV_TYPES).codes.astype(np.int8)
+    timestamps = timestamps[order]
+
+    arrays = {
+        'article_offsets': article_offsets,
+        'rev_versions': rev_versions.astype(np.int32),
+        'parent_versions': np.where(np.isnan(parent_versions), -1,
+                                    parent_versions).astype(np.int32),
+        'rev_types': rev_types,
+        'timestamps': timestamps,
+        'version_offsets': version_offsets,
+        'parents': local_parents.astype(np.int32),
+        'depths': depths,
+        'child_offsets': child_offsets,
+        'children': local_children.astype(np.int32),
+    }
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    for name, values in arrays.items():
+        np.save(os.path.join(directory, name + '.npy'), values)
+    with open(os.path.join(directory, 'article_slugs.json'), 'w') as f:
+        json.dump(list(article_slugs), f)
+
+
+def _measure_depths(parents, child_offsets, children):
+    """Measure the depth of each version below its root, a level at a time."""
+    depths = np.full(len(parents), -1, dtype=np.int32)
+    frontier = np.flatnonzero(parents < 0)
+    depth = 0
+    while len(frontier):
+        depths[frontier] = depth
+        starts = child_offsets[frontier]
+        counts = child_offsets[frontier + 1] - starts
+        positions = (np.repeat(starts - np.cumsum(counts) + counts, counts) +
+                     np.arange(counts.sum()))
+        frontier = children[positions]
+        # guard against cycles in malformed histories
+        frontier = frontier[depths[frontier] < 0]
+        depth += 1
+    return depths
+
+
+class VersionGraph(object):
+    """The version graphs of many articles, memory-mapped from disk.
+
+    Arrays saved by `save_version_graph` are mapped rather than read, so
+    opening a graph of a whole corpus is instant, and querying an article
+    only touches the pages that hold its rows. Queries return numpy arrays
+    and versions numbered within the article, as in `build_parent_index`.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'article_slugs.json')) as f:
+            self.article_slugs = json.load(f)
+        self._articles = {article_slug: i for i, article_slug
+                          in enumerate(self.article_slugs)}
+        for name in ['article_offsets', 'rev_versions', 'parent_versions',
+                     'rev_types', 'timestamps', 'version_offsets', 'parents',
+                     'depths', 'child_offsets', 'children']:
+            setattr(self, '_' + name, np.load(
+                os.path.join(directory, name + '.npy'), mmap_mode='r'
+            ))
+
+    def __len__(self):
+        return len(self.article_slugs)
+
+    def __contains__(self, article_slug):
+        return article_slug in self._articles
+
+    def _article(self, article_slug):
+        try:
+            return self._articles[article_slug]
+        except KeyError:
+            raise LookupError('no graph of article {}'.format(article_slug))
+
+    def _revision_range(self, article_slug):
+        i = self._article(article_slug)
+        return slice(self._article_offsets[i], self._article_offsets[i + 1])
+
+    def _version_range(self, article_slug):
+        i = self._article(article_slug)
+        return slice(self._version_offsets[i], self._version_offsets[i + 1])
+
+    def rev_versions(self, article_slug):
+        """The version of each revision of an article, in order."""
+        return self._rev_versions[self._revision_range(article_slug)]
+
+    def parent_versions(self, article_slug):
+        """The parent version of each revision, or -1 for none."""
+        return self._parent_versions[self._revision_range(article_slug)]
+
+    def rev_types(self, article_slug):
+        """The type of each revision of an article, as strings."""
+        codes = self._rev_types[self._revision_range(article_slug)]
+        return np.append(REV_TYPES, None).astype(object)[codes]
+
+    def timestamps(self, article_slug):
+        """The timestamp of each revision of an article."""
+        return self._timestamps[self._revision_range(article_slug)]
+
+    def parents(self, article_slug):
+        """The parent of each version, as made by `build_parent_index`."""
+        return self._parents[self._version_range(article_slug)]
+
+    def depths(self, article_slug):
+        """The number of ancestors of each version of an article."""
+        return self._depths[self._version_range(article_slug)]
+
+    def num_children(self, article_slug):
+        """The number of children of each version of an article."""
+        versions = self._version_range(article_slug)
+        return np.diff(self._child_offsets[versions.start:versions.stop + 1])
+
+    def children(self, article_slug, version):
+        """The children of a version of an article, in order."""
+        versions = self._version_range(article_slug)
+        v = versions.start + version
+        if not versions.start <= v < versions.stop:
+            raise LookupError('no version {} of {}'.format(version,
+                                                           article_slug))
+        return self._children[self._child_offsets[v]:
+                              self._child_offsets[v + 1]]
+
+    def head(self, article_slug):
+        """The version of the latest revision of an article."""
+        return int(self.rev_versions(article_slug)[-1])
+
+    def lineage(self, article_slug, version=None):
+        """Trace a version back to the root, by default from the head.
+
+        Returns:
+            A list of versions from `version` back to the root, inclusive.
+        """
+        if version is None:
+            version = self.head(article_slug)
+        # stepping through a memmap of int32s one element at a time is slow
+        parents = np.array(self.parents(article_slug), dtype=np.int64)
+        return trace_lineage(parents, version)
+
+
+def compact_revisions(revisions, hashes='categorical'):
+    """Store the hash and type columns of revisions compactly.
+
+    Each hash is a 40 character hex string stored as a Python object, and
+    most of them appear in a revision history at least twice, once as a
+    rev_sha1 and again as a parent_sha1. As categoricals, the rev_sha1 and
+    parent_sha1 columns share a single lookup table of unique hashes and
+    each row only holds an integer code. Categories are ordered by first
+    appearance, so for the revisions of a single article, the code of a
+    rev_sha1 is its rev_version. Across many articles, versions are
+    numbered within each article, so codes and versions differ. As binary,
+    each hash is stored as its 20 byte digest instead. The rev_type and
+    article_slug columns are made categorical either way.
+
+    Args:
+        revisions: A pandas.DataFrame of tidied revisions.
+        hashes: How to store the hashes, either 'categorical' or 'binary'.
+
+    Returns:
+        A copy of revisions with compact hash and type columns. See
+        `expand_revisions` for the inverse.
+    """
+    hash_columns = [col for col in ['rev_sha1', 'parent_sha1']
+                    if col in revisions]
+    compact = revisions.copy()
+
+    if hashes == 'categorical':
+        sha1s = pd.unique(np.concatenate(
+            [revisions[col].dropna().values for col in hash_columns]
+        )) if hash_columns else []
+        for col in hash_columns:
+            compact[col] = pd.Categorical(revisions[col], categories=sha1s)
+    elif hashes == 'binary':
+        for col in hash_columns:
+            compact[col] = revisions[col].map(
+                lambda sha1: sha1 if pd.isnull(sha1) else bytes.fromhex(sha1)
+            )
+    else:
+        raise ValueError('unknown hash format: {}'.format(hashes))
+
+    if 'rev_type' in revisions:
+        compact['rev_type'] = pd.Categorical(revisions.rev_type,
+                                             categories=REV_TYPES)
+    if 'article_slug' in revisions:
+        compact['article_slug'] = pd.Categorical(revisions.article_slug)
+
+    return compact
+
+
+def expand_revisions(revisions):
+    """Restore the hash and type columns of compact revisions to strings.
+
+    Args:
+        revisions: A pandas.DataFrame made by `compact_revisions`.
+
+    Returns:
+        A copy of revisions with hex string hashes and string rev types.
+    """
+    expanded = revisions.copy()
+    for col in ['rev_sha1', 'parent_sha1']:
+        if col in revisions:
+            expanded[col] = to_hex_digests(revisions[col])
+    for col in ['rev_type', 'article_slug']:
+        if col in revisions:
+            expanded[col] = np.asarray(revisions[col], dtype=object)
+    return expanded
+
+
+def to_hex_digests(hashes):
+    """Convert hashes stored in any format to hex strings.
+
+    Args:
+        hashes: A pandas.Series of hex strings, 20 byte digests, or a
+            categorical of either.
+
+    Returns:
+        A pandas.Series of hex strings, with missing hashes left as nan.
+    """
+    if hasattr(hashes, 'cat'):
+        # convert each unique hash once and look the rows up by code
+        categories = to_hex_digests(pd.Series(hashes.cat.categories)).values
+        codes = hashes.cat.codes.values
+        values = np.where(codes < 0, nan,
+                          categories.take(codes.clip(0), mode='clip')
+                          if len(categories) else nan)
+        return pd.Series(values.astype(object), index=hashes.index)
+
+    values = np.asarray(hashes, dtype=object).copy()
+    is_binary = np.array([isinstance(h, bytes) for h in values], dtype=bool)
+    if is_binary.any():
+        values[is_binary] = [h.hex() for h in values[is_binary]]
+    return pd.Series(values, index=hashes.index)
 
 
 class IncompleteRevisionHistoryError(Exception):
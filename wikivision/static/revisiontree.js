@@ -1,6 +1,7 @@
 function revisionTree() {
   var _chart = {},
-      _data;
+      _data,
+      _articleSlug;
 
   var margin = {top: 40, right: 120, bottom: 20, left: 120},
     width = 960 - margin.right - margin.left,
@@ -24,7 +25,7 @@ function revisionTree() {
     var i = 0;
 
     // Compute the new tree layout.
-    var nodes = tree.nodes(root).reverse(),
+    var nodes = tree.nodes(_data).reverse(),
         links = tree.links(nodes);
 
     // Normalize for fixed-depth.
@@ -38,7 +39,8 @@ function revisionTree() {
     var nodeEnter = node.enter().append("g")
       .attr("class", "node")
       .attr("transform", function(d) {
-        return "translate(" + d.x + "," + d.y + ")"; });
+        return "translate(" + d.x + "," + d.y + ")"; })
+      .on("click", expand);
 
     nodeEnter.append("circle")
       .attr("r", 10)
@@ -49,7 +51,7 @@ function revisionTree() {
         return d.children || d._children ? -18 : 18; })
       .attr("dy", ".35em")
       .attr("text-anchor", "middle")
-      .text(function(d) { return d.wikitext; })
+      .text(function(d) { return d.rev_sha1.slice(0, 4); })
       .style("fill-opacity", 1);
 
     // Declare the links
@@ -62,32 +64,66 @@ function revisionTree() {
       .attr("d", diagonal);
   };
 
+  // Fetch the children of a node that weren't included in its subtree.
+  function expand(d) {
+    var loaded = d.children ? d.children.length : 0;
+    if (loaded >= d.num_children) return;
+
+    fetchTree(_articleSlug, {root: d.rev_version, offset: loaded},
+              function(subtree) {
+      d.children = (d.children || []).concat(subtree.children || []);
+      _chart.render();
+    });
+  }
+
   _chart.data = function (data) {
     if (!arguments.length) return _data;
     _data = data;
     return _chart;
   }
 
+  _chart.articleSlug = function (articleSlug) {
+    if (!arguments.length) return _articleSlug;
+    _articleSlug = articleSlug;
+    return _chart;
+  }
+
   return _chart;
 }
 
 
-function nestNodeList(nodes) {
-  var nodeById = {};
-
-  // Index the nodes by id, in case they come out of order.
-  nodes.forEach(function(d) {
-    nodeById[d.wikitext_version] = d;
-  });
-
-  // Lazily compute children.
-  nodes.forEach(function(d) {
-    if ("wikitext_parent_version" in d) {
-      var parent = nodeById[d.wikitext_parent_version];
-      if (parent.children) parent.children.push(d);
-      else parent.children = [d];
+// Request a subtree of the versions of an article, already nested.
+// Articles that aren't cached yet are fetched in the background, so
+// wait for the job fetching the article before requesting the tree again.
+function fetchTree(articleSlug, params, callback) {
+  var query = Object.keys(params).map(function(key) {
+    return key + "=" + encodeURIComponent(params[key]);
+  }).join("&");
+  var url = "/api/tree/" + encodeURIComponent(articleSlug) + "?" + query;
+
+  d3.json(url, function(error, data) {
+    if (error) return console.warn(error);
+    if ("job" in data) {
+      waitForJob(data.job, function() {
+        fetchTree(articleSlug, params, callback);
+      });
+    } else {
+      callback(data.tree);
     }
   });
+}
+
+
+function waitForJob(job, callback) {
+  if (job.status == "done") return callback();
+  if (job.status == "failed") return console.warn(job.error);
 
-  return nodes[0];
+  console.log("fetched " + job.revisions + " revisions in " +
+              job.pages + " pages");
+  setTimeout(function() {
+    d3.json(job.status_url, function(error, data) {
+      if (error) return console.warn(error);
+      waitForJob(data.job, callback);
+    });
+  }, 1000);
 }
@@ -1,14 +1,50 @@
+import glob
+import hashlib
+import os
+import re
+import tempfile
+
 import graphviz
+import numpy as np
 import pandas as pd
 
 import wikivision
 
 
-def graph_article_revisions(article_slug, highlight=False, labels=False):
-    """Create a Digraph from a Wikipedia article's revision history."""
-    revisions = wikivision.get_article_revisions(article_slug)
+# Identifiers that don't need to be quoted in DOT.
+DOT_ID = r'^(?:[a-zA-Z_][a-zA-Z0-9_]*|-?(?:\.[0-9]+|[0-9]+(?:\.[0-9]*)?))$'
+DOT_HTML_STRING = r'^<.*>$'
+DOT_KEYWORDS = ['node', 'edge', 'graph', 'digraph', 'subgraph', 'strict']
+DOT_UNESCAPED_QUOTE = re.compile(r'(?<!\\)"')
+
+# Where rendered graphs are cached, and how much space they can take up.
+RENDER_CACHE_DIR = 'renders'
+RENDER_CACHE_MAX_BYTES = 100 * 2**20
+
+# Levels of a version tree that are nested at a time, and the most allowed.
+TREE_DEPTH = 10
+TREE_MAX_DEPTH = 200
+
+
+def graph_article_revisions(article_slug, highlight=False, labels=False,
+                            db_con=None, edits=False):
+    """Create a Digraph from a Wikipedia article's revision history.
+
+    Only the metadata of the revisions is loaded, never the wikitexts, and
+    it is kept in compact form while graphing. If edges are weighted by
+    edits, the edits are measured with `wikivision.label_edits`, which
+    only reads wikitexts for edits that haven't been measured before.
+    """
+    revisions = wikivision.get_article_revisions(
+        article_slug, db_con=db_con,
+        columns=['rev_sha1', 'parent_sha1', 'rev_type'],
+    )
+    if edits:
+        revisions = wikivision.label_edits(revisions,
+                                           db_con=db_con or wikivision.get_db())
+    revisions = wikivision.compact_revisions(revisions)
 
-    edges = revisions[['parent_sha1', 'rev_sha1']].iloc[1:]
+    edges = format_edges(revisions.iloc[1:], edits=edits)
     nodes = format_nodes(revisions, highlight=highlight)
 
     remove_labels = not labels
@@ -18,12 +54,169 @@ def graph_article_revisions(article_slug, highlight=False, labels=False):
     return graph(edges, nodes, remove_labels=remove_labels)
 
 
+def render_article_revisions(article_slug, format='svg', highlight=False,
+                             labels=False, db_con=None, cache=None,
+                             edits=False):
+    """Render the graph of an article's revision history, if not cached.
+
+    Rendered graphs are cached by the article's head revision, so they
+    are only graphed and laid out again when the article has a new head
+    revision. Looking up the head revision doesn't load the history. The
+    DOT source of each graph is cached too, so rendering the same graph
+    in another format only lays it out again.
+
+    Args:
+        article_slug: The name of the Wikipedia article.
+        format: The output format, e.g., 'svg' or 'png', or 'gv' for the
+            DOT source.
+        highlight: Passed on to `graph_article_revisions`.
+        labels: Passed on to `graph_article_revisions`.
+        db_con: An open connection to the database. If not specified,
+            this thread's connection to the default db is used.
+        cache: A RenderCache. Defaults to one in `RENDER_CACHE_DIR`.
+        edits: Passed on to `graph_article_revisions`.
+
+    Returns:
+        The path to the rendered graph.
+    """
+    if not db_con:
+        db_con = wikivision.get_db()
+
+    if cache is None:
+        cache = RenderCache()
+
+    try:
+        head_rev_id = wikivision.select_head_rev_id(article_slug, db_con)
+    except LookupError:
+        wikivision.fetch_article_revisions(article_slug, db_con)
+        head_rev_id = wikivision.select_head_rev_id(article_slug, db_con)
+
+    key = cache.key(article_slug, head_rev_id, highlight=highlight,
+                    labels=labels, edits=edits)
+    path = cache.get(key, format)
+    if path is None:
+        source_path = cache.get(key, 'gv')
+        if source_path is not None:
+            with open(source_path) as f:
+                g = graphviz.Source(f.read())
+        else:
+            g = graph_article_revisions(article_slug, highlight=highlight,
+                                        labels=labels, db_con=db_con,
+                                        edits=edits)
+        path = cache.put(key, g, format)
+    return path
+
+
+class RenderCache(object):
+    """An on-disk cache of rendered graphs, bounded in size.
+
+    Each entry is a file named for the article and the options used to
+    graph it, followed by the rev_id of the head revision of the article,
+    with the output format as its extension. The DOT source of every graph
+    is stored alongside it with the extension gv. When the cache grows
+    larger than `max_bytes`, the least recently used files are removed.
+    Storing a graph of a new head revision removes those of the old head.
+    """
+
+    def __init__(self, directory=RENDER_CACHE_DIR,
+                 max_bytes=RENDER_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @staticmethod
+    def key(article_slug, head_rev_id, **options):
+        """Make a key for a graph of an article at a head revision."""
+        graph = hashlib.sha1('{} {}'.format(
+            article_slug, sorted(options.items())
+        ).encode('utf-8')).hexdigest()
+        return '{}_{}'.format(graph[:16], head_rev_id)
+
+    def path(self, key, format):
+        return os.path.join(self.directory, '{}.{}'.format(key, format))
+
+    def get(self, key, format):
+        """Return the path to a cached graph, or None if it's not cached."""
+        path = self.path(key, format)
+        try:
+            # mark as recently used
+            os.utime(path, None)
+        except OSError:
+            return None
+        return path
+
+    def put(self, key, g, format):
+        """Render a graph and store it in the cache.
+
+        Args:
+            key: A key made by `RenderCache.key`.
+            g: A graphviz.Digraph or graphviz.Source.
+            format: The output format, or 'gv' for the DOT source.
+
+        Returns:
+            The path to the rendered graph.
+        """
+        self._write(key, 'gv', g.source.encode('utf-8'))
+        if format != 'gv':
+            self._write(key, format, g.pipe(format=format))
+        path = self.path(key, format)
+
+        self.invalidate(key)
+        self.evict()
+        return path
+
+    def _write(self, key, format, data):
+        # write to a temporary file first so readers never see partial files
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self.path(key, format))
+
+    def invalidate(self, key):
+        """Remove graphs of the same article made from other head revisions."""
+        graph = key.split('_')[0]
+        pattern = os.path.join(self.directory, '{}_*.*'.format(graph))
+        for path in glob.glob(pattern):
+            if not os.path.basename(path).startswith(key + '.'):
+                _remove(path)
+
+    def evict(self):
+        """Remove the least recently used graphs until the cache fits."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            _remove(path)
+            total -= size
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        # another process already removed it
+        pass
+
+
 def graph(edges, nodes=None, remove_labels=False):
     """Create a simple revision history Digraph from a pandas DataFrame.
 
     Args:
         edges: A DataFrame with two columns, the first is the **from** column
-            and the second is the **to** column.
+            and the second is the **to** column. Hashes can be compact, in
+            which case nodes are named as in `format_nodes`.
         nodes: A DataFrame with columns for node attributes. If not provided,
             nodes are inferred from edges.
         remove_labels: Should the labels be removed from the nodes? Useful
@@ -31,32 +224,113 @@ def graph(edges, nodes=None, remove_labels=False):
             long hashes, in which case the labels are probably not needed.
     """
     g = graphviz.Digraph(graph_attr={'rankdir': 'LR'})
+    g.body.extend(format_dot_body(edges, nodes, remove_labels=remove_labels))
+    return g
+
+
+def format_dot_body(edges, nodes=None, remove_labels=False):
+    """Format the node and edge statements of a graph in bulk.
+
+    Statements are built a column at a time instead of a node at a time,
+    and are the same as those made by calling `graphviz.Digraph.node` for
+    each node and `graphviz.Digraph.edge` for each edge, except that node
+    names in edges are never split into ports.
+
+    Args:
+        edges: A DataFrame of edges. See `graph`.
+        nodes: A DataFrame of nodes, with a 'name' column and a column for
+            each attribute. If not provided, nodes are inferred from edges.
+        remove_labels: Should the labels be removed from the nodes?
+
+    Returns:
+        A list of lines for the body of a graphviz.Digraph.
+    """
+    from_nodes = node_names(edges.iloc[:, 0])
+    to_nodes = node_names(edges.iloc[:, 1])
 
     if nodes is None:
-        labels = set(edges.iloc[:, 0]).union(set(edges.iloc[:, 1]))
-        nodes = pd.DataFrame({'name': list(labels), 'label': list(labels)})
+        names = pd.unique(np.concatenate([from_nodes.values, to_nodes.values]))
+        nodes = pd.DataFrame({'name': names, 'label': names})
 
-    node_data = nodes.to_dict('index')
-    for _, attrs in node_data.items():
-        if remove_labels:
-            attrs['label'] = ''
-        g.node(**attrs)
+    node_lines = '\t' + quote_ids(nodes.name)
+    attr_lists = format_attr_lists(nodes.drop('name', axis=1),
+                                   remove_labels=remove_labels)
+    if attr_lists is not None:
+        node_lines = node_lines + ' [' + attr_lists + ']'
+    node_lines = node_lines + '\n'
 
-    # add the edges
-    g.edges([(from_node, to_node) for _, (from_node, to_node) in edges.iterrows()])
+    edge_lines = ('\t' + quote_ids(from_nodes).values + ' -> ' +
+                  quote_ids(to_nodes).values)
+    attr_lists = format_attr_lists(edges.iloc[:, 2:])
+    if attr_lists is not None:
+        edge_lines = edge_lines + ' [' + attr_lists.values + ']'
+    edge_lines = edge_lines + '\n'
+
+    return node_lines.tolist() + edge_lines.tolist()
+
+
+def format_attr_lists(attrs, remove_labels=False):
+    """Format a column of attributes at a time into DOT attribute lists.
+
+    The label goes first, then the rest of the attributes in sorted order,
+    as in `graphviz.Digraph`.
+
+    Args:
+        attrs: A DataFrame with a column for each attribute.
+        remove_labels: Should the labels be left empty?
+
+    Returns:
+        A pandas.Series of attribute lists, or None if there aren't any
+        attributes.
+    """
+    names = sorted(col for col in attrs if col != 'label')
+    if 'label' in attrs:
+        names.insert(0, 'label')
+
+    attr_lists = None
+    for name in names:
+        if name == 'label' and remove_labels:
+            values = pd.Series('""', index=attrs.index)
+        else:
+            values = quote_ids(attrs[name])
+        values = quote_ids(pd.Series([name]))[0] + '=' + values
+        attr_lists = values if attr_lists is None else attr_lists + ' ' + values
+    return attr_lists
 
-    return g
+
+def quote_ids(ids):
+    """Quote values for DOT where needed, like `graphviz.Digraph` does.
+
+    Args:
+        ids: A pandas.Series of node names or attribute values.
+
+    Returns:
+        A pandas.Series of DOT identifiers.
+    """
+    ids = ids.astype(str)
+    bare = ((ids.str.contains(DOT_ID) & ~ids.str.lower().isin(DOT_KEYWORDS)) |
+            ids.str.contains(DOT_HTML_STRING))
+    quoted = ids[~bare].map(
+        lambda id_: '"' + DOT_UNESCAPED_QUOTE.sub(r'\\"', id_) + '"'
+    )
+    return ids.where(bare, quoted)
 
 
 def format_nodes(revisions, highlight=False):
-    """Reduce revisions to unique nodes and attributes."""
+    """Reduce revisions to unique nodes and attributes.
+
+    Revisions can be compact (see `wikivision.compact_revisions`). Nodes
+    for categorical hashes are named by their integer codes, which are
+    shorter than the hashes, and labeled with the hashes themselves.
+    """
     # Select unique nodes based on rev_sha1, and keep the first rev_type
     nodes = revisions[['rev_sha1', 'rev_type']].drop_duplicates(
         subset='rev_sha1', keep='first'
     )
 
-    nodes.rename(columns={'rev_sha1': 'name'}, inplace=True)
-    nodes['label'] = nodes.name
+    nodes['label'] = wikivision.to_hex_digests(nodes.rev_sha1)
+    nodes['name'] = node_names(nodes.rev_sha1)
+    nodes.drop('rev_sha1', axis=1, inplace=True)
 
     if highlight:
         rev_type_color = dict(reversion='#D3D3D3',
@@ -66,13 +340,118 @@ def format_nodes(revisions, highlight=False):
                               head='#fc8d62')
 
         nodes['style'] = 'filled'
-        nodes['color'] = nodes.rev_type.apply(lambda x: rev_type_color[x])
+        nodes['color'] = nodes.rev_type.map(rev_type_color).astype(object)
 
     nodes.drop('rev_type', axis=1, inplace=True)
 
     return nodes
 
 
+def format_edges(revisions, edits=False):
+    """Connect each revision to its parent, naming nodes like format_nodes.
+
+    With edits, each edge is drawn wider the more characters its revision
+    changed, on a log scale, using the edit_distance column made by
+    `wikivision.label_edits`. Edges of unmeasured edits are drawn thin.
+    """
+    edges = pd.DataFrame({
+        'parent_sha1': node_names(revisions.parent_sha1),
+        'rev_sha1': node_names(revisions.rev_sha1),
+    }, index=revisions.index)[['parent_sha1', 'rev_sha1']]
+
+    if edits:
+        widths = 1 + np.log10(1 + revisions.edit_distance.fillna(0))
+        edges['penwidth'] = widths.round(2).astype(str)
+
+    return edges
+
+
+def node_names(hashes):
+    """Name the nodes for hashes stored as strings, bytes or categoricals."""
+    if hasattr(hashes, 'cat'):
+        codes = hashes.cat.codes
+        return codes.astype(str).where(codes >= 0)
+    return wikivision.to_hex_digests(hashes)
+
+
+def nest_versions(revisions, root=None, depth=TREE_DEPTH, offset=0,
+                  limit=None):
+    """Nest the versions of an article into a tree, a subtree at a time.
+
+    Each version of the article is a node in the tree, and the version it
+    was first made from is its parent. Only the subtree below `root` is
+    nested, down to `depth` levels. Nodes with children that weren't
+    nested can be expanded later by nesting again from them.
+
+    Args:
+        revisions: A pandas.DataFrame of tidied revisions with columns
+            rev_version and parent_version. Other columns are taken from
+            the first revision of each version as attributes of its node.
+        root: The version at the root of the subtree. Defaults to the
+            first version.
+        depth: The number of levels of descendants to nest.
+        offset: The number of children of the root to skip.
+        limit: The most children of a node to nest. Defaults to all.
+
+    Returns:
+        The root node, a dict with attributes of the version, its
+        `num_children`, and its nested `children`, if any.
+
+    Raises:
+        KeyError: If root isn't a version of the article.
+    """
+    parent_index = wikivision.build_parent_index(revisions.rev_version,
+                                                 revisions.parent_version)
+    offsets, children = wikivision.index_children(parent_index)
+
+    versions = revisions.drop_duplicates(subset='rev_version', keep='first')
+    versions = versions.set_index('rev_version', drop=False)
+    versions = versions.drop('parent_version', axis=1)
+
+    if root is None:
+        root = versions.index[0]
+    if root not in versions.index:
+        raise KeyError('no version {}'.format(root))
+
+    def make_node(version):
+        node = {name: _to_json_value(value)
+                for name, value in versions.loc[version].items()}
+        node['rev_version'] = int(version)
+        node['num_children'] = int(offsets[version + 1] - offsets[version])
+        return node
+
+    # nest a level at a time to avoid recursion for deep trees
+    tree = make_node(root)
+    level = [(tree, root, offset)]
+    for _ in range(depth):
+        next_level = []
+        for node, version, skip in level:
+            start = offsets[version] + skip
+            stop = offsets[version + 1]
+            if limit is not None:
+                stop = min(stop, start + limit)
+            if start >= stop:
+                continue
+            node['children'] = []
+            for child in children[start:stop]:
+                child_node = make_node(child)
+                node['children'].append(child_node)
+                next_level.append((child_node, child, 0))
+        level = next_level
+
+    return tree
+
+
+def _to_json_value(value):
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+
 def tree_format(revisions):
     """Convert a complete revision history to a tree format.
 
@@ -87,7 +466,7 @@ def tree_format(revisions):
 
     # remove parent info from root node
     root = nodes[0]
-    root.pop('wikitext_parent_version')
+    root.pop('wikitext_parent_version', None)
     nodes[0] = root
 
     return nodes